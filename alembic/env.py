@@ -1,41 +1,108 @@
 import sys
 import os
+import io
+import logging
 from logging.config import fileConfig
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from alembic import context
+from alembic.runtime.migration import MigrationContext
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app.models import *
 from app.database import DATABASE_URL  
+from app.migracoes import em_dry_run, iniciar_dry_run, registrar_revisao, resumir_dry_run
+from app.particoes import eh_particao
 
 config = context.config
 if config.config_file_name:
-    fileConfig(config.config_file_name)
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+    # O logger da aplicação (usado por app.migracoes) já tem console e arquivo próprios.
+    logging.getLogger("MyBooks").propagate = False
 
 target_metadata = SQLModel.metadata
 
-sync_engine = create_engine(DATABASE_URL.replace("postgresql+asyncpg", "postgresql"), echo=True)
+# Migrações rodam com o driver síncrono do mesmo banco (Postgres ou SQLite embutido).
+SYNC_DATABASE_URL = DATABASE_URL.replace("postgresql+asyncpg", "postgresql").replace("sqlite+aiosqlite", "sqlite")
+EH_SQLITE = SYNC_DATABASE_URL.startswith("sqlite")
+
+sync_engine = create_engine(SYNC_DATABASE_URL, echo=True)
+
+
+def incluir_objeto(objeto, nome, tipo, refletido, comparado_com):
+    # Partições de pedido/pagamento e os índices delas vêm do banco, não dos modelos.
+    tabela = objeto if tipo == "table" else getattr(objeto, "table", None)
+    return tabela is None or not eh_particao(tabela.name)
+
+
+def banco_sqlite_novo(connection) -> bool:
+    return EH_SQLITE and not inspect(connection).get_table_names()
+
 
 def run_migrations_offline():
     context.configure(
-        url=DATABASE_URL,
+        url=SYNC_DATABASE_URL,
         target_metadata=target_metadata,
+        render_as_batch=EH_SQLITE,
+        include_object=incluir_objeto,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
     with context.begin_transaction():
         context.run_migrations()
 
+def run_migrations_dry_run(connection):
+    # Nada é executado no banco alvo: as revisões rodam como no --sql, com o SQL gravado
+    # num buffer e estimado pelo tamanho das tabelas que toca (app.migracoes), e a conexão
+    # só lê o catálogo, numa transação somente leitura.
+    saida = io.StringIO()
+    if not EH_SQLITE:
+        connection.execute(text("SET TRANSACTION READ ONLY"))
+    heads = MigrationContext.configure(connection).get_current_heads()
+    context.configure(
+        connection=connection,
+        as_sql=True,
+        output_buffer=saida,
+        starting_rev=heads or None,
+        target_metadata=target_metadata,
+        include_object=incluir_objeto,
+        transaction_per_migration=True,
+        on_version_apply=registrar_revisao,
+    )
+    # Revisões que precisam ler o catálogo para gerar o SQL (partições) a pegam daqui.
+    config.attributes["conexao_catalogo"] = connection
+    try:
+        iniciar_dry_run(connection, saida)
+        context.run_migrations()
+    finally:
+        connection.rollback()
+    resumir_dry_run()
+
+
 def run_migrations_online():
     connectable = sync_engine
     with connectable.connect() as connection:
+        if em_dry_run():
+            run_migrations_dry_run(connection)
+            return
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
+            # SQLite não tem ALTER TABLE completo: alterações viram cópia da tabela.
+            render_as_batch=EH_SQLITE,
+            include_object=incluir_objeto,
+            # Uma transação por revisão: os helpers de app.migracoes confirmam o que veio antes.
+            transaction_per_migration=True,
         )
-        with context.begin_transaction():
-            context.run_migrations()
+        if banco_sqlite_novo(connection) and context.get_revision_argument() in context.script.get_heads():
+            # As primeiras revisões usam ALTERs que o SQLite não tem: um arquivo novo recebe o
+            # schema dos modelos e é marcado na head. Daí em diante as revisões rodam nele.
+            target_metadata.create_all(connection)
+            context.get_context().stamp(context.script, "heads")
+            connection.commit()
+        else:
+            with context.begin_transaction():
+                context.run_migrations()
 
 if context.is_offline_mode():
     run_migrations_offline()
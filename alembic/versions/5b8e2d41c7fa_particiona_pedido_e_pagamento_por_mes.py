@@ -0,0 +1,377 @@
+"""particiona pedido e pagamento por mês
+
+Revision ID: 5b8e2d41c7fa
+Revises: 'a3f1c9e27b40'
+Create Date: 2026-10-18 11:47:05.813960
+
+"""
+import logging
+import os
+import random
+import time
+from datetime import date
+from alembic import context, op
+import sqlalchemy as sa
+
+
+revision = '5b8e2d41c7fa'
+down_revision = 'a3f1c9e27b40'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("MyBooks")
+
+MESES_FUTUROS = 3
+
+COLUNAS = {
+    'pedido': (
+        "id integer NOT NULL DEFAULT nextval('pedido_id_seq'::regclass), "
+        "usuario_id integer REFERENCES usuario (id), "
+        "data_pedido date NOT NULL, "
+        "status varchar NOT NULL, "
+        "valor_total double precision NOT NULL"
+    ),
+    'pagamento': (
+        "id integer NOT NULL DEFAULT nextval('pagamento_id_seq'::regclass), "
+        "pedido_id integer, "
+        "data_pagamento date NOT NULL, "
+        "valor double precision NOT NULL, "
+        "forma_pagamento varchar NOT NULL"
+    ),
+}
+NOMES_COLUNAS = {
+    'pedido': "id, usuario_id, data_pedido, status, valor_total",
+    'pagamento': "id, pedido_id, data_pagamento, valor, forma_pagamento",
+}
+CHAVE_PARTICAO = {'pedido': 'data_pedido', 'pagamento': 'data_pagamento'}
+RESTRICOES_PARTICIONADA = {
+    'pedido': "",
+    'pagamento': ", UNIQUE (pedido_id, data_pagamento)",
+}
+RESTRICOES_COMUM = {
+    'pedido': "",
+    'pagamento': ", UNIQUE (pedido_id)",
+}
+# Constraints que a tabela nova recebe com o nome provisório ({tabela}_nova_...) e que
+# voltam ao nome de sempre na troca (as com índice precisam de nome único no schema).
+RENOMEAR_PARTICIONADA = {'pedido': ['pkey', 'usuario_id_fkey'], 'pagamento': ['pkey', 'pedido_id_data_pagamento_key']}
+RENOMEAR_COMUM = {'pedido': ['pkey', 'usuario_id_fkey'], 'pagamento': ['pkey', 'pedido_id_key']}
+
+# Em tabela particionada toda PK/UNIQUE inclui a chave de partição: nenhuma FK aponta
+# para pedido.id e pagamento perde UNIQUE(pedido_id). As duas regras continuam no banco,
+# por triggers que fazem o que a FK fazia (PERFORM ... FOR KEY SHARE na linha do pedido,
+# como o próprio Postgres faz): o filho só entra com o pedido existente e travado, e o
+# pedido só sai sem filhos. No pagamento a trava é FOR UPDATE, o que enfileira os
+# pagamentos do mesmo pedido e deixa o seguinte ver o anterior; pagamento na mesma data
+# cai na UNIQUE (pedido_id, data_pagamento), que o upsert do lote usa.
+INTEGRIDADE = [
+    """CREATE OR REPLACE FUNCTION pedido_referenciado_existe() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.pedido_id IS NULL OR (TG_OP = 'UPDATE' AND NEW.pedido_id IS NOT DISTINCT FROM OLD.pedido_id) THEN
+        RETURN NEW;
+    END IF;
+    PERFORM 1 FROM pedido WHERE id = NEW.pedido_id FOR KEY SHARE;
+    IF NOT FOUND THEN
+        RAISE foreign_key_violation USING MESSAGE = format('%s.pedido_id = %s: pedido inexistente', TG_TABLE_NAME, NEW.pedido_id);
+    END IF;
+    RETURN NEW;
+END $$""",
+    """CREATE OR REPLACE FUNCTION pagamento_unico_por_pedido() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.pedido_id IS NULL OR (TG_OP = 'UPDATE' AND NEW.pedido_id IS NOT DISTINCT FROM OLD.pedido_id) THEN
+        RETURN NEW;
+    END IF;
+    PERFORM 1 FROM pedido WHERE id = NEW.pedido_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE foreign_key_violation USING MESSAGE = format('pagamento.pedido_id = %s: pedido inexistente', NEW.pedido_id);
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM pagamento
+        WHERE pedido_id = NEW.pedido_id AND id <> NEW.id AND data_pagamento <> NEW.data_pagamento
+    ) THEN
+        RAISE unique_violation USING MESSAGE = format('pedido %s já tem pagamento', NEW.pedido_id);
+    END IF;
+    RETURN NEW;
+END $$""",
+    # Na checagem adiada (commit) um pedido que só mudou de partição, por UPDATE de
+    # data_pedido ou pela manutenção de partições, já está de volta em pedido.
+    """CREATE OR REPLACE FUNCTION pedido_sem_dependentes() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pedido WHERE id = OLD.id) THEN
+        RETURN NULL;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pagamento WHERE pedido_id = OLD.id)
+        OR EXISTS (SELECT 1 FROM pedidolivrolink WHERE pedido_id = OLD.id) THEN
+        RAISE foreign_key_violation USING MESSAGE = format('pedido %s ainda é referenciado', OLD.id);
+    END IF;
+    RETURN NULL;
+END $$""",
+]
+REMOVER_INTEGRIDADE = [
+    "DROP FUNCTION IF EXISTS pedido_referenciado_existe() CASCADE",
+    "DROP FUNCTION IF EXISTS pagamento_unico_por_pedido() CASCADE",
+    "DROP FUNCTION IF EXISTS pedido_sem_dependentes() CASCADE",
+]
+
+
+def _trigger_pedido_existe(tabela, alvo):
+    # Papel da FK (pedido_id) -> pedido (id) em `tabela`, criado em `alvo` (a tabela ainda
+    # com o nome provisório, durante a troca).
+    return (
+        f"CREATE TRIGGER {tabela}_pedido_existe BEFORE INSERT OR UPDATE OF pedido_id ON {alvo} "
+        "FOR EACH ROW EXECUTE FUNCTION pedido_referenciado_existe()"
+    )
+
+
+def _trigger_pagamento_unico(alvo):
+    return (
+        f"CREATE TRIGGER pagamento_unico_por_pedido BEFORE INSERT OR UPDATE OF pedido_id ON {alvo} "
+        "FOR EACH ROW EXECUTE FUNCTION pagamento_unico_por_pedido()"
+    )
+
+
+def _trigger_pedido_sem_dependentes(alvo):
+    return (
+        f"CREATE CONSTRAINT TRIGGER pedido_sem_dependentes AFTER DELETE ON {alvo} "
+        "DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION pedido_sem_dependentes()"
+    )
+
+
+# Cópia das funções de app/particoes.py e dos helpers de app/migracoes.py que esta revisão
+# usa, como estavam na data dela: a revisão não importa o app, que continua mudando depois dela.
+# Com --sql (ou no dry-run) só o SQL de cada passo é emitido, sem os lotes nem as novas
+# tentativas.
+LOCK_TIMEOUT_MS = int(os.getenv("MIGRACAO_LOCK_TIMEOUT_MS", "2000"))
+TENTATIVAS = int(os.getenv("MIGRACAO_TENTATIVAS", "10"))
+ESPERA_MAX_S = float(os.getenv("MIGRACAO_ESPERA_MAX_S", "30"))
+LOTE = int(os.getenv("MIGRACAO_LOTE", "5000"))
+PAUSA_S = float(os.getenv("MIGRACAO_PAUSA_MS", "100")) / 1000
+SQLSTATES_LOCK = {"55P03", "40P01"}
+
+
+def _inicio_do_mes(dia):
+    return dia.replace(day=1)
+
+
+def _somar_meses(mes, quantidade):
+    total = mes.year * 12 + mes.month - 1 + quantidade
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _executar(descricao, comando, parametros=None):
+    bind = op.get_bind()
+    tentativa = 1
+    while True:
+        bind.execute(sa.text(f"SET lock_timeout = {LOCK_TIMEOUT_MS}"))
+        try:
+            return bind.execute(sa.text(comando), parametros or {})
+        except sa.exc.DBAPIError as e:
+            sqlstate = getattr(e.orig, "pgcode", None) or getattr(e.orig, "sqlstate", None)
+            if sqlstate not in SQLSTATES_LOCK or tentativa >= TENTATIVAS:
+                raise
+            espera = random.uniform(0, min(ESPERA_MAX_S, 0.5 * 2 ** tentativa))
+            logger.info(f"Lock indisponível ao {descricao} (tentativa {tentativa}/{TENTATIVAS}); repetindo em {espera:.1f}s")
+            time.sleep(espera)
+            tentativa += 1
+        finally:
+            bind.execute(sa.text("RESET lock_timeout"))
+
+
+def _catalogo():
+    # Conexão para ler o banco: a da migração ou, no dry-run, a conexão somente leitura
+    # que o env.py deixa em config.attributes. None num --sql puro.
+    if not context.is_offline_mode():
+        return op.get_bind()
+    return context.config.attributes.get("conexao_catalogo")
+
+
+# A troca de uma tabela por outra com as mesmas linhas, sem travar o tráfego durante a
+# cópia: um trigger na tabela atual anota em {tabela}_pendente o id de toda linha escrita
+# a partir dali; a cópia vai em lotes por id, cada um no seu commit, e os ids anotados são
+# recopiados até sobrarem poucos. Só o último repasse e a troca de nomes rodam com a
+# tabela travada, numa instrução (DO) que pode ser repetida se o lock não vier.
+def _criar_particionada(tabela, destino):
+    coluna = CHAVE_PARTICAO[tabela]
+    op.execute(
+        f"CREATE TABLE {destino} ({COLUNAS[tabela]}, PRIMARY KEY (id, {coluna}){RESTRICOES_PARTICIONADA[tabela]}) "
+        f"PARTITION BY RANGE ({coluna})"
+    )
+    op.execute(f"CREATE TABLE {tabela}_padrao PARTITION OF {destino} DEFAULT")
+
+    # Partições do mês mais antigo até MESES_FUTUROS à frente; sem catálogo (--sql), a
+    # partir do mês atual, e o que for mais antigo cai na padrão.
+    catalogo = _catalogo()
+    menor = maior = None
+    if catalogo is not None and catalogo.dialect.name == "postgresql":
+        menor, maior = catalogo.execute(sa.text(f"SELECT min({coluna}), max({coluna}) FROM {tabela}")).one()
+    mes_atual = _inicio_do_mes(date.today())
+    mes = _inicio_do_mes(menor) if menor else mes_atual
+    ultimo = max(_somar_meses(mes_atual, MESES_FUTUROS), _inicio_do_mes(maior) if maior else mes_atual)
+    while mes <= ultimo:
+        op.execute(
+            f"CREATE TABLE {tabela}_p{mes:%Y_%m} PARTITION OF {destino} "
+            f"FOR VALUES FROM ('{mes}') TO ('{_somar_meses(mes, 1)}')"
+        )
+        mes = _somar_meses(mes, 1)
+
+
+def _criar_comum(tabela, destino):
+    op.execute(f"CREATE TABLE {destino} ({COLUNAS[tabela]}, PRIMARY KEY (id){RESTRICOES_COMUM[tabela]})")
+
+
+def _anotar_escritas(tabela):
+    op.execute(f"CREATE TABLE {tabela}_pendente (id integer PRIMARY KEY)")
+    op.execute(f"""CREATE FUNCTION {tabela}_anotar_pendente() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO {tabela}_pendente VALUES (OLD.id) ON CONFLICT DO NOTHING;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO {tabela}_pendente VALUES (NEW.id) ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END $$""")
+    comando = (
+        f"CREATE TRIGGER {tabela}_anotar_pendente AFTER INSERT OR UPDATE OR DELETE ON {tabela} "
+        f"FOR EACH ROW EXECUTE FUNCTION {tabela}_anotar_pendente()"
+    )
+    if context.is_offline_mode():
+        op.execute(comando)
+        return
+    with op.get_context().autocommit_block():
+        _executar(f"anotar escritas em {tabela}", comando)
+
+
+def _bloco(comandos):
+    # Uma instrução só (e uma transação, mesmo em autocommit) com todos os comandos.
+    return "DO $$ DECLARE ids integer[]; BEGIN " + " ".join(f"{comando};" for comando in comandos) + " END $$"
+
+
+def _repasse(tabela, destino, limite=None):
+    # Recopia os ids anotados (até `limite`): apaga a versão copiada e insere a atual, ou
+    # nenhuma se a linha foi removida.
+    colunas = NOMES_COLUNAS[tabela]
+    selecao = f"SELECT id FROM {tabela}_pendente ORDER BY id" + (f" LIMIT {limite}" if limite else "")
+    return [
+        f"ids := ARRAY({selecao})",
+        f"DELETE FROM {tabela}_pendente WHERE id = ANY(ids)",
+        f"DELETE FROM {destino} WHERE id = ANY(ids)",
+        f"INSERT INTO {destino} ({colunas}) SELECT {colunas} FROM {tabela} WHERE id = ANY(ids)",
+    ]
+
+
+def _copiar_em_lotes(tabela, destino):
+    colunas = NOMES_COLUNAS[tabela]
+    if context.is_offline_mode():
+        op.execute(f"INSERT INTO {destino} ({colunas}) SELECT {colunas} FROM {tabela}")
+        return
+    total, ultimo = 0, None
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            apos = "" if ultimo is None else "WHERE id > :ultimo"
+            parametros = {} if ultimo is None else {"ultimo": ultimo}
+            fim = bind.scalar(
+                sa.text(f"SELECT max(id) FROM (SELECT id FROM {tabela} {apos} ORDER BY id LIMIT {LOTE}) t"), parametros
+            )
+            if fim is None:
+                break
+            faixa = "id <= :fim" if ultimo is None else "id > :ultimo AND id <= :fim"
+            result = bind.execute(
+                sa.text(f"INSERT INTO {destino} ({colunas}) SELECT {colunas} FROM {tabela} WHERE {faixa}"),
+                {**parametros, "fim": fim},
+            )
+            total += max(result.rowcount, 0)
+            ultimo = fim
+            time.sleep(PAUSA_S)
+        logger.info(f"copiar {tabela}: {total} linhas")
+
+        while bind.scalar(sa.text(f"SELECT count(*) FROM {tabela}_pendente")) > LOTE:
+            bind.execute(sa.text(_bloco(_repasse(tabela, destino, LOTE))))
+            time.sleep(PAUSA_S)
+
+
+def _trocar(tabela, destino, renomear, antes=(), depois=()):
+    # Último repasse e troca numa instrução só, com a tabela travada; a antiga sai junto.
+    # `antes` roda logo após o repasse, `depois` com a tabela nova já no lugar. A sequência
+    # é desligada da antiga antes do DROP, que a levaria junto.
+    comando = _bloco([
+        f"LOCK TABLE {tabela} IN ACCESS EXCLUSIVE MODE",
+        *_repasse(tabela, destino),
+        f"DROP TRIGGER {tabela}_anotar_pendente ON {tabela}",
+        f"DROP FUNCTION {tabela}_anotar_pendente()",
+        f"DROP TABLE {tabela}_pendente",
+        *antes,
+        f"ALTER SEQUENCE {tabela}_id_seq OWNED BY NONE",
+        f"DROP TABLE {tabela}",
+        *(f"ALTER TABLE {destino} RENAME CONSTRAINT {destino}_{sufixo} TO {tabela}_{sufixo}" for sufixo in renomear),
+        f"ALTER TABLE {destino} RENAME TO {tabela}",
+        f"ALTER SEQUENCE {tabela}_id_seq OWNED BY {tabela}.id",
+        *depois,
+    ])
+    if context.is_offline_mode():
+        op.execute(comando)
+        return
+    with op.get_context().autocommit_block():
+        _executar(f"trocar {tabela}", comando)
+    logger.info(f"{tabela} trocada")
+
+
+def _reconstruir(tabela, criar, renomear, antes=(), depois=()):
+    destino = f"{tabela}_nova"
+    criar(tabela, destino)
+    _anotar_escritas(tabela)
+    _copiar_em_lotes(tabela, destino)
+    _trocar(tabela, destino, renomear, antes, depois)
+
+
+def upgrade():
+    for comando in INTEGRIDADE:
+        op.execute(comando)
+    # As FKs saem na troca de pedido, com os triggers entrando no mesmo commit.
+    _reconstruir(
+        'pedido', _criar_particionada, RENOMEAR_PARTICIONADA['pedido'],
+        antes=[
+            "ALTER TABLE pagamento DROP CONSTRAINT pagamento_pedido_id_fkey",
+            "ALTER TABLE pedidolivrolink DROP CONSTRAINT pedidolivrolink_pedido_id_fkey",
+            _trigger_pagamento_unico('pagamento'),
+            _trigger_pedido_existe('pedidolivrolink', 'pedidolivrolink'),
+            _trigger_pedido_sem_dependentes('pedido_nova'),
+        ],
+    )
+    _reconstruir(
+        'pagamento', _criar_particionada, RENOMEAR_PARTICIONADA['pagamento'],
+        antes=[_trigger_pagamento_unico('pagamento_nova')],
+    )
+
+
+def downgrade():
+    # Com pedido ainda particionada, pagamento volta com a UNIQUE(pedido_id) e o trigger
+    # no lugar da FK; as FKs voltam na troca de pedido, NOT VALID, e são validadas depois
+    # sem travar escritas.
+    _reconstruir(
+        'pagamento', _criar_comum, RENOMEAR_COMUM['pagamento'],
+        antes=[_trigger_pedido_existe('pagamento', 'pagamento_nova')],
+    )
+    _reconstruir(
+        'pedido', _criar_comum, RENOMEAR_COMUM['pedido'],
+        antes=[
+            "DROP TRIGGER pagamento_pedido_existe ON pagamento",
+            "DROP TRIGGER pedidolivrolink_pedido_existe ON pedidolivrolink",
+        ],
+        depois=[
+            "ALTER TABLE pedidolivrolink ADD CONSTRAINT pedidolivrolink_pedido_id_fkey "
+            "FOREIGN KEY (pedido_id) REFERENCES pedido (id) NOT VALID",
+            "ALTER TABLE pagamento ADD CONSTRAINT pagamento_pedido_id_fkey "
+            "FOREIGN KEY (pedido_id) REFERENCES pedido (id) NOT VALID",
+        ],
+    )
+    for tabela, nome in [('pedidolivrolink', 'pedidolivrolink_pedido_id_fkey'), ('pagamento', 'pagamento_pedido_id_fkey')]:
+        comando = f"ALTER TABLE {tabela} VALIDATE CONSTRAINT {nome}"
+        if context.is_offline_mode():
+            op.execute(comando)
+            continue
+        with op.get_context().autocommit_block():
+            _executar(f"validar {nome}", comando)
+    for comando in REMOVER_INTEGRIDADE:
+        op.execute(comando)
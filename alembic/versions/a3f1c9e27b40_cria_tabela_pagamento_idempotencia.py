@@ -0,0 +1,28 @@
+"""cria tabela pagamentoidempotencia
+
+Revision ID: a3f1c9e27b40
+Revises: 'd4048bf9920c'
+Create Date: 2026-10-18 09:12:44.201318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'a3f1c9e27b40'
+down_revision = 'd4048bf9920c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pagamentoidempotencia',
+        sa.Column('chave', sa.String(), nullable=False),
+        sa.Column('pedido_id', sa.Integer(), nullable=False),
+        sa.Column('criado_em', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('chave')
+    )
+
+
+def downgrade():
+    op.drop_table('pagamentoidempotencia')
@@ -0,0 +1,53 @@
+"""cria tabelas de arquivo de pedido e pagamento
+
+Revision ID: b6d2f9a4e317
+Revises: 'f1b8d3a6c520'
+Create Date: 2026-10-19 00:12:48.527301
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b6d2f9a4e317'
+down_revision = 'f1b8d3a6c520'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pedido_arquivado',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('usuario_id', sa.Integer(), nullable=True),
+        sa.Column('data_pedido', sa.Date(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('valor_total', sa.Float(), nullable=False),
+        sa.Column('arquivado_em', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_pedido_arquivado_usuario_id_data_pedido', 'pedido_arquivado', ['usuario_id', 'data_pedido'])
+    op.create_table('pedidolivrolink_arquivado',
+        sa.Column('pedido_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('livro_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.ForeignKeyConstraint(['livro_id'], ['livro.id']),
+        sa.PrimaryKeyConstraint('pedido_id', 'livro_id')
+    )
+    op.create_table('pagamento_arquivado',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('pedido_id', sa.Integer(), nullable=True),
+        sa.Column('data_pagamento', sa.Date(), nullable=False),
+        sa.Column('valor', sa.Float(), nullable=False),
+        sa.Column('forma_pagamento', sa.String(), nullable=False),
+        sa.Column('arquivado_em', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_pagamento_arquivado_pedido_id', 'pagamento_arquivado', ['pedido_id'])
+
+
+def downgrade():
+    op.drop_index('ix_pagamento_arquivado_pedido_id', table_name='pagamento_arquivado')
+    op.drop_table('pagamento_arquivado')
+    op.drop_table('pedidolivrolink_arquivado')
+    op.drop_index('ix_pedido_arquivado_usuario_id_data_pedido', table_name='pedido_arquivado')
+    op.drop_table('pedido_arquivado')
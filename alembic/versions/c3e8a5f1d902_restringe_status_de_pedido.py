@@ -0,0 +1,295 @@
+"""restringe status de pedido e cria índices parciais de pedidos em aberto
+
+Revision ID: c3e8a5f1d902
+Revises: 'b6d2f9a4e317'
+Create Date: 2026-10-19 02:41:07.913554
+
+"""
+import logging
+import os
+import random
+import time
+from alembic import context, op
+import sqlalchemy as sa
+
+
+revision = 'c3e8a5f1d902'
+down_revision = 'b6d2f9a4e317'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("MyBooks")
+
+VALIDOS = "('pendente', 'pago', 'enviado', 'entregue', 'cancelado')"
+ABERTOS = "status IN ('pendente', 'pago', 'enviado')"
+
+# Grafias livres gravadas até aqui. Um valor fora delas interrompe a migração com a lista
+# do que falta: o operador decide o destino em MIGRACAO_STATUS_MAPA
+# ("devolvido=cancelado,em separacao=pago"), que tem precedência sobre as grafias abaixo.
+SINONIMOS = {
+    'pendente': ('pendente', 'aberto', 'novo', 'aguardando pagamento'),
+    'pago': ('pago', 'aprovado', 'confirmado'),
+    'enviado': ('enviado', 'despachado', 'em transporte', 'em trânsito'),
+    'entregue': ('entregue', 'concluído', 'concluido', 'finalizado'),
+    'cancelado': ('cancelado', 'cancelada', 'estornado'),
+}
+MAPA_OPERADOR = [
+    tuple(parte.strip() for parte in item.split("=", 1))
+    for item in os.getenv("MIGRACAO_STATUS_MAPA", "").split(",") if "=" in item
+]
+# Valor original de cada linha normalizada, para o downgrade devolver.
+BACKUP = 'pedido_status_original'
+
+
+def _literal(valor):
+    return "'" + valor.replace("'", "''") + "'"
+
+
+def _normalizacao():
+    casos = []
+    for grafia, status in MAPA_OPERADOR:
+        if status not in SINONIMOS:
+            raise RuntimeError(f"MIGRACAO_STATUS_MAPA: '{status}' não é um status válido {VALIDOS}")
+        casos.append(f"    WHEN lower(trim(status)) = {_literal(grafia.lower())} THEN '{status}'")
+    for status, grafias in SINONIMOS.items():
+        casos.append(f"    WHEN lower(trim(status)) IN ({', '.join(map(_literal, grafias))}) THEN '{status}'")
+    # Sem ELSE: o que não foi reconhecido fica NULL e é barrado antes de qualquer UPDATE.
+    return "CASE\n" + "\n".join(casos) + "\nEND"
+
+
+NORMALIZACAO = _normalizacao()
+
+TABELAS = [('pedido', 'id'), ('pedido_arquivado', 'id'), ('pedido_view', 'pedido_id')]
+# Particionada por 5b8e2d41c7fa.
+PARTICIONADAS = {'pedido'}
+
+
+# Cópia dos helpers de app/migracoes.py que esta revisão usa, como estavam na data dela:
+# a revisão não importa o app, que continua mudando depois dela. Com --sql (ou no dry-run)
+# só o SQL de cada passo é emitido, sem os lotes nem as novas tentativas; o catálogo só é
+# consultado no dry-run, pela conexão que o env.py deixa em config.attributes.
+LOCK_TIMEOUT_MS = int(os.getenv("MIGRACAO_LOCK_TIMEOUT_MS", "2000"))
+TENTATIVAS = int(os.getenv("MIGRACAO_TENTATIVAS", "10"))
+ESPERA_MAX_S = float(os.getenv("MIGRACAO_ESPERA_MAX_S", "30"))
+LOTE = int(os.getenv("MIGRACAO_LOTE", "5000"))
+PAUSA_S = float(os.getenv("MIGRACAO_PAUSA_MS", "100")) / 1000
+SQLSTATES_LOCK = {"55P03", "40P01"}
+
+
+def _executar(descricao, comando, parametros=None, ao_falhar=None):
+    bind = op.get_bind()
+    tentativa = 1
+    while True:
+        bind.execute(sa.text(f"SET lock_timeout = {LOCK_TIMEOUT_MS}"))
+        try:
+            return bind.execute(sa.text(comando), parametros or {})
+        except sa.exc.DBAPIError as e:
+            if ao_falhar is not None:
+                ao_falhar()
+            sqlstate = getattr(e.orig, "pgcode", None) or getattr(e.orig, "sqlstate", None)
+            if sqlstate not in SQLSTATES_LOCK or tentativa >= TENTATIVAS:
+                raise
+            espera = random.uniform(0, min(ESPERA_MAX_S, 0.5 * 2 ** tentativa))
+            logger.info(f"Lock indisponível ao {descricao} (tentativa {tentativa}/{TENTATIVAS}); repetindo em {espera:.1f}s")
+            time.sleep(espera)
+            tentativa += 1
+        finally:
+            bind.execute(sa.text("RESET lock_timeout"))
+
+
+def _preencher_em_lotes(tabela, atribuicoes, pendente, chave):
+    if context.is_offline_mode():
+        op.execute(f"UPDATE {tabela} SET {atribuicoes} WHERE {pendente}")
+        return
+    total, ultimo = 0, None
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            apos = "" if ultimo is None else f"WHERE {chave} > :ultimo"
+            parametros = {} if ultimo is None else {"ultimo": ultimo}
+            fim = bind.scalar(
+                sa.text(f"SELECT max({chave}) FROM (SELECT {chave} FROM {tabela} {apos} ORDER BY {chave} LIMIT {LOTE}) t"),
+                parametros,
+            )
+            if fim is None:
+                break
+            faixa = f"{chave} <= :fim" if ultimo is None else f"{chave} > :ultimo AND {chave} <= :fim"
+            result = _executar(
+                f"preencher {tabela}",
+                f"UPDATE {tabela} SET {atribuicoes} WHERE {faixa} AND ({pendente})",
+                {**parametros, "fim": fim},
+            )
+            total += max(result.rowcount, 0)
+            ultimo = fim
+            time.sleep(PAUSA_S)
+    logger.info(f"preencher {tabela}: {total} linhas")
+
+
+def _adicionar_check(nome, tabela, condicao):
+    # NOT VALID só altera o catálogo; VALIDATE varre a tabela sem bloquear escritas.
+    if context.is_offline_mode():
+        op.execute(f"ALTER TABLE {tabela} ADD CONSTRAINT {nome} CHECK ({condicao}) NOT VALID")
+        op.execute(f"ALTER TABLE {tabela} VALIDATE CONSTRAINT {nome}")
+        return
+    with op.get_context().autocommit_block():
+        existe = op.get_bind().scalar(sa.text(
+            "SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = CAST(:tabela AS regclass) AND conname = :nome)"
+        ), {"tabela": tabela, "nome": nome})
+        if not existe:
+            _executar(f"adicionar {nome}", f"ALTER TABLE {tabela} ADD CONSTRAINT {nome} CHECK ({condicao}) NOT VALID")
+        _executar(f"validar {nome}", f"ALTER TABLE {tabela} VALIDATE CONSTRAINT {nome}")
+
+
+def _indice(nome):
+    # (válido, anexado a um índice pai) ou None se o índice não existe.
+    return op.get_bind().execute(sa.text(
+        "SELECT i.indisvalid, EXISTS (SELECT 1 FROM pg_inherits h WHERE h.inhrelid = i.indexrelid) "
+        "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :nome"
+    ), {"nome": nome}).first()
+
+
+def _criar_indice_concorrente(nome, tabela, corpo):
+    # Um CONCURRENTLY interrompido deixa índice inválido: ele sai antes de cada tentativa.
+    def descartar_invalido():
+        estado = _indice(nome)
+        if estado is not None and not estado[0]:
+            op.get_bind().execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}"))
+
+    descartar_invalido()
+    _executar(
+        f"criar índice {nome}", f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} {corpo}",
+        ao_falhar=descartar_invalido,
+    )
+
+
+def _catalogo():
+    # Conexão para ler o banco: a da migração ou, no dry-run (SQL renderizado), a conexão
+    # somente leitura que o env.py deixa em config.attributes. None num --sql puro.
+    if not context.is_offline_mode():
+        return op.get_bind()
+    return context.config.attributes.get("conexao_catalogo")
+
+
+def _particoes(bind, tabela):
+    # None se a tabela não é particionada (no dry-run, ainda não particionada no banco lido).
+    if bind.dialect.name != "postgresql":
+        return None
+    relkind = bind.scalar(sa.text("SELECT relkind FROM pg_class WHERE oid = CAST(:tabela AS regclass)"), {"tabela": tabela})
+    if relkind != "p":
+        return None
+    return bind.execute(sa.text(
+        "SELECT CAST(relid AS regclass)::text FROM pg_partition_tree(CAST(:tabela AS regclass)) "
+        "WHERE parentrelid = CAST(:tabela AS regclass) ORDER BY 1"
+    ), {"tabela": tabela}).scalars().all()
+
+
+def _criar_indice(nome, tabela, colunas, where):
+    # Tabela comum: CONCURRENTLY. Particionada: índice pai só no catálogo (ON ONLY), um
+    # CONCURRENTLY por partição, anexado em seguida.
+    corpo = f"({', '.join(colunas)}) WHERE {where}"
+    if context.is_offline_mode():
+        catalogo = _catalogo()
+        if catalogo is None and tabela in PARTICIONADAS:
+            # O Postgres recusa CONCURRENTLY na tabela particionada, e sem conexão não há a
+            # lista de partições para gerar o SQL de cada uma.
+            raise RuntimeError(
+                f"{tabela} é particionada: o índice {nome} precisa das partições do banco; "
+                "use -x dry_run=sim em vez de --sql"
+            )
+        particoes = None if catalogo is None else _particoes(catalogo, tabela)
+        with op.get_context().autocommit_block():
+            if particoes is None:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} {corpo}")
+                return
+            op.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON ONLY {tabela} {corpo}")
+            for particao in particoes:
+                indice = f"{particao}_{nome}"[:63]
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {indice} ON {particao} {corpo}")
+                op.execute(f"ALTER INDEX {nome} ATTACH PARTITION {indice}")
+        return
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        particoes = _particoes(bind, tabela)
+        if particoes is None:
+            _criar_indice_concorrente(nome, tabela, corpo)
+            return
+        _executar(f"criar índice {nome}", f"CREATE INDEX IF NOT EXISTS {nome} ON ONLY {tabela} {corpo}")
+        for particao in particoes:
+            indice = f"{particao}_{nome}"[:63]
+            _criar_indice_concorrente(indice, particao, corpo)
+            if not _indice(indice)[1]:
+                _executar(f"anexar índice {indice}", f"ALTER INDEX {nome} ATTACH PARTITION {indice}")
+
+
+def _remover_indice(nome):
+    if context.is_offline_mode():
+        op.execute(f"DROP INDEX IF EXISTS {nome}")
+        return
+    particionado = op.get_bind().scalar(sa.text("SELECT relkind = 'I' FROM pg_class WHERE relname = :nome"), {"nome": nome})
+    with op.get_context().autocommit_block():
+        # Índice de tabela particionada não aceita CONCURRENTLY; o DROP dele só mexe no catálogo.
+        concorrente = "" if particionado else "CONCURRENTLY "
+        _executar(f"remover índice {nome}", f"DROP INDEX {concorrente}IF EXISTS {nome}")
+
+
+def _recusar_desconhecidos():
+    # Todas as tabelas antes de qualquer UPDATE: a migração para sem ter mudado nada.
+    condicao = f"status NOT IN {VALIDOS} AND ({NORMALIZACAO}) IS NULL"
+    catalogo = _catalogo()
+    if catalogo is None:
+        # --sql puro: a checagem vai no próprio script, que para antes de normalizar.
+        for tabela, _ in TABELAS:
+            op.execute(
+                f"DO $$ BEGIN IF EXISTS (SELECT 1 FROM {tabela} WHERE {condicao}) THEN "
+                f"RAISE EXCEPTION 'status sem mapeamento em {tabela}: defina MIGRACAO_STATUS_MAPA'; "
+                "END IF; END $$"
+            )
+        return
+    desconhecidos = []
+    for tabela, _ in TABELAS:
+        # No dry-run a tabela pode vir de uma revisão anterior ainda não aplicada: nasce vazia.
+        if not sa.inspect(catalogo).has_table(tabela):
+            continue
+        linhas = catalogo.execute(sa.text(
+            f"SELECT status, count(*) FROM {tabela} WHERE {condicao} GROUP BY status ORDER BY 2 DESC"
+        )).all()
+        desconhecidos += [f"{tabela}: '{status}' ({quantidade})" for status, quantidade in linhas]
+    if desconhecidos:
+        raise RuntimeError(
+            "Status sem mapeamento; defina o destino em MIGRACAO_STATUS_MAPA e rode de novo: "
+            + ", ".join(desconhecidos)
+        )
+
+
+def upgrade():
+    _recusar_desconhecidos()
+    op.execute(
+        f"CREATE TABLE IF NOT EXISTS {BACKUP} (tabela varchar NOT NULL, chave integer NOT NULL, "
+        "original varchar NOT NULL, normalizado varchar NOT NULL, PRIMARY KEY (tabela, chave))"
+    )
+    for tabela, chave in TABELAS:
+        op.execute(
+            f"INSERT INTO {BACKUP} (tabela, chave, original, normalizado) "
+            f"SELECT '{tabela}', {chave}, status, {NORMALIZACAO} FROM {tabela} WHERE status NOT IN {VALIDOS} "
+            "ON CONFLICT DO NOTHING"
+        )
+    for tabela, chave in TABELAS:
+        _preencher_em_lotes(tabela, f"status = {NORMALIZACAO}", f"status NOT IN {VALIDOS}", chave)
+
+    _adicionar_check('ck_pedido_status', 'pedido', f"status IN {VALIDOS}")
+    _adicionar_check('ck_pedido_arquivado_status', 'pedido_arquivado', f"status IN {VALIDOS}")
+    _criar_indice('ix_pedido_status_abertos', 'pedido', ['status', 'data_pedido'], ABERTOS)
+    _criar_indice('ix_pedido_view_status_abertos', 'pedido_view', ['status', 'pedido_id'], ABERTOS)
+
+
+def downgrade():
+    _remover_indice('ix_pedido_view_status_abertos')
+    _remover_indice('ix_pedido_status_abertos')
+    op.drop_constraint('ck_pedido_arquivado_status', 'pedido_arquivado', type_='check')
+    op.drop_constraint('ck_pedido_status', 'pedido', type_='check')
+    # Volta o valor original só onde o status ainda é o normalizado: o que mudou depois
+    # da migração fica como está.
+    for tabela, chave in TABELAS:
+        backup = f"FROM {BACKUP} b WHERE b.tabela = '{tabela}' AND b.chave = {tabela}.{chave} AND b.normalizado = {tabela}.status"
+        op.execute(f"UPDATE {tabela} SET status = (SELECT b.original {backup}) WHERE EXISTS (SELECT 1 {backup})")
+    op.execute(f"DROP TABLE IF EXISTS {BACKUP}")
@@ -0,0 +1,28 @@
+"""cria índice de pedido por usuário e data
+
+Revision ID: db62cbc47d8b
+Revises: '5b8e2d41c7fa'
+Create Date: 2026-10-18 14:05:31.472906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'db62cbc47d8b'
+down_revision = '5b8e2d41c7fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Em pedido particionado, o índice criado na tabela pai é replicado em cada partição.
+    op.create_index(
+        'ix_pedido_usuario_id_data_pedido',
+        'pedido',
+        ['usuario_id', sa.text('data_pedido DESC'), sa.text('id DESC')],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_pedido_usuario_id_data_pedido', table_name='pedido')
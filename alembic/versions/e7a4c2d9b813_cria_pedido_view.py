@@ -0,0 +1,63 @@
+"""cria modelo de leitura pedido_view
+
+Revision ID: e7a4c2d9b813
+Revises: 'db62cbc47d8b'
+Create Date: 2026-10-18 16:22:07.318245
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e7a4c2d9b813'
+down_revision = 'db62cbc47d8b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'pedido_view',
+        sa.Column('pedido_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('usuario_id', sa.Integer(), nullable=True),
+        sa.Column('data_pedido', sa.Date(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('valor_total', sa.Float(), nullable=False),
+        sa.Column('usuario_nome', sa.String(), nullable=True),
+        sa.Column('pagamento_id', sa.Integer(), nullable=True),
+        sa.Column('pagamento_data', sa.Date(), nullable=True),
+        sa.Column('pagamento_valor', sa.Float(), nullable=True),
+        sa.Column('pagamento_forma', sa.String(), nullable=True),
+        sa.Column('quantidade_livros', sa.Integer(), nullable=False),
+        sa.Column('titulos', sa.JSON(), nullable=False),
+        sa.PrimaryKeyConstraint('pedido_id'),
+    )
+    op.create_index('ix_pedido_view_usuario_id_data_pedido', 'pedido_view', ['usuario_id', 'data_pedido'])
+    op.create_index('ix_pedido_view_data_pedido', 'pedido_view', ['data_pedido'])
+    op.create_index('ix_pedido_view_pagamento_id', 'pedido_view', ['pagamento_id'])
+
+    # Carga inicial; depois disso a tabela é mantida pelos handlers (python -m app.pedido_view).
+    op.execute("""
+        INSERT INTO pedido_view
+        SELECT p.id, p.usuario_id, p.data_pedido, p.status, p.valor_total, u.nome,
+               pg.id, pg.data_pagamento, pg.valor, pg.forma_pagamento,
+               COALESCE(l.quantidade, 0), COALESCE(l.titulos, json_build_array())
+        FROM pedido p
+        LEFT JOIN usuario u ON u.id = p.usuario_id
+        LEFT JOIN (
+            SELECT pl.pedido_id, count(*) AS quantidade, json_agg(lv.titulo ORDER BY lv.id) AS titulos
+            FROM pedidolivrolink pl JOIN livro lv ON lv.id = pl.livro_id
+            GROUP BY pl.pedido_id
+        ) l ON l.pedido_id = p.id
+        LEFT JOIN (
+            SELECT pedido_id, min(id) AS id FROM pagamento GROUP BY pedido_id
+        ) primeiro ON primeiro.pedido_id = p.id
+        LEFT JOIN pagamento pg ON pg.pedido_id = p.id AND pg.id = primeiro.id
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_pedido_view_pagamento_id', table_name='pedido_view')
+    op.drop_index('ix_pedido_view_data_pedido', table_name='pedido_view')
+    op.drop_index('ix_pedido_view_usuario_id_data_pedido', table_name='pedido_view')
+    op.drop_table('pedido_view')
@@ -0,0 +1,35 @@
+"""cria tabela pedido_evento
+
+Revision ID: f1b8d3a6c520
+Revises: 'e7a4c2d9b813'
+Create Date: 2026-10-18 18:05:31.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'f1b8d3a6c520'
+down_revision = 'e7a4c2d9b813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pedido_evento',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('entidade', sa.String(), nullable=False),
+        sa.Column('acao', sa.String(), nullable=False),
+        sa.Column('registro_id', sa.Integer(), nullable=False),
+        sa.Column('pedido_id', sa.Integer(), nullable=True),
+        sa.Column('usuario_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_pedido_evento_criado_em', 'pedido_evento', ['criado_em'])
+
+
+def downgrade():
+    op.drop_index('ix_pedido_evento_criado_em', table_name='pedido_evento')
+    op.drop_table('pedido_evento')
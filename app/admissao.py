@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from typing import Dict, List, Optional
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+
+def _ler_rotas(valor: str) -> Dict[str, tuple]:
+    # "/pedidos/filtrar=2:10,/livros/mais-vendidos=2" -> {rota: (limite, fila)}
+    rotas = {}
+    for item in filter(None, (parte.strip() for parte in valor.split(","))):
+        rota, _, config = item.partition("=")
+        limite, _, fila = config.partition(":")
+        rotas[rota] = (int(limite), int(fila or limite * 5))
+    return rotas
+
+
+ADMISSAO_ATIVA = os.getenv("ADMISSAO_ATIVA", "true").lower() in ("1", "true", "sim")
+ADMISSAO_LIMITE_GLOBAL = int(os.getenv("ADMISSAO_LIMITE_GLOBAL", "15"))
+ADMISSAO_FILA_GLOBAL = int(os.getenv("ADMISSAO_FILA_GLOBAL", "200"))
+ADMISSAO_ESPERA_MAX_S = float(os.getenv("ADMISSAO_ESPERA_MAX_S", "5"))
+ADMISSAO_RETRY_AFTER_S = int(os.getenv("ADMISSAO_RETRY_AFTER_S", "1"))
+ADMISSAO_CLASSES = {
+    # classe: (prioridade, limite, fila) — menor prioridade é atendida primeiro
+    "escrita": (0, int(os.getenv("ADMISSAO_LIMITE_ESCRITA", "10")), int(os.getenv("ADMISSAO_FILA_ESCRITA", "100"))),
+    "leitura": (1, int(os.getenv("ADMISSAO_LIMITE_LEITURA", "12")), int(os.getenv("ADMISSAO_FILA_LEITURA", "100"))),
+    "relatorio": (2, int(os.getenv("ADMISSAO_LIMITE_RELATORIO", "4")), int(os.getenv("ADMISSAO_FILA_RELATORIO", "20"))),
+}
+ADMISSAO_ROTAS_RELATORIO = set(filter(None, os.getenv(
+    "ADMISSAO_ROTAS_RELATORIO",
+    "/pedidos/filtrar,/livros/mais-vendidos,/livros/filtro,/livros/facetas,/pagamentos/filtro,"
+    "/usuarios/filtrar,/autores/filtrar,/autores/ordenado,/editoras/filtro",
+).split(",")))
+ADMISSAO_ROTAS = _ler_rotas(os.getenv("ADMISSAO_ROTAS", ""))
+# /pedidos/eventos é uma conexão longa (SSE) e ocuparia uma vaga enquanto estivesse aberta.
+ADMISSAO_ROTAS_IGNORADAS = ("/docs", "/redoc", "/openapi.json", "/metricas", "/pedidos/eventos")
+# POSTs que só leem dados e entram na classe de leitura.
+ADMISSAO_ROTAS_POST_LEITURA = {"/batch"}
+
+LIMITES_HISTOGRAMA_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class FilaCheia(Exception):
+    def __init__(self, limitador):
+        self.limitador = limitador
+
+
+class EsperaExpirada(Exception):
+    def __init__(self, limitador):
+        self.limitador = limitador
+
+
+class Limitador:
+    def __init__(self, nome: str, limite: int, fila_max: int):
+        self.nome = nome
+        self.limite = limite
+        self.fila_max = fila_max
+        self.em_uso = 0
+        self.aguardando = 0
+        self._espera = []
+        self._sequencia = itertools.count()
+        self.admitidos = 0
+        self.rejeitados = 0
+        self.expirados = 0
+        self.tempo_fila_total_ms = 0.0
+        self.tempo_fila_max_ms = 0.0
+        self.histograma = [0] * (len(LIMITES_HISTOGRAMA_MS) + 1)
+
+    async def adquirir(self, prioridade: int, timeout: float):
+        inicio = time.perf_counter()
+        if self.em_uso < self.limite and not self.aguardando:
+            self.em_uso += 1
+            self._registrar_admissao(inicio)
+            return
+
+        if self.aguardando >= self.fila_max:
+            self.rejeitados += 1
+            raise FilaCheia(self)
+
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._espera, (prioridade, next(self._sequencia), futuro))
+        self.aguardando += 1
+        try:
+            await asyncio.wait_for(futuro, timeout)
+        except asyncio.TimeoutError:
+            self.expirados += 1
+            raise EsperaExpirada(self)
+        except asyncio.CancelledError:
+            # A vaga pode ter sido entregue no mesmo instante do cancelamento.
+            if futuro.done() and not futuro.cancelled():
+                self.liberar()
+            raise
+        finally:
+            self.aguardando -= 1
+        self._registrar_admissao(inicio)
+
+    def liberar(self):
+        while self._espera:
+            _, _, futuro = heapq.heappop(self._espera)
+            if not futuro.done():
+                # A vaga passa direto para o próximo da fila, sem decrementar em_uso.
+                futuro.set_result(None)
+                return
+        self.em_uso -= 1
+
+    def _registrar_admissao(self, inicio: float):
+        espera_ms = (time.perf_counter() - inicio) * 1000
+        self.admitidos += 1
+        self.tempo_fila_total_ms += espera_ms
+        self.tempo_fila_max_ms = max(self.tempo_fila_max_ms, espera_ms)
+        for indice, limite in enumerate(LIMITES_HISTOGRAMA_MS):
+            if espera_ms <= limite:
+                self.histograma[indice] += 1
+                break
+        else:
+            self.histograma[-1] += 1
+
+    def metricas(self) -> dict:
+        return {
+            "limite": self.limite,
+            "fila_max": self.fila_max,
+            "em_uso": self.em_uso,
+            "aguardando": self.aguardando,
+            "admitidos": self.admitidos,
+            "rejeitados": self.rejeitados,
+            "expirados": self.expirados,
+            "tempo_fila_medio_ms": round(self.tempo_fila_total_ms / self.admitidos, 3) if self.admitidos else 0.0,
+            "tempo_fila_max_ms": round(self.tempo_fila_max_ms, 3),
+            "histograma_tempo_fila_ms": {
+                **{f"<={limite}": total for limite, total in zip(LIMITES_HISTOGRAMA_MS, self.histograma)},
+                f">{LIMITES_HISTOGRAMA_MS[-1]}": self.histograma[-1],
+            },
+        }
+
+
+class ControleAdmissao:
+    def __init__(self):
+        self.global_ = Limitador("global", ADMISSAO_LIMITE_GLOBAL, ADMISSAO_FILA_GLOBAL)
+        self.classes = {
+            nome: Limitador(nome, limite, fila) for nome, (_, limite, fila) in ADMISSAO_CLASSES.items()
+        }
+        self.rotas = {rota: Limitador(rota, limite, fila) for rota, (limite, fila) in ADMISSAO_ROTAS.items()}
+
+    def classificar(self, metodo: str, caminho: str) -> str:
+        if metodo in ("POST", "PUT", "PATCH", "DELETE") and caminho.rstrip("/") not in ADMISSAO_ROTAS_POST_LEITURA:
+            return "escrita"
+        if caminho.rstrip("/") in ADMISSAO_ROTAS_RELATORIO:
+            return "relatorio"
+        return "leitura"
+
+    def limitadores(self, metodo: str, caminho: str) -> tuple:
+        classe = self.classificar(metodo, caminho)
+        cadeia: List[Limitador] = []
+        rota = self.rotas.get(caminho.rstrip("/"))
+        if rota is not None:
+            cadeia.append(rota)
+        cadeia.append(self.classes[classe])
+        cadeia.append(self.global_)
+        return ADMISSAO_CLASSES[classe][0], cadeia
+
+    def metricas(self) -> dict:
+        return {
+            "global": self.global_.metricas(),
+            "classes": {nome: limitador.metricas() for nome, limitador in self.classes.items()},
+            "rotas": {nome: limitador.metricas() for nome, limitador in self.rotas.items()},
+        }
+
+
+controle_admissao = ControleAdmissao()
+
+
+class ControleAdmissaoMiddleware:
+    def __init__(self, app, controle: Optional[ControleAdmissao] = None):
+        self.app = app
+        self.controle = controle or controle_admissao
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not ADMISSAO_ATIVA
+            or scope["type"] != "http"
+            or scope["path"].startswith(ADMISSAO_ROTAS_IGNORADAS)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        prioridade, cadeia = self.controle.limitadores(scope["method"], scope["path"])
+        prazo = time.monotonic() + ADMISSAO_ESPERA_MAX_S
+        adquiridos = []
+        try:
+            for limitador in cadeia:
+                await limitador.adquirir(prioridade, max(prazo - time.monotonic(), 0))
+                adquiridos.append(limitador)
+        except (FilaCheia, EsperaExpirada) as e:
+            for limitador in reversed(adquiridos):
+                limitador.liberar()
+            motivo = "fila cheia" if isinstance(e, FilaCheia) else "tempo de espera esgotado"
+            logger.warning(f"Requisição {scope['method']} {scope['path']} recusada ({e.limitador.nome}: {motivo})")
+            await self._recusar(send)
+            return
+        except BaseException:
+            for limitador in reversed(adquiridos):
+                limitador.liberar()
+            raise
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for limitador in reversed(adquiridos):
+                limitador.liberar()
+
+    async def _recusar(self, send):
+        corpo = json.dumps({"detail": "Servidor sobrecarregado, tente novamente em instantes."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(corpo)).encode()),
+                (b"retry-after", str(ADMISSAO_RETRY_AFTER_S).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": corpo})
@@ -0,0 +1,129 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import insert
+from app.database import async_session
+from app.transacao import unidade_de_trabalho
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+ESCRITA_AGRUPADA = os.getenv("ESCRITA_AGRUPADA", "false").lower() in ("1", "true", "sim")
+ESCRITA_AGRUPADA_JANELA_MS = float(os.getenv("ESCRITA_AGRUPADA_JANELA_MS", "5"))
+ESCRITA_AGRUPADA_LOTE = int(os.getenv("ESCRITA_AGRUPADA_LOTE", "100"))
+
+
+Antes = Callable[[Any, List[dict]], Awaitable[None]]
+Depois = Callable[[Any, List[Any], List[Any]], Awaitable[None]]
+
+
+class AgrupadorInsercoes:
+    # Junta inserções concorrentes de um mesmo modelo em um único INSERT ... RETURNING
+    # e um único commit. Cada chamador recebe a própria linha ou o próprio erro.
+    #
+    # antes(session, dados) e depois(session, objetos, extras) rodam na transação do lote:
+    # validações com trava e efeitos que precisam ser atômicos com a inserção (vínculos,
+    # outbox, pedido_view). Um erro neles desfaz o lote, que é refeito item a item.
+
+    def __init__(
+        self,
+        modelo,
+        janela_ms: float = ESCRITA_AGRUPADA_JANELA_MS,
+        tamanho_lote: int = ESCRITA_AGRUPADA_LOTE,
+        antes: Optional[Antes] = None,
+        depois: Optional[Depois] = None,
+    ):
+        self.modelo = modelo
+        self.janela = janela_ms / 1000
+        self.tamanho_lote = tamanho_lote
+        self.antes = antes
+        self.depois = depois
+        self._pendentes: List[Tuple[dict, Any, asyncio.Future]] = []
+        self._lote_cheio = asyncio.Event()
+        self._tarefa = None
+
+    async def inserir(self, dados: dict, extra: Any = None):
+        # extra chega a depois() junto com a linha inserida (ex.: livro_ids do pedido).
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._pendentes.append((dados, extra, futuro))
+
+        if self._tarefa is None or self._tarefa.done():
+            self._lote_cheio.clear()
+            self._tarefa = loop.create_task(self._descarregar())
+        elif len(self._pendentes) >= self.tamanho_lote:
+            self._lote_cheio.set()
+
+        return await futuro
+
+    async def encerrar(self):
+        if self._tarefa is not None:
+            self._lote_cheio.set()
+            await self._tarefa
+
+    async def _descarregar(self):
+        try:
+            await asyncio.wait_for(self._lote_cheio.wait(), self.janela)
+        except asyncio.TimeoutError:
+            pass
+
+        while self._pendentes:
+            lote = self._pendentes[:self.tamanho_lote]
+            self._pendentes = self._pendentes[self.tamanho_lote:]
+            await self._gravar(lote)
+
+    async def _gravar(self, lote: List[Tuple[dict, Any, asyncio.Future]]):
+        # Chamadores que desistiram (cancelados) antes da gravação ficam de fora do lote.
+        lote = [item for item in lote if not item[2].done()]
+        if not lote:
+            return
+
+        try:
+            async with async_session() as session:
+                async def inserir():
+                    dados = [dados for dados, _, _ in lote]
+                    if self.antes is not None:
+                        await self.antes(session, dados)
+                    result = await session.execute(
+                        insert(self.modelo).returning(self.modelo, sort_by_parameter_order=True), dados,
+                    )
+                    objetos = result.scalars().all()
+                    if self.depois is not None:
+                        await self.depois(session, objetos, [extra for _, extra, _ in lote])
+                    return objetos
+
+                objetos = await unidade_de_trabalho(session, inserir, f"gravar lote agrupado de {self.modelo.__name__}")
+        except Exception as e:
+            if len(lote) == 1:
+                _, _, futuro = lote[0]
+                if not futuro.done():
+                    futuro.set_exception(e)
+                return
+            logger.warning(
+                f"Falha no lote agrupado de {self.modelo.__name__} ({len(lote)} registros); "
+                f"gravando individualmente: {e}"
+            )
+            for item in lote:
+                await self._gravar([item])
+            return
+
+        for (_, _, futuro), objeto in zip(lote, objetos):
+            if not futuro.done():
+                futuro.set_result(objeto)
+        logger.info(f"Lote agrupado de {self.modelo.__name__} gravado: {len(objetos)} registros em um commit")
+
+
+_agrupadores: Dict[type, AgrupadorInsercoes] = {}
+
+
+def agrupador_para(modelo, antes: Optional[Antes] = None, depois: Optional[Depois] = None) -> AgrupadorInsercoes:
+    # Um agrupador por modelo; os ganchos são os da primeira chamada (cada modelo tem um
+    # único handler de criação).
+    if modelo not in _agrupadores:
+        _agrupadores[modelo] = AgrupadorInsercoes(modelo, antes=antes, depois=depois)
+    return _agrupadores[modelo]
+
+
+async def encerrar_agrupadores():
+    for agrupador in _agrupadores.values():
+        await agrupador.encerrar()
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import os
+import time
+from datetime import date
+from typing import Tuple
+from sqlalchemy import delete, func, insert, select, union_all
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models import (
+    Pagamento, PagamentoArquivado, Pedido, PedidoArquivado, PedidoLivroLink, PedidoLivroLinkArquivado, PedidoView
+)
+from app.particoes import inicio_do_mes, somar_meses
+from app.transacao import unidade_de_trabalho
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+# Pedidos com data_pedido anterior ao início do mês de N meses atrás vão, com seus vínculos
+# de livros e pagamento, para as tabelas *_arquivado. Corte em início de mês: as partições
+# antigas ficam vazias e podem ser desanexadas (python -m app.particoes --reter-meses).
+ARQUIVAMENTO_MESES = int(os.getenv("ARQUIVAMENTO_MESES", "24"))
+ARQUIVAMENTO_LOTE = int(os.getenv("ARQUIVAMENTO_LOTE", "1000"))
+ARQUIVAMENTO_PAUSA_MS = float(os.getenv("ARQUIVAMENTO_PAUSA_MS", "200"))
+
+
+def _uniao(quente, frio, nome: str):
+    colunas = [coluna.name for coluna in quente.columns]
+    return union_all(select(*quente.columns), select(*(frio.c[coluna] for coluna in colunas))).subquery(nome)
+
+
+# Uniões criadas uma vez: condições montadas sobre tabela_pedidos(True).c valem em
+# qualquer consulta que use o mesmo objeto como origem.
+_PEDIDOS_COM_ARQUIVO = _uniao(Pedido.__table__, PedidoArquivado.__table__, "pedido")
+_PAGAMENTOS_COM_ARQUIVO = _uniao(Pagamento.__table__, PagamentoArquivado.__table__, "pagamento")
+_VINCULOS_COM_ARQUIVO = _uniao(PedidoLivroLink.__table__, PedidoLivroLinkArquivado.__table__, "pedidolivrolink")
+
+
+def tabela_pedidos(incluir_arquivados: bool = False):
+    # Origem das leituras de pedido: a tabela quente ou a união com o arquivo, com as
+    # mesmas colunas. Filtros sobre as colunas da união chegam às duas tabelas.
+    return _PEDIDOS_COM_ARQUIVO if incluir_arquivados else Pedido.__table__
+
+
+def tabela_pagamentos(incluir_arquivados: bool = False):
+    return _PAGAMENTOS_COM_ARQUIVO if incluir_arquivados else Pagamento.__table__
+
+
+def tabela_vinculos(incluir_arquivados: bool = False):
+    return _VINCULOS_COM_ARQUIVO if incluir_arquivados else PedidoLivroLink.__table__
+
+
+def data_corte(meses: int, hoje: date = None) -> date:
+    return somar_meses(inicio_do_mes(hoje or date.today()), -meses)
+
+
+async def _mover(session: AsyncSession, origem, destino, *condicoes):
+    colunas = [coluna.name for coluna in origem.__table__.columns]
+    await session.execute(
+        insert(destino.__table__).from_select(colunas, select(*origem.__table__.columns).where(*condicoes))
+    )
+    await session.execute(delete(origem.__table__).where(*condicoes))
+
+
+async def _arquivar_lote(session: AsyncSession, corte: date, lote: int) -> Tuple[int, int]:
+    # Trava os pedidos do lote (pulando os que estão sendo alterados agora) e os pagamentos
+    # deles, e move tudo na mesma transação: nenhuma escrita concorrente se perde entre a
+    # cópia e a remoção.
+    result = await session.execute(
+        select(Pedido.id)
+        .where(Pedido.data_pedido < corte)
+        .order_by(Pedido.data_pedido, Pedido.id)
+        .limit(lote)
+        .with_for_update(skip_locked=True)
+    )
+    pedido_ids = result.scalars().all()
+    if not pedido_ids:
+        return 0, 0
+    result = await session.execute(
+        select(Pagamento.id).where(Pagamento.pedido_id.in_(pedido_ids)).with_for_update()
+    )
+    pagamento_ids = result.scalars().all()
+
+    # Nenhuma FK aponta para pedido_arquivado (nem para pedido): a integridade vem das
+    # travas acima. Dependentes antes do pedido, na mesma ordem dos deletes.
+    await _mover(session, PedidoLivroLink, PedidoLivroLinkArquivado, PedidoLivroLink.pedido_id.in_(pedido_ids))
+    if pagamento_ids:
+        await _mover(session, Pagamento, PagamentoArquivado, Pagamento.id.in_(pagamento_ids))
+    # data_pedido < corte repetido na remoção: o planner só visita as partições antigas.
+    await _mover(session, Pedido, PedidoArquivado, Pedido.id.in_(pedido_ids), Pedido.data_pedido < corte)
+    # pedido_view é modelo de leitura das tabelas quentes.
+    await session.execute(delete(PedidoView).where(PedidoView.pedido_id.in_(pedido_ids)))
+    return len(pedido_ids), len(pagamento_ids)
+
+
+async def arquivar(
+    engine,
+    meses: int = ARQUIVAMENTO_MESES,
+    lote: int = ARQUIVAMENTO_LOTE,
+    pausa_ms: float = ARQUIVAMENTO_PAUSA_MS,
+    dry_run: bool = False,
+    hoje: date = None,
+) -> Tuple[int, int]:
+    corte = data_corte(meses, hoje)
+    if dry_run:
+        async with engine.connect() as conn:
+            pedidos = await conn.scalar(select(func.count()).select_from(Pedido).where(Pedido.data_pedido < corte))
+        logger.info(f"[dry-run] Arquivamento: {pedidos} pedido(s) anteriores a {corte}")
+        return pedidos, 0
+
+    total_pedidos = total_pagamentos = 0
+    inicio = time.perf_counter()
+    async with AsyncSession(engine) as session:
+        while True:
+            pedidos, pagamentos = await unidade_de_trabalho(
+                session, lambda: _arquivar_lote(session, corte, lote), "arquivar pedidos"
+            )
+            if not pedidos:
+                break
+            total_pedidos += pedidos
+            total_pagamentos += pagamentos
+            logger.info(f"Arquivamento: {total_pedidos} pedido(s) e {total_pagamentos} pagamento(s) movidos até agora")
+            # Lotes curtos com pausa: os locks de linha e o I/O não disputam com o tráfego.
+            await asyncio.sleep(pausa_ms / 1000)
+    logger.info(
+        f"Arquivamento concluído: {total_pedidos} pedido(s) e {total_pagamentos} pagamento(s) "
+        f"anteriores a {corte} em {time.perf_counter() - inicio:.1f}s"
+    )
+    return total_pedidos, total_pagamentos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move pedidos antigos e seus pagamentos para as tabelas de arquivo")
+    parser.add_argument("--meses", type=int, default=ARQUIVAMENTO_MESES, help="Mantém nas tabelas quentes os últimos N meses")
+    parser.add_argument("--lote", type=int, default=ARQUIVAMENTO_LOTE, help="Pedidos por transação")
+    parser.add_argument("--pausa-ms", type=float, default=ARQUIVAMENTO_PAUSA_MS, help="Pausa entre lotes")
+    parser.add_argument("--dry-run", action="store_true", help="Apenas conta os pedidos a arquivar")
+    args = parser.parse_args()
+
+    from app.database import engine
+    asyncio.run(arquivar(engine, args.meses, args.lote, args.pausa_ms, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import asyncio
+import heapq
+import os
+import re
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, select
+from app.arquivamento import tabela_vinculos
+from app.database import async_session
+from app.invalidacao import assinar
+from app.models import Autor, Editora, Livro, PedidoLivroLink
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+AUTOCOMPLETE_LIMITE_PADRAO = int(os.getenv("AUTOCOMPLETE_LIMITE_PADRAO", "10"))
+# Prefixos curtos casam com boa parte do índice; o top-N deles fica em cache até uma escrita
+# mudar algum texto ou popularidade que comece com eles.
+AUTOCOMPLETE_PREFIXO_CACHE = int(os.getenv("AUTOCOMPLETE_PREFIXO_CACHE", "3"))
+AUTOCOMPLETE_CACHE_MAX = int(os.getenv("AUTOCOMPLETE_CACHE_MAX", "5000"))
+
+TIPOS = ("livro", "autor", "editora")
+
+Alvo = Tuple[str, int]
+
+
+def normalizar(texto: str) -> str:
+    # Sem acentos, sem diferença de caixa e com espaços simples: "Érico  Veríssimo" -> "erico verissimo".
+    decomposto = unicodedata.normalize("NFKD", texto)
+    sem_acento = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", sem_acento.casefold()).strip()
+
+
+def chaves_de(texto: str) -> List[str]:
+    # Uma chave por início de palavra, para "senhor d" encontrar "O Senhor dos Anéis".
+    normalizado = normalizar(texto)
+    palavras = normalizado.split(" ")
+    return sorted({" ".join(palavras[i:]) for i in range(len(palavras)) if palavras[i]})
+
+
+class IndicePrefixos:
+    # Array ordenado de chaves normalizadas com busca binária; cada chave aponta para
+    # (tipo, id). Inserções e remoções usam bisect e mantêm a ordenação.
+
+    def __init__(self, textos: List[Tuple[str, int, str]] = ()):
+        # Carga inicial ordenada de uma vez; inserir chave a chave custaria O(n²).
+        self._entradas: Dict[Alvo, Tuple[str, List[str]]] = {
+            (tipo, id): (texto, chaves_de(texto)) for tipo, id, texto in textos
+        }
+        pares = sorted((chave, alvo) for alvo, (_, chaves) in self._entradas.items() for chave in chaves)
+        self._chaves: List[str] = [chave for chave, _ in pares]
+        self._alvos: List[Alvo] = [alvo for _, alvo in pares]
+        self.popularidade: Dict[Alvo, int] = {alvo: 0 for alvo in self._entradas}
+        # livro -> (autor_id, editora_id), para repassar vendas do livro ao autor e à editora
+        self._livros: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
+        # prefixo -> {(limite, tipos): resultado}
+        self._cache: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._chaves)
+
+    def gravar(self, tipo: str, id: int, texto: str):
+        self._invalidar((tipo, id))
+        self._remover_chaves((tipo, id))
+        chaves = chaves_de(texto)
+        for chave in chaves:
+            posicao = bisect_left(self._chaves, chave)
+            self._chaves.insert(posicao, chave)
+            self._alvos.insert(posicao, (tipo, id))
+        self._entradas[(tipo, id)] = (texto, chaves)
+        self.popularidade.setdefault((tipo, id), 0)
+        self._invalidar((tipo, id))
+
+    def remover(self, tipo: str, id: int):
+        self._invalidar((tipo, id))
+        self._remover_chaves((tipo, id))
+        self._entradas.pop((tipo, id), None)
+        if tipo == "livro":
+            self.vincular_livro(id, None, None)
+            self._livros.pop(id, None)
+        self.popularidade.pop((tipo, id), None)
+
+    def _remover_chaves(self, alvo: Alvo):
+        entrada = self._entradas.get(alvo)
+        if entrada is None:
+            return
+        for chave in entrada[1]:
+            # Só entre as posições da própria chave; se o alvo não está lá, não há o que remover.
+            inicio = bisect_left(self._chaves, chave)
+            fim = bisect_right(self._chaves, chave, lo=inicio)
+            try:
+                posicao = self._alvos.index(alvo, inicio, fim)
+            except ValueError:
+                logger.warning(f"Chave {chave!r} de {alvo} ausente do índice de autocompletar")
+                continue
+            del self._chaves[posicao]
+            del self._alvos[posicao]
+
+    def vincular_livro(self, livro_id: int, autor_id: Optional[int], editora_id: Optional[int]):
+        # Move as vendas do livro do autor/editora antigos para os novos.
+        vendas = self.popularidade.get(("livro", livro_id), 0)
+        antigo_autor, antiga_editora = self._livros.get(livro_id, (None, None))
+        self._somar(("autor", antigo_autor), -vendas)
+        self._somar(("editora", antiga_editora), -vendas)
+        self._livros[livro_id] = (autor_id, editora_id)
+        self._somar(("autor", autor_id), vendas)
+        self._somar(("editora", editora_id), vendas)
+
+    def definir_vendas(self, livro_id: int, vendas: int):
+        # Contagem lida do banco, que já reflete vínculos criados e removidos; a diferença
+        # vai também para o autor e a editora.
+        alvo = ("livro", livro_id)
+        if alvo not in self.popularidade:
+            return
+        diferenca = vendas - self.popularidade[alvo]
+        autor_id, editora_id = self._livros.get(livro_id, (None, None))
+        for item in (alvo, ("autor", autor_id), ("editora", editora_id)):
+            self._somar(item, diferenca)
+
+    def _somar(self, alvo: Alvo, quantidade: int):
+        if alvo[1] is not None and alvo in self.popularidade and quantidade:
+            self.popularidade[alvo] += quantidade
+            self._invalidar(alvo)
+
+    def _invalidar(self, alvo: Alvo):
+        entrada = self._entradas.get(alvo)
+        if entrada is None or not self._cache:
+            return
+        for chave in entrada[1]:
+            for tamanho in range(1, AUTOCOMPLETE_PREFIXO_CACHE + 1):
+                self._cache.pop(chave[:tamanho], None)
+
+    def buscar(self, consulta: str, limite: int, tipos: Tuple[str, ...] = TIPOS) -> List[dict]:
+        prefixo = normalizar(consulta)
+        if not prefixo:
+            return []
+        usa_cache = len(prefixo) <= AUTOCOMPLETE_PREFIXO_CACHE
+        if usa_cache and (limite, tipos) in self._cache.get(prefixo, {}):
+            self._cache.move_to_end(prefixo)
+            return self._cache[prefixo][(limite, tipos)]
+
+        inicio = bisect_left(self._chaves, prefixo)
+        # Todo texto que começa com o prefixo fica antes de prefixo + o maior caractere.
+        fim = bisect_left(self._chaves, prefixo + "\U0010ffff", lo=inicio)
+        candidatos = {alvo for alvo in self._alvos[inicio:fim] if alvo[0] in tipos}
+        melhores = heapq.nsmallest(
+            limite, candidatos, key=lambda alvo: (-self.popularidade.get(alvo, 0), self._entradas[alvo][0], alvo)
+        )
+        resultado = [
+            {"tipo": tipo, "id": id, "texto": self._entradas[(tipo, id)][0], "popularidade": self.popularidade[(tipo, id)]}
+            for tipo, id in melhores
+        ]
+
+        if usa_cache:
+            self._cache.setdefault(prefixo, {})[(limite, tipos)] = resultado
+            self._cache.move_to_end(prefixo)
+            while len(self._cache) > AUTOCOMPLETE_CACHE_MAX:
+                self._cache.popitem(last=False)
+        return resultado
+
+
+def _vinculos():
+    # Vendas contam também os pedidos arquivados: arquivar não muda a popularidade.
+    return tabela_vinculos(incluir_arquivados=True)
+
+
+def _vendas(*condicoes):
+    vinculos = _vinculos()
+    return (
+        select(vinculos.c.livro_id, func.count().label("vendas"))
+        .where(*condicoes)
+        .group_by(vinculos.c.livro_id)
+    )
+
+
+class Autocompletar:
+    def __init__(self):
+        self.indice: Optional[IndicePrefixos] = None
+        self._lock = asyncio.Lock()
+        self._alteracoes: Optional[List[dict]] = None
+        self._carga_inicial: Optional[asyncio.Task] = None
+
+    async def construir(self):
+        async with self._lock:
+            # Eventos que chegam durante a leitura são reaplicados sobre o índice novo; um
+            # "lote" ou "resync" entre eles pede outra leitura.
+            self._alteracoes = []
+            try:
+                indice = await self._ler()
+                while self._alteracoes:
+                    eventos, self._alteracoes = self._alteracoes, []
+                    if any(evento["acao"] in ("resync", "lote") for evento in eventos):
+                        indice = await self._ler()
+                        continue
+                    for evento in eventos:
+                        await self._aplicar(indice, evento)
+            finally:
+                self._alteracoes = None
+            self.indice = indice
+            logger.info(f"Índice de autocompletar construído com {len(indice)} chaves")
+
+    async def _ler(self) -> IndicePrefixos:
+        async with async_session() as session:
+            vendas = _vendas().subquery()
+            livros = await session.execute(
+                select(Livro.id, Livro.titulo, Livro.autor_id, Livro.editora_id, vendas.c.vendas)
+                .outerjoin(vendas, vendas.c.livro_id == Livro.id)
+            )
+            livros = livros.all()
+            autores = await session.execute(select(Autor.id, Autor.nome))
+            editoras = await session.execute(select(Editora.id, Editora.nome))
+            indice = IndicePrefixos(
+                [("autor", id, nome) for id, nome in autores.all()]
+                + [("editora", id, nome) for id, nome in editoras.all()]
+                + [("livro", id, titulo) for id, titulo, _, _, _ in livros]
+            )
+            for id, _, autor_id, editora_id, vendas_livro in livros:
+                indice.popularidade[("livro", id)] = vendas_livro or 0
+                indice.vincular_livro(id, autor_id, editora_id)
+        return indice
+
+    async def garantir_pronto(self) -> IndicePrefixos:
+        if self.indice is None:
+            if self._carga_inicial is None or self._carga_inicial.done():
+                self._carga_inicial = asyncio.create_task(self.construir())
+            await asyncio.shield(self._carga_inicial)
+        return self.indice
+
+    def registrar(self, evento: dict) -> bool:
+        # Guarda o evento para a construção em andamento; False se não há nenhuma.
+        if self._alteracoes is None:
+            return False
+        self._alteracoes.append(evento)
+        return True
+
+    async def atualizar(self, evento: dict):
+        # Toda escrita (deste ou de outro worker) chega pelo barramento; lê a linha afetada.
+        if evento["acao"] in ("resync", "lote"):
+            try:
+                await self.construir()
+            except Exception:
+                logger.error(f"Erro ao reconstruir índice de autocompletar com {evento}", exc_info=True)
+            return
+        async with self._lock:
+            if self.indice is not None:
+                await self._aplicar(self.indice, evento)
+
+    async def _aplicar(self, indice: IndicePrefixos, evento: dict):
+        try:
+            await self._atualizar(indice, evento["entidade"], evento["id"])
+        except Exception:
+            logger.error(f"Erro ao atualizar índice de autocompletar com {evento}", exc_info=True)
+
+    async def _atualizar(self, indice: IndicePrefixos, entidade: str, id: int):
+        async with async_session() as session:
+            if entidade == "pedido":
+                # Recontagem dos livros do pedido em vez de somar: repetir o evento não conta a
+                # venda duas vezes.
+                livros = select(PedidoLivroLink.livro_id).where(PedidoLivroLink.pedido_id == id)
+                result = await session.execute(_vendas(_vinculos().c.livro_id.in_(livros)))
+                for livro_id, vendas in result:
+                    indice.definir_vendas(livro_id, vendas)
+            elif entidade == "livro":
+                livro = (await session.execute(
+                    select(Livro.titulo, Livro.autor_id, Livro.editora_id).where(Livro.id == id)
+                )).first()
+                if livro is None:
+                    indice.remover("livro", id)
+                else:
+                    indice.gravar("livro", id, livro.titulo)
+                    indice.vincular_livro(id, livro.autor_id, livro.editora_id)
+            else:
+                modelo = Autor if entidade == "autor" else Editora
+                nome = await session.scalar(select(modelo.nome).where(modelo.id == id))
+                if nome is None:
+                    indice.remover(entidade, id)
+                else:
+                    indice.gravar(entidade, id, nome)
+
+
+autocompletar = Autocompletar()
+_tarefas = set()
+
+
+def _ao_evento(evento: dict):
+    relevante = (
+        evento["acao"] == "resync"
+        or (evento["entidade"] in TIPOS and (evento["acao"] == "lote" or evento["id"] is not None))
+        or (evento["entidade"] == "pedido" and evento["acao"] == "criado")
+    )
+    # Sem índice e sem construção em andamento o evento pode ser descartado: a próxima
+    # construção lê o estado atual.
+    if relevante and not autocompletar.registrar(evento) and autocompletar.indice is not None:
+        tarefa = asyncio.get_running_loop().create_task(autocompletar.atualizar(evento))
+        _tarefas.add(tarefa)
+        tarefa.add_done_callback(_tarefas.discard)
+
+
+async def iniciar_autocompletar():
+    assinar("*", _ao_evento)
+    tarefa = asyncio.create_task(autocompletar.garantir_pronto())
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
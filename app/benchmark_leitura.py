@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+from fastapi.encoders import jsonable_encoder
+from app.database import async_session
+from app.routes import autores, editoras, livros, pagamentos, pedidos, usuarios
+
+# Compara, chamando os próprios handlers, o caminho ORM (instâncias SQLModel + jsonable_encoder)
+# com o caminho leve de app.leitura (Core + JSON direto). O caminho ORM medido aqui ainda não
+# inclui a validação do response_model que o FastAPI faz por cima, então a diferença real é maior.
+HANDLERS = {
+    "usuarios": (usuarios, usuarios.listar_usuarios, {}),
+    "autores": (autores, autores.listar_autores, {}),
+    "editoras": (editoras, editoras.listar_editoras, {}),
+    "livros": (livros, livros.listar_livros, {"autor_id": None}),
+    "pedidos": (pedidos, pedidos.listar_pedidos, {"usuario_id": None, "incluir_arquivados": False}),
+    "pagamentos": (pagamentos, pagamentos.listar_pagamentos, {"pedido_id": None, "incluir_arquivados": False}),
+}
+
+
+async def _executar(modulo, handler, argumentos: dict, leve: bool) -> bytes:
+    modulo.LEITURA_LEVE = leve
+    async with async_session() as session:
+        resultado = await handler(session=session, **argumentos)
+    if leve:
+        return resultado.body
+    return json.dumps(jsonable_encoder(resultado), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+async def medir(entidade: str, limit: int, repeticoes: int) -> dict:
+    modulo, handler, extras = HANDLERS[entidade]
+    argumentos = {"page": 1, "limit": limit, **extras}
+    original = modulo.LEITURA_LEVE
+    medicoes = {}
+    try:
+        for nome, leve in (("orm", False), ("leve", True)):
+            corpo = await _executar(modulo, handler, argumentos, leve)
+            linhas = len(json.loads(corpo)["items"]) or 1
+
+            inicio_cpu, inicio = time.process_time(), time.perf_counter()
+            for _ in range(repeticoes):
+                await _executar(modulo, handler, argumentos, leve)
+            cpu = (time.process_time() - inicio_cpu) / repeticoes
+            parede = (time.perf_counter() - inicio) / repeticoes
+
+            tracemalloc.start()
+            await _executar(modulo, handler, argumentos, leve)
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            medicoes[nome] = {
+                "linhas": linhas,
+                "ms": round(parede * 1000, 2),
+                "cpu_ms": round(cpu * 1000, 2),
+                "cpu_us_por_linha": round(cpu * 1e6 / linhas, 2),
+                "pico_kb": round(pico / 1024, 1),
+                "bytes": len(corpo),
+            }
+    finally:
+        modulo.LEITURA_LEVE = original
+    return medicoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das listagens: caminho ORM x leitura leve (Core)")
+    parser.add_argument("--entidades", default="pedidos,livros,pagamentos", help="Entidades separadas por vírgula")
+    parser.add_argument("--limit", type=int, default=500, help="Tamanho da página")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    async def executar():
+        for entidade in filter(None, (parte.strip() for parte in args.entidades.split(","))):
+            medicoes = await medir(entidade, args.limit, args.repeticoes)
+            for nome, valores in medicoes.items():
+                print(f"{entidade:<11} {nome:<5} " + "  ".join(f"{chave}={valor}" for chave, valor in valores.items()))
+
+    asyncio.run(executar())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from app.database import async_session
+from app.invalidacao import ORIGEM, assinar
+from app.models import Livro
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+CATALOGO_MEMORIA = os.getenv("CATALOGO_MEMORIA", "false").lower() in ("1", "true", "sim")
+CATALOGO_VERIFICAR = os.getenv("CATALOGO_VERIFICAR", "false").lower() in ("1", "true", "sim")
+# Fração de linhas removidas a partir da qual os arrays são compactados.
+CATALOGO_COMPACTAR = float(os.getenv("CATALOGO_COMPACTAR", "0.25"))
+
+SEM_ID = -1
+
+
+class SnapshotCatalogo:
+    # Cópia colunar de livro em arrays tipados, ordenada por id. genero é codificado como
+    # inteiro (dicionário de strings); ids nulos de autor/editora viram SEM_ID. Remoções
+    # só desligam a linha em "ativo" até a próxima compactação.
+
+    def __init__(self, livros: List[dict]):
+        livros = sorted(livros, key=lambda livro: livro["id"])
+        self.generos: List[str] = []
+        self._codigos: Dict[str, int] = {}
+        n = len(livros)
+        self.tamanho = n
+        self.id = np.array([livro["id"] for livro in livros], dtype=np.int64)
+        self.preco = np.array([livro["preco"] for livro in livros], dtype=np.float64)
+        self.genero = np.array([self._codigo(livro["genero"]) for livro in livros], dtype=np.int32)
+        self.autor_id = np.array([_id_ou_vazio(livro["autor_id"]) for livro in livros], dtype=np.int64)
+        self.editora_id = np.array([_id_ou_vazio(livro["editora_id"]) for livro in livros], dtype=np.int64)
+        self.titulo = np.array([livro["titulo"] for livro in livros], dtype=object)
+        self.ativo = np.ones(n, dtype=bool)
+        self.removidos = 0
+        self._posicao = {int(id_livro): i for i, id_livro in enumerate(self.id)}
+
+    def _codigo(self, genero: str) -> int:
+        codigo = self._codigos.get(genero)
+        if codigo is None:
+            codigo = self._codigos[genero] = len(self.generos)
+            self.generos.append(genero)
+        return codigo
+
+    def gravar(self, livro: dict):
+        posicao = self._posicao.get(livro["id"])
+        if posicao is None:
+            if self.tamanho and livro["id"] < self.id[self.tamanho - 1]:
+                # Id fora de ordem (raro): reconstrói para manter a ordenação.
+                self._reconstruir_com(livro)
+                return
+            posicao = self._acrescentar()
+            self._posicao[livro["id"]] = posicao
+        self.id[posicao] = livro["id"]
+        self.preco[posicao] = livro["preco"]
+        self.genero[posicao] = self._codigo(livro["genero"])
+        self.autor_id[posicao] = _id_ou_vazio(livro["autor_id"])
+        self.editora_id[posicao] = _id_ou_vazio(livro["editora_id"])
+        self.titulo[posicao] = livro["titulo"]
+        self.ativo[posicao] = True
+
+    def remover(self, id_livro: int):
+        posicao = self._posicao.pop(id_livro, None)
+        if posicao is None:
+            return
+        self.ativo[posicao] = False
+        self.removidos += 1
+        if self.removidos > CATALOGO_COMPACTAR * self.tamanho:
+            self._reconstruir_com(None)
+
+    def _acrescentar(self) -> int:
+        if self.tamanho == len(self.id):
+            capacidade = max(16, len(self.id) * 2)
+            for coluna in ("id", "preco", "genero", "autor_id", "editora_id", "titulo", "ativo"):
+                atual = getattr(self, coluna)
+                novo = np.empty(capacidade, dtype=atual.dtype)
+                novo[:self.tamanho] = atual[:self.tamanho]
+                setattr(self, coluna, novo)
+        self.tamanho += 1
+        return self.tamanho - 1
+
+    def _reconstruir_com(self, livro: Optional[dict]):
+        livros = [self._linha(i) for i in np.flatnonzero(self.ativo[:self.tamanho])]
+        if livro is not None:
+            livros = [existente for existente in livros if existente["id"] != livro["id"]] + [livro]
+        self.__init__(livros)
+
+    def _linha(self, i: int) -> dict:
+        return {
+            "id": int(self.id[i]),
+            "titulo": self.titulo[i],
+            "preco": float(self.preco[i]),
+            "genero": self.generos[self.genero[i]],
+            "autor_id": _id_ou_none(self.autor_id[i]),
+            "editora_id": _id_ou_none(self.editora_id[i]),
+        }
+
+    def filtrar(
+        self,
+        genero: Optional[str] = None,
+        preco_min: Optional[float] = None,
+        preco_max: Optional[float] = None,
+        autor_id: Optional[int] = None,
+        editora_id: Optional[int] = None,
+    ) -> np.ndarray:
+        # Mesma semântica de filtrar_livros: genero exato, faixa de preço inclusiva.
+        n = self.tamanho
+        mascara = self.ativo[:n].copy()
+        if genero:
+            codigo = self._codigos.get(genero)
+            if codigo is None:
+                return np.empty(0, dtype=np.int64)
+            mascara &= self.genero[:n] == codigo
+        if preco_min is not None:
+            mascara &= self.preco[:n] >= preco_min
+        if preco_max is not None:
+            mascara &= self.preco[:n] <= preco_max
+        if autor_id:
+            mascara &= self.autor_id[:n] == autor_id
+        if editora_id:
+            mascara &= self.editora_id[:n] == editora_id
+        return np.flatnonzero(mascara)
+
+    def registros(self, posicoes: np.ndarray) -> List[tuple]:
+        # (id, preco, genero, autor_id, editora_id), no formato das linhas lidas do banco.
+        return [
+            (linha["id"], linha["preco"], linha["genero"], linha["autor_id"], linha["editora_id"])
+            for linha in self.linhas(posicoes)
+        ]
+
+    def linhas(self, posicoes: np.ndarray) -> List[dict]:
+        return [self._linha(i) for i in posicoes]
+
+
+def _id_ou_vazio(valor: Optional[int]) -> int:
+    return SEM_ID if valor is None else valor
+
+
+def _id_ou_none(valor) -> Optional[int]:
+    return None if valor == SEM_ID else int(valor)
+
+
+def _dados(livro) -> dict:
+    return {
+        "id": livro.id, "titulo": livro.titulo, "preco": livro.preco, "genero": livro.genero,
+        "autor_id": livro.autor_id, "editora_id": livro.editora_id,
+    }
+
+
+class CatalogoMemoria:
+    def __init__(self):
+        self.snapshot: Optional[SnapshotCatalogo] = None
+        self._lock = asyncio.Lock()
+        self._alteracoes: Optional[List[Tuple[str, object]]] = None
+        self._carga_inicial: Optional[asyncio.Task] = None
+
+    async def carregar(self):
+        async with self._lock:
+            # Alterações feitas durante a leitura são reaplicadas sobre o snapshot novo.
+            self._alteracoes = []
+            try:
+                async with async_session() as session:
+                    result = await session.execute(
+                        select(Livro.id, Livro.titulo, Livro.preco, Livro.genero, Livro.autor_id, Livro.editora_id)
+                    )
+                    livros = [_dados(linha) for linha in result.all()]
+                snapshot = SnapshotCatalogo(livros)
+                for acao, valor in self._alteracoes:
+                    if acao == "gravar":
+                        snapshot.gravar(valor)
+                    else:
+                        snapshot.remover(valor)
+            finally:
+                self._alteracoes = None
+            self.snapshot = snapshot
+            logger.info(f"Catálogo em memória carregado: {len(livros)} livros")
+
+    async def garantir_pronto(self) -> SnapshotCatalogo:
+        if self.snapshot is None:
+            if self._carga_inicial is None or self._carga_inicial.done():
+                self._carga_inicial = asyncio.create_task(self.carregar())
+            await asyncio.shield(self._carga_inicial)
+        return self.snapshot
+
+    def conferir(self, registros_memoria: List[tuple], registros_sql: List[tuple]) -> bool:
+        if registros_memoria == registros_sql:
+            return True
+        ausentes = len(set(registros_sql) - set(registros_memoria))
+        divergentes = len(set(registros_memoria) - set(registros_sql))
+        logger.warning(
+            f"Catálogo em memória divergente do banco ({ausentes} registro(s) ausente(s) ou "
+            f"desatualizado(s), {divergentes} indevido(s)); recarregando"
+        )
+        _agendar(self.carregar())
+        return False
+
+    def gravar(self, livro):
+        dados = _dados(livro)
+        if self._alteracoes is not None:
+            self._alteracoes.append(("gravar", dados))
+        if self.snapshot is not None:
+            self.snapshot.gravar(dados)
+
+    def remover(self, id_livro: int):
+        if self._alteracoes is not None:
+            self._alteracoes.append(("remover", id_livro))
+        if self.snapshot is not None:
+            self.snapshot.remover(id_livro)
+
+
+catalogo = CatalogoMemoria()
+_tarefas = set()
+
+
+def _agendar(coro):
+    tarefa = asyncio.get_running_loop().create_task(coro)
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
+
+
+async def _recarregar_livro(id_livro: int):
+    async with async_session() as session:
+        livro = await session.scalar(select(Livro).where(Livro.id == id_livro))
+    if livro is None:
+        catalogo.remover(id_livro)
+    else:
+        catalogo.gravar(livro)
+
+
+def _ao_evento(evento: dict):
+    if catalogo.snapshot is None:
+        return
+    if evento["acao"] == "resync" or (evento["entidade"] == "livro" and evento["acao"] == "lote"):
+        # Operações em lote não informam ids: recarrega tudo.
+        _agendar(catalogo.carregar())
+    elif evento["entidade"] == "livro" and evento.get("origem") != ORIGEM:
+        # Escritas deste worker já foram aplicadas pelos handlers de livros.
+        _agendar(_recarregar_livro(evento["id"]))
+
+
+async def iniciar_catalogo():
+    if not CATALOGO_MEMORIA:
+        return
+    assinar("*", _ao_evento)
+    _agendar(catalogo.garantir_pronto())
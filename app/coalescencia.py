@@ -0,0 +1,75 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from app.database import sessao_compartilhada
+from app.timeouts import sessao_com_timeout
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+
+class SingleFlight:
+    # Requisições idênticas e simultâneas compartilham uma única execução em andamento.
+    # A execução roda em uma tarefa própria, protegida por shield: se um cliente desconecta,
+    # só a espera dele é cancelada e os demais continuam recebendo o resultado. Quando o
+    # último desiste, a execução é cancelada como seria a de uma requisição só.
+
+    def __init__(self):
+        self._em_voo: Dict[str, asyncio.Task] = {}
+        self._esperando: Dict[str, int] = {}
+
+    async def executar(self, chave: str, funcao: Callable[[], Awaitable]):
+        tarefa = self._em_voo.get(chave)
+        if tarefa is None:
+            tarefa = asyncio.create_task(funcao())
+            self._em_voo[chave] = tarefa
+            self._esperando[chave] = 0
+            tarefa.add_done_callback(lambda t: self._finalizar(chave, t))
+        else:
+            logger.info(f"Requisição coalescida com execução em andamento: {chave}")
+        self._esperando[chave] += 1
+        try:
+            return await asyncio.shield(tarefa)
+        finally:
+            if self._em_voo.get(chave) is tarefa:
+                self._esperando[chave] -= 1
+                if not self._esperando[chave] and not tarefa.done():
+                    tarefa.cancel()
+
+    def _finalizar(self, chave: str, tarefa: asyncio.Task):
+        if self._em_voo.get(chave) is tarefa:
+            del self._em_voo[chave]
+            del self._esperando[chave]
+        # Evita o aviso de exceção não recuperada quando todos os clientes já desistiram.
+        if not tarefa.cancelled():
+            tarefa.exception()
+
+
+single_flight = SingleFlight()
+
+
+def chave_requisicao(request: Request, args: tuple) -> str:
+    # Usa os argumentos já validados pelo FastAPI, então "?limit=10", "?limit=010" e a
+    # ausência do parâmetro (padrão 10) caem na mesma chave.
+    return f"{request.method} {request.url.path}{args!r}"
+
+
+async def compartilhar(request: Request, handler: str, consulta: Callable[..., Awaitable], *args) -> Response:
+    # handler: nome da rota em STATEMENT_TIMEOUT_ROTAS. A sessão vem de sessao_com_timeout,
+    # como nas rotas com Depends; dentro de um /batch a consulta roda na sessão do
+    # trabalhador, sem coalescer: ela enxerga as escritas ainda não confirmadas do batch.
+    def serializar(resultado) -> bytes:
+        return json.dumps(jsonable_encoder(resultado), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    async def executar():
+        async with asynccontextmanager(sessao_com_timeout(handler))() as session:
+            return serializar(await consulta(session, *args))
+
+    if sessao_compartilhada.get() is not None:
+        corpo = await executar()
+    else:
+        corpo = await single_flight.executar(chave_requisicao(request, args), executar)
+    return Response(content=corpo, media_type="application/json")
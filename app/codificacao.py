@@ -0,0 +1,341 @@
+import asyncio
+import json
+import os
+import zlib
+from contextvars import ContextVar
+from typing import Dict, Optional
+import msgpack
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from logs.logger import get_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = get_logger("MyBooks")
+
+COMPRESSAO_ATIVA = os.getenv("COMPRESSAO_ATIVA", "true").lower() in ("1", "true", "sim")
+COMPRESSAO_MINIMO_BYTES = int(os.getenv("COMPRESSAO_MINIMO_BYTES", "1024"))
+# Corpos maiores que isso são comprimidos (ou convertidos para MessagePack) fora do event loop.
+COMPRESSAO_THREAD_BYTES = int(os.getenv("COMPRESSAO_THREAD_BYTES", str(256 * 1024)))
+COMPRESSAO_NIVEL_GZIP = int(os.getenv("COMPRESSAO_NIVEL_GZIP", "6"))
+COMPRESSAO_QUALIDADE_BROTLI = int(os.getenv("COMPRESSAO_QUALIDADE_BROTLI", "4"))
+COMPRESSAO_NIVEL_ZSTD = int(os.getenv("COMPRESSAO_NIVEL_ZSTD", "3"))
+COMPRESSAO_TIPOS = ("application/json", "application/msgpack", "text/")
+# Eventos SSE precisam chegar assim que são enviados: sem espera pelo mínimo.
+TIPOS_TEMPO_REAL = ("text/event-stream",)
+
+MSGPACK_ATIVO = os.getenv("MSGPACK_ATIVO", "true").lower() in ("1", "true", "sim")
+TIPO_MSGPACK = "application/msgpack"
+TIPOS_MSGPACK = (TIPO_MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+
+# Ligada pelo MessagePackMiddleware quando o cliente pediu MessagePack; quem executa rotas
+# com outro Accept (o /batch) desliga.
+msgpack_negociado: ContextVar[bool] = ContextVar("msgpack_negociado", default=False)
+
+
+def _preferencias(valor: str) -> Dict[str, float]:
+    # "gzip, br;q=0.8, *;q=0" -> {"gzip": 1.0, "br": 0.8, "*": 0.0}
+    preferencias = {}
+    for item in filter(None, (parte.strip() for parte in valor.split(","))):
+        nome, *parametros = (parte.strip() for parte in item.split(";"))
+        q = 1.0
+        for parametro in parametros:
+            chave, _, numero = parametro.partition("=")
+            if chave.strip() == "q":
+                try:
+                    q = float(numero)
+                except ValueError:
+                    q = 0.0
+        preferencias[nome.lower()] = q
+    return preferencias
+
+
+def codificacoes_disponiveis():
+    # Em ordem de preferência do servidor quando o cliente aceita várias com o mesmo peso.
+    disponiveis = []
+    if zstandard is not None:
+        disponiveis.append("zstd")
+    if brotli is not None:
+        disponiveis.append("br")
+    disponiveis.append("gzip")
+    return disponiveis
+
+
+CODIFICACOES = codificacoes_disponiveis()
+
+
+def escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    preferencias = _preferencias(accept_encoding)
+    melhor, melhor_q = None, 0.0
+    for codificacao in CODIFICACOES:
+        q = preferencias.get(codificacao, preferencias.get("*", 0.0))
+        if q > melhor_q:
+            melhor, melhor_q = codificacao, q
+    return melhor
+
+
+def prefere_msgpack(accept: str) -> bool:
+    # Opt-in: só quando o cliente pede MessagePack explicitamente com peso >= ao de JSON.
+    preferencias = _preferencias(accept)
+    q_msgpack = max((preferencias.get(tipo, 0.0) for tipo in TIPOS_MSGPACK), default=0.0)
+    return q_msgpack > 0 and q_msgpack >= _q_json(preferencias)
+
+
+def aceita_json(accept: str) -> bool:
+    return not accept or _q_json(_preferencias(accept)) > 0
+
+
+def _q_json(preferencias: Dict[str, float]) -> float:
+    return max(
+        preferencias.get("application/json", 0.0),
+        preferencias.get("application/*", 0.0),
+        preferencias.get("*/*", 0.0),
+    )
+
+
+class Compressor:
+    # Interface comum para gzip, brotli e zstd: parcial() devolve os bytes já prontos para
+    # envio (flush a cada parte, para streaming); final() fecha o fluxo.
+
+    def __init__(self, codificacao: str):
+        self.codificacao = codificacao
+        if codificacao == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=COMPRESSAO_NIVEL_ZSTD).compressobj()
+        elif codificacao == "br":
+            self._obj = brotli.Compressor(quality=COMPRESSAO_QUALIDADE_BROTLI)
+        else:
+            self._obj = zlib.compressobj(COMPRESSAO_NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def parcial(self, dados: bytes) -> bytes:
+        if self.codificacao == "zstd":
+            return self._obj.compress(dados) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if self.codificacao == "br":
+            return self._obj.process(dados) + self._obj.flush()
+        return self._obj.compress(dados) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def final(self, dados: bytes = b"") -> bytes:
+        if self.codificacao == "zstd":
+            return self._obj.compress(dados) + self._obj.flush()
+        if self.codificacao == "br":
+            return self._obj.process(dados) + self._obj.finish()
+        return self._obj.compress(dados) + self._obj.flush(zlib.Z_FINISH)
+
+
+def _para_msgpack(corpo: bytes) -> bytes:
+    return msgpack.packb(json.loads(corpo), use_bin_type=True)
+
+
+class RespostaNegociada(JSONResponse):
+    # Resposta padrão das rotas: com MessagePack negociado, o conteúdo já é serializado
+    # direto nesse formato, sem passar por JSON. O que o msgpack não souber serializar sai
+    # em JSON e ainda passa pela conversão do middleware.
+
+    def render(self, content) -> bytes:
+        if msgpack_negociado.get():
+            try:
+                corpo = msgpack.packb(content, use_bin_type=True)
+            except (TypeError, ValueError):
+                pass
+            else:
+                self.media_type = TIPO_MSGPACK
+                return corpo
+        return super().render(content)
+
+
+async def _executar(funcao, dados: bytes) -> bytes:
+    if len(dados) > COMPRESSAO_THREAD_BYTES:
+        return await asyncio.to_thread(funcao, dados)
+    return funcao(dados)
+
+
+def _adicionar_vary(headers: MutableHeaders, valor: str):
+    atual = headers.get("vary")
+    if atual is None:
+        headers["vary"] = valor
+    elif valor.lower() not in atual.lower():
+        headers["vary"] = f"{atual}, {valor}"
+
+
+class CompressaoMiddleware:
+    # Respostas completas menores que COMPRESSAO_MINIMO_BYTES seguem sem compressão. Em
+    # streaming, as partes são acumuladas até atingir o mínimo; a partir daí cada parte é
+    # comprimida e enviada com flush, sem esperar o fim do corpo. SSE é comprimido desde o
+    # primeiro evento.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD" or not COMPRESSAO_ATIVA:
+            await self.app(scope, receive, send)
+            return
+        codificacao = escolher_codificacao(Headers(scope=scope).get("accept-encoding", ""))
+        if codificacao is None:
+            async def sem_compressao(mensagem):
+                if mensagem["type"] == "http.response.start":
+                    mensagem = {**mensagem, "headers": list(mensagem.get("headers", []))}
+                    _adicionar_vary(MutableHeaders(scope=mensagem), "Accept-Encoding")
+                await send(mensagem)
+
+            await self.app(scope, receive, sem_compressao)
+            return
+
+        inicio = None
+        pendente = []
+        tamanho_pendente = 0
+        compressor: Optional[Compressor] = None
+        direto = False
+
+        def iniciar_compressao(streaming: bool):
+            nonlocal compressor
+            compressor = Compressor(codificacao)
+            headers = MutableHeaders(scope=inicio)
+            headers["content-encoding"] = codificacao
+            if streaming:
+                del headers["content-length"]
+
+        async def enviar(mensagem):
+            nonlocal inicio, tamanho_pendente, direto
+            if direto:
+                await send(mensagem)
+                return
+            if mensagem["type"] == "http.response.start":
+                inicio = {**mensagem, "headers": list(mensagem.get("headers", []))}
+                # Houve negociação: a resposta depende do Accept-Encoding mesmo se sair sem compressão.
+                _adicionar_vary(MutableHeaders(scope=inicio), "Accept-Encoding")
+                headers = Headers(raw=inicio["headers"])
+                tipo = headers.get("content-type", "")
+                tamanho = headers.get("content-length")
+                if (
+                    "content-encoding" in headers
+                    or not tipo.startswith(COMPRESSAO_TIPOS)
+                    or (tamanho is not None and int(tamanho) < COMPRESSAO_MINIMO_BYTES)
+                ):
+                    direto = True
+                    await send(inicio)
+                return
+            if mensagem["type"] != "http.response.body":
+                await send(mensagem)
+                return
+
+            corpo = mensagem.get("body", b"")
+            mais = mensagem.get("more_body", False)
+            if compressor is not None:
+                funcao = compressor.parcial if mais else compressor.final
+                await send({"type": "http.response.body", "body": await _executar(funcao, corpo), "more_body": mais})
+                return
+
+            pendente.append(corpo)
+            tamanho_pendente += len(corpo)
+            tempo_real = Headers(raw=inicio["headers"]).get("content-type", "").startswith(TIPOS_TEMPO_REAL)
+            if not mais and tamanho_pendente < COMPRESSAO_MINIMO_BYTES:
+                # Pequena demais para valer a compressão: envia como veio.
+                corpo = b"".join(pendente)
+                headers = MutableHeaders(scope=inicio)
+                if "content-length" not in headers:
+                    headers["content-length"] = str(len(corpo))
+                await send(inicio)
+                await send({"type": "http.response.body", "body": corpo, "more_body": False})
+                return
+            if mais and tamanho_pendente < COMPRESSAO_MINIMO_BYTES and not tempo_real:
+                return
+
+            corpo = b"".join(pendente)
+            pendente.clear()
+            iniciar_compressao(streaming=mais)
+            if mais:
+                await send(inicio)
+                await send({"type": "http.response.body", "body": compressor.parcial(corpo), "more_body": True})
+            else:
+                comprimido = await _executar(compressor.final, corpo)
+                MutableHeaders(scope=inicio)["content-length"] = str(len(comprimido))
+                await send(inicio)
+                await send({"type": "http.response.body", "body": comprimido, "more_body": False})
+
+        await self.app(scope, receive, enviar)
+
+
+class MessagePackMiddleware:
+    # Negocia MessagePack via Accept. Rotas que usam RespostaNegociada já respondem no
+    # formato; o restante das respostas JSON completas (erros, respostas já serializadas)
+    # é convertido aqui. Respostas em streaming continuam em JSON.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not MSGPACK_ATIVO:
+            await self.app(scope, receive, send)
+            return
+        accept = Headers(scope=scope).get("accept", "")
+        converter = prefere_msgpack(accept)
+
+        inicio = None
+        direto = False
+
+        async def enviar(mensagem):
+            nonlocal inicio, direto
+            if direto:
+                await send(mensagem)
+                return
+            if mensagem["type"] == "http.response.start":
+                inicio = {**mensagem, "headers": list(mensagem.get("headers", []))}
+                headers = MutableHeaders(scope=inicio)
+                tipo = headers.get("content-type", "")
+                if converter and tipo.startswith(TIPO_MSGPACK):
+                    # Já serializada por RespostaNegociada.
+                    _adicionar_vary(headers, "Accept")
+                    direto = True
+                    await send(inicio)
+                elif not tipo.startswith("application/json"):
+                    direto = True
+                    await send(mensagem)
+                elif not converter:
+                    # A mesma URL responde JSON ou MessagePack conforme o Accept.
+                    _adicionar_vary(headers, "Accept")
+                    direto = True
+                    await send(inicio)
+                return
+            if mensagem["type"] != "http.response.body":
+                await send(mensagem)
+                return
+
+            corpo = mensagem.get("body", b"")
+            if mensagem.get("more_body", False) or not corpo:
+                direto = True
+                await send(inicio)
+                await send(mensagem)
+                return
+            try:
+                corpo = await _executar(_para_msgpack, corpo)
+            except ValueError:
+                # Sem conversão a resposta não variou com o Accept: nada de Vary. Quem não
+                # aceita JSON recebe 406 em vez de um formato que não pediu.
+                logger.warning(f"Resposta de {scope['path']} não é JSON válido; enviada sem conversão")
+                if inicio["status"] < 400 and not aceita_json(accept):
+                    corpo = json.dumps({"detail": "Resposta disponível apenas em JSON"}).encode()
+                    inicio = {
+                        "type": "http.response.start", "status": 406,
+                        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(corpo)).encode())],
+                    }
+            else:
+                headers = MutableHeaders(scope=inicio)
+                headers["content-type"] = TIPO_MSGPACK
+                headers["content-length"] = str(len(corpo))
+                _adicionar_vary(headers, "Accept")
+            await send(inicio)
+            await send({"type": "http.response.body", "body": corpo, "more_body": False})
+
+        token = msgpack_negociado.set(converter)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            msgpack_negociado.reset(token)
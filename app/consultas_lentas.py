@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from logs.logger import get_logger, get_rotating_logger
+
+logger = get_logger("MyBooks")
+logger_lento = get_rotating_logger(
+    "consultas_lentas",
+    max_bytes=int(os.getenv("CONSULTA_LENTA_LOG_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("CONSULTA_LENTA_LOG_ARQUIVOS", "5")),
+)
+
+CONSULTA_LENTA_MS = float(os.getenv("CONSULTA_LENTA_MS", "200"))
+CONSULTA_LENTA_AMOSTRA_EXPLAIN = float(os.getenv("CONSULTA_LENTA_AMOSTRA_EXPLAIN", "0.1"))
+CONSULTA_LENTA_EXPLAIN_SIMULTANEOS = int(os.getenv("CONSULTA_LENTA_EXPLAIN_SIMULTANEOS", "2"))
+CONSULTA_LENTA_EXPLAIN_TIMEOUT_MS = int(os.getenv("CONSULTA_LENTA_EXPLAIN_TIMEOUT_MS", "5000"))
+CONSULTA_LENTA_EXPLAIN_LOCK_TIMEOUT_MS = int(os.getenv("CONSULTA_LENTA_EXPLAIN_LOCK_TIMEOUT_MS", "100"))
+
+# Leituras com trava (FOR UPDATE/NO KEY UPDATE/SHARE/KEY SHARE, com ou sem SKIP LOCKED):
+# re-executá-las travaria linhas de produção, então só o plano estimado é capturado.
+_LEITURA_COM_TRAVA = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE)
+
+# scope ASGI da requisição atual; o roteador do Starlette grava "endpoint" e "route" nele.
+_requisicao_atual: ContextVar[Optional[dict]] = ContextVar("requisicao_atual", default=None)
+_sequencia = itertools.count(1)
+_explains_em_andamento = 0
+
+
+class ContextoRequisicaoMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _requisicao_atual.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _requisicao_atual.reset(token)
+
+
+def _origem() -> dict:
+    scope = _requisicao_atual.get()
+    if scope is None:
+        return {"rota": None, "handler": None}
+    rota = scope.get("route")
+    endpoint = scope.get("endpoint")
+    return {
+        "rota": f"{scope['method']} {getattr(rota, 'path', scope['path'])}",
+        "handler": getattr(endpoint, "__name__", None),
+    }
+
+
+def _formato_valor(valor) -> str:
+    if isinstance(valor, (list, tuple)):
+        return f"{type(valor).__name__}[{len(valor)}]"
+    return type(valor).__name__
+
+
+def formato_parametros(parametros, executemany: bool):
+    # Registra apenas tipos e tamanhos, nunca os valores (podem conter dados pessoais).
+    if executemany:
+        return {"execucoes": len(parametros), "formato": formato_parametros(parametros[0], False) if parametros else None}
+    if isinstance(parametros, dict):
+        return {chave: _formato_valor(valor) for chave, valor in parametros.items()}
+    if isinstance(parametros, (list, tuple)):
+        return [_formato_valor(valor) for valor in parametros]
+    return None
+
+
+def _antes(conn, cursor, statement, parameters, context, executemany):
+    context.inicio_consulta = time.perf_counter()
+
+
+def _depois(conn, cursor, statement, parameters, context, executemany):
+    global _explains_em_andamento
+    duracao_ms = (time.perf_counter() - context.inicio_consulta) * 1000
+    if duracao_ms < CONSULTA_LENTA_MS or context.execution_options.get("ignorar_consulta_lenta"):
+        return
+
+    registro = {
+        "id": next(_sequencia),
+        "duracao_ms": round(duracao_ms, 2),
+        **_origem(),
+        "sql": re.sub(r"\s+", " ", statement).strip()[:4000],
+        "parametros": formato_parametros(parameters, executemany),
+    }
+    logger_lento.info(json.dumps(registro, ensure_ascii=False, default=str))
+
+    if (
+        not executemany
+        and conn.dialect.name == "postgresql"
+        and statement.lstrip().upper().startswith("SELECT")
+        and _explains_em_andamento < CONSULTA_LENTA_EXPLAIN_SIMULTANEOS
+        and random.random() < CONSULTA_LENTA_AMOSTRA_EXPLAIN
+    ):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # Contado já aqui: várias consultas lentas no mesmo ciclo do loop veem a vaga ocupada.
+        _explains_em_andamento += 1
+        loop.create_task(_explicar(conn.engine, registro["id"], statement, parameters))
+
+
+async def _explicar(engine_sincrono, id_registro: int, statement: str, parameters):
+    global _explains_em_andamento
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+    try:
+        engine = AsyncEngine(engine_sincrono)
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(ignorar_consulta_lenta=True)
+            # EXPLAIN ANALYZE executa a consulta de novo; a transação é sempre desfeita e os
+            # timeouts impedem que ela fique na fila de travas de quem está escrevendo.
+            async with conn.begin() as transacao:
+                await conn.exec_driver_sql(f"SET LOCAL lock_timeout = {CONSULTA_LENTA_EXPLAIN_LOCK_TIMEOUT_MS}")
+                await conn.exec_driver_sql(f"SET LOCAL statement_timeout = {CONSULTA_LENTA_EXPLAIN_TIMEOUT_MS}")
+                opcoes = "" if _LEITURA_COM_TRAVA.search(statement) else "(ANALYZE, BUFFERS) "
+                result = await conn.exec_driver_sql(f"EXPLAIN {opcoes}{statement}", parameters)
+                plano = "\n".join(linha[0] for linha in result.all())
+                await transacao.rollback()
+        logger_lento.info(json.dumps({"id": id_registro, "plano": plano}, ensure_ascii=False))
+    except Exception as e:
+        logger.warning(f"Falha ao capturar plano da consulta lenta {id_registro}: {e}")
+    finally:
+        _explains_em_andamento -= 1
+
+
+def registrar_consultas_lentas(engine):
+    alvo = getattr(engine, "sync_engine", engine)
+    event.listen(alvo, "before_cursor_execute", _antes)
+    event.listen(alvo, "after_cursor_execute", _depois)
@@ -1,22 +1,59 @@
 from sqlmodel import SQLModel, create_engine
 from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
-from typing import AsyncGenerator
+from sqlalchemy.pool import StaticPool
+from contextvars import ContextVar
+from typing import AsyncGenerator, Optional
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "sim")
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+SQLITE_BUSY_TIMEOUT_S = float(os.getenv("SQLITE_BUSY_TIMEOUT_S", "30"))
+
+
+def _opcoes_engine(url: str) -> dict:
+    # SQLite embutido (sqlite+aiosqlite:///arquivo.db) para testes e benchmarks locais.
+    if not url.startswith("sqlite"):
+        return {}
+    opcoes = {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_S}}
+    if ":memory:" in url or url.rstrip("/").endswith(":"):
+        # Cada conexão teria um banco vazio próprio: todas as sessões usam a mesma conexão.
+        opcoes["poolclass"] = StaticPool
+    return opcoes
+
+
+engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO, future=True, **_opcoes_engine(DATABASE_URL))
+DIALETO = engine.dialect.name
+EH_SQLITE = DIALETO == "sqlite"
+
+if EH_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _configurar_sqlite(conexao, _):
+        cursor = conexao.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        # WAL: leitores não bloqueiam o escritor (sem efeito em banco em memória).
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
+# Sessão já aberta que handlers de leitura devem reaproveitar (usada por POST /batch).
+sessao_compartilhada: ContextVar[Optional[AsyncSession]] = ContextVar("sessao_compartilhada", default=None)
+
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    compartilhada = sessao_compartilhada.get()
+    if compartilhada is not None:
+        yield compartilhada
+        return
     async with async_session() as session:
         yield session
 
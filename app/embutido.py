@@ -0,0 +1,59 @@
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import List
+from sqlalchemy import event
+from sqlmodel import SQLModel
+from app.database import EH_SQLITE, engine
+from app.invalidacao import publicar
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+# App inteira em processo sobre SQLite embutido, para testes, benchmarks e orçamentos de
+# consultas sem Postgres. DATABASE_URL precisa apontar para sqlite+aiosqlite antes do
+# primeiro import de app.* (ver tests/conftest.py).
+
+
+def _exigir_sqlite():
+    # O schema é apagado e recriado: nunca contra o banco configurado para produção.
+    if not EH_SQLITE:
+        raise RuntimeError("app.embutido só roda sobre SQLite (DATABASE_URL=sqlite+aiosqlite:///...)")
+
+
+async def recriar_banco():
+    _exigir_sqlite()
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+    # Catálogo, facetas, autocompletar e recomendações em memória são refeitos do banco vazio.
+    await publicar("*", "resync")
+
+
+@asynccontextmanager
+async def app_embutido():
+    _exigir_sqlite()
+    import httpx
+    from app.main import app
+
+    inicio = time.perf_counter()
+    await recriar_banco()
+    async with app.router.lifespan_context(app):
+        transporte = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://embutido") as cliente:
+            logger.info(f"App embutido pronto em {(time.perf_counter() - inicio) * 1000:.1f}ms")
+            yield cliente
+
+
+@contextmanager
+def contar_consultas():
+    # Instruções SQL enviadas ao banco dentro do bloco, para testes de orçamento de consultas.
+    consultas: List[str] = []
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        consultas.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", registrar)
+    try:
+        yield consultas
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", registrar)
@@ -0,0 +1,57 @@
+from typing import List, Optional
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as insert_postgres
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import EH_SQLITE
+
+# Escritas em uma única instrução com RETURNING: o 404 vem do resultado vazio, sem SELECT
+# prévio, e a linha gravada volta na mesma ida ao banco, sem refresh. Quem chama faz o commit.
+
+
+async def inserir_retornando(session: AsyncSession, modelo, dados: dict):
+    result = await session.execute(insert(modelo).values(**dados).returning(modelo))
+    return result.scalar_one()
+
+
+async def atualizar_retornando(session: AsyncSession, modelo, id: int, dados: dict, *condicoes):
+    # condicoes restringem a linha atualizada (ex.: transição de status); sem linha que as
+    # satisfaça o resultado é None, como para id inexistente.
+    if not dados:
+        # UPDATE sem SET é inválido; um PATCH vazio só devolve o registro atual.
+        result = await session.execute(select(modelo).where(modelo.id == id, *condicoes))
+        return result.scalar_one_or_none()
+    stmt = update(modelo).where(modelo.id == id, *condicoes).values(**dados).returning(modelo)
+    result = await session.execute(stmt, execution_options={"populate_existing": True})
+    return result.scalar_one_or_none()
+
+
+async def deletar_retornando(session: AsyncSession, modelo, id: int, *condicoes) -> Optional[int]:
+    stmt = delete(modelo).where(modelo.id == id, *condicoes).returning(modelo.id)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def desvincular_retornando(session: AsyncSession, modelo, coluna, id: int) -> List[int]:
+    # Zera a FK `coluna` das linhas de `modelo` que apontam para id, como o delete do ORM
+    # fazia com os filhos antes de remover o pai. Devolve as chaves das linhas alteradas.
+    stmt = update(modelo).where(coluna == id).values({coluna.key: None}).returning(modelo.id)
+    result = await session.execute(stmt, execution_options={"synchronize_session": False})
+    return result.scalars().all()
+
+
+async def travar_retornando(session: AsyncSession, modelo, *condicoes) -> List[int]:
+    # SELECT ... FOR UPDATE, em ordem de id, das linhas que satisfazem condicoes; a trava
+    # vale até o commit. O SQLite ignora FOR UPDATE: lá um UPDATE sem efeito abre antes a
+    # transação de escrita, que só uma conexão tem por vez, e as leituras seguintes já veem
+    # o último commit.
+    if EH_SQLITE:
+        stmt = update(modelo).where(*condicoes).values(id=modelo.id)
+        await session.execute(stmt, execution_options={"synchronize_session": False})
+    result = await session.execute(select(modelo.id).where(*condicoes).order_by(modelo.id).with_for_update())
+    return result.scalars().all()
+
+
+def insert_com_conflito(tabela):
+    # INSERT com ON CONFLICT (on_conflict_do_update/do_nothing, excluded) do dialeto em uso.
+    return insert_sqlite(tabela) if EH_SQLITE else insert_postgres(tabela)
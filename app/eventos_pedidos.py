@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from sqlalchemy import delete, exists, func, insert, literal, select, union_all
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import async_session
+from app.invalidacao import assinar
+from app.models import Pagamento, Pedido, PedidoEvento, PedidoView
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+EVENTOS_HEARTBEAT_S = float(os.getenv("EVENTOS_HEARTBEAT_S", "15"))
+# O barramento acorda o leitor a cada escrita; a varredura periódica só cobre eventos perdidos.
+EVENTOS_VARREDURA_S = float(os.getenv("EVENTOS_VARREDURA_S", "5"))
+EVENTOS_BLOCO = int(os.getenv("EVENTOS_BLOCO", "500"))
+EVENTOS_FILA_MAX = int(os.getenv("EVENTOS_FILA_MAX", "1000"))
+# Ids do outbox ainda não visíveis (transação aberta) são esperados por esse tempo.
+EVENTOS_LACUNA_S = float(os.getenv("EVENTOS_LACUNA_S", "30"))
+EVENTOS_RETENCAO_HORAS = int(os.getenv("EVENTOS_RETENCAO_HORAS", "72"))
+EVENTOS_RETRY_MS = int(os.getenv("EVENTOS_RETRY_MS", "3000"))
+
+ENTIDADES = ("pedido", "pagamento")
+COLUNAS_EVENTO = ["entidade", "acao", "registro_id", "pedido_id", "usuario_id", "status"]
+
+
+async def registrar_eventos(session: AsyncSession, entidade: str, acao: str, ids: Iterable[int]):
+    # Grava no outbox, na transação do chamador, um evento por registro afetado. Deve ser
+    # chamado antes de sincronizar pedido_view: para registros já removidos, o último
+    # usuario_id/status conhecido ainda está lá.
+    ids = sorted(set(ids))
+    if not ids:
+        return
+    if entidade == "pedido":
+        atuais = select(Pedido.id, Pedido.id, Pedido.usuario_id, Pedido.status).where(Pedido.id.in_(ids))
+        removidos = select(
+            PedidoView.pedido_id, PedidoView.pedido_id, PedidoView.usuario_id, PedidoView.status
+        ).where(PedidoView.pedido_id.in_(ids), ~exists().where(Pedido.id == PedidoView.pedido_id))
+    else:
+        atuais = (
+            select(Pagamento.id, Pagamento.pedido_id, Pedido.usuario_id, Pedido.status)
+            .outerjoin(Pedido, Pedido.id == Pagamento.pedido_id)
+            .where(Pagamento.id.in_(ids))
+        )
+        removidos = select(
+            PedidoView.pagamento_id, PedidoView.pedido_id, PedidoView.usuario_id, PedidoView.status
+        ).where(PedidoView.pagamento_id.in_(ids), ~exists().where(Pagamento.id == PedidoView.pagamento_id))
+    origem = union_all(atuais, removidos).subquery()
+    await session.execute(insert(PedidoEvento).from_select(
+        COLUNAS_EVENTO,
+        select(literal(entidade), literal(acao), *origem.c).order_by(origem.c[0]),
+    ))
+
+
+def _evento(linha) -> dict:
+    return {
+        "id": linha.id,
+        "entidade": linha.entidade,
+        "acao": linha.acao,
+        "registro_id": linha.registro_id,
+        "pedido_id": linha.pedido_id,
+        "usuario_id": linha.usuario_id,
+        "status": linha.status,
+        "criado_em": linha.criado_em.isoformat(),
+    }
+
+
+def _condicoes(usuario_id: Optional[int], status: Optional[List[str]]) -> list:
+    condicoes = []
+    if usuario_id is not None:
+        condicoes.append(PedidoEvento.usuario_id == usuario_id)
+    if status:
+        condicoes.append(PedidoEvento.status.in_(status))
+    return condicoes
+
+
+async def ler_eventos(desde: int, *condicoes, limite: int = EVENTOS_BLOCO) -> List[dict]:
+    async with async_session() as session:
+        result = await session.execute(
+            select(PedidoEvento.__table__)
+            .where(PedidoEvento.id > desde, *condicoes)
+            .order_by(PedidoEvento.id)
+            .limit(limite)
+        )
+        return [_evento(linha) for linha in result]
+
+
+async def ler_eventos_por_id(ids: List[int]) -> List[dict]:
+    async with async_session() as session:
+        result = await session.execute(
+            select(PedidoEvento.__table__).where(PedidoEvento.id.in_(ids)).order_by(PedidoEvento.id)
+        )
+        return [_evento(linha) for linha in result]
+
+
+class Assinante:
+    # Uma conexão do feed. A fila é limitada: quem não consome a tempo perde a fila e
+    # volta a ler do outbox a partir do primeiro evento descartado.
+
+    def __init__(self, usuario_id: Optional[int] = None, status: Optional[List[str]] = None):
+        self.usuario_id = usuario_id
+        self.status = set(status or ())
+        self.fila = deque()
+        self.sinal = asyncio.Event()
+        self.retomar_de: Optional[int] = None
+
+    def aceita(self, evento: dict) -> bool:
+        if self.usuario_id is not None and evento["usuario_id"] != self.usuario_id:
+            return False
+        return not self.status or evento["status"] in self.status
+
+    def entregar(self, evento: dict):
+        if not self.aceita(evento):
+            return
+        if self.retomar_de is None:
+            if len(self.fila) < EVENTOS_FILA_MAX:
+                self.fila.append(evento)
+                self.sinal.set()
+                return
+            self.retomar_de = min(item["id"] for item in self.fila) - 1
+            self.fila.clear()
+            logger.warning("Feed de eventos: assinante atrasado; retomando pelo outbox")
+        self.retomar_de = min(self.retomar_de, evento["id"] - 1)
+        self.sinal.set()
+
+
+class DistribuidorEventos:
+    # Um único leitor do outbox por worker, ativo enquanto houver conexões: acordado pelo
+    # barramento, lê as linhas novas e repassa às filas dos assinantes. Os ids vêm de uma
+    # sequence e transações concorrentes fazem commit fora de ordem, então um id ausente
+    # abaixo do maior já lido fica aguardando (lacuna) por até EVENTOS_LACUNA_S. Cada
+    # varredura lê só o que passa do cursor (maior id já lido) e consulta as lacunas pelo id.
+
+    def __init__(self):
+        self.assinantes = set()
+        self._acordar = asyncio.Event()
+        self._tarefa: Optional[asyncio.Task] = None
+        self._cursor = 0
+        self._lacunas: Dict[int, float] = {}
+
+    def acordar(self):
+        self._acordar.set()
+
+    def adicionar(self, assinante: Assinante):
+        self.assinantes.add(assinante)
+        if self._tarefa is None or self._tarefa.done():
+            self._tarefa = asyncio.create_task(self._executar())
+
+    def remover(self, assinante: Assinante):
+        self.assinantes.discard(assinante)
+        if not self.assinantes and self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+
+    async def encerrar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+
+    async def _iniciar(self):
+        # Parte do fim do outbox; ids recentes ainda não visíveis já entram como lacunas.
+        async with async_session() as session:
+            maximo = await session.scalar(select(func.max(PedidoEvento.id))) or 0
+            result = await session.execute(
+                select(PedidoEvento.id).where(PedidoEvento.id > maximo - EVENTOS_BLOCO)
+            )
+            visiveis = set(result.scalars().all())
+        prazo = time.monotonic() + EVENTOS_LACUNA_S
+        self._cursor = maximo
+        self._lacunas = {
+            id: prazo for id in range(max(maximo - EVENTOS_BLOCO, 0) + 1, maximo + 1) if id not in visiveis
+        }
+
+    async def _executar(self):
+        while True:
+            try:
+                await self._iniciar()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error("Erro ao iniciar o leitor do feed de eventos", exc_info=True)
+                await asyncio.sleep(EVENTOS_VARREDURA_S)
+        while True:
+            try:
+                await asyncio.wait_for(self._acordar.wait(), EVENTOS_VARREDURA_S)
+            except asyncio.TimeoutError:
+                pass
+            self._acordar.clear()
+            try:
+                await self._varrer()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error("Erro ao ler o outbox de eventos de pedido", exc_info=True)
+
+    def _distribuir(self, evento: dict):
+        for assinante in list(self.assinantes):
+            assinante.entregar(evento)
+
+    async def _varrer(self):
+        await self._conferir_lacunas()
+        while True:
+            eventos = await ler_eventos(self._cursor)
+            prazo = time.monotonic() + EVENTOS_LACUNA_S
+            for evento in eventos:
+                # Só os últimos EVENTOS_BLOCO ids de um salto viram lacuna: um salto maior é
+                # da sequence, não de transações abertas.
+                for id in range(max(self._cursor + 1, evento["id"] - EVENTOS_BLOCO), evento["id"]):
+                    self._lacunas[id] = prazo
+                self._cursor = evento["id"]
+                self._distribuir(evento)
+            if len(eventos) < EVENTOS_BLOCO:
+                return
+
+    async def _conferir_lacunas(self):
+        # Transação desfeita ou aberta por tempo demais: o id não vai mais aparecer.
+        agora = time.monotonic()
+        for id in [id for id, prazo in self._lacunas.items() if prazo <= agora]:
+            del self._lacunas[id]
+        pendentes = sorted(self._lacunas)
+        for inicio in range(0, len(pendentes), EVENTOS_BLOCO):
+            for evento in await ler_eventos_por_id(pendentes[inicio:inicio + EVENTOS_BLOCO]):
+                del self._lacunas[evento["id"]]
+                self._distribuir(evento)
+
+
+distribuidor = DistribuidorEventos()
+
+
+def _formatar(evento: dict) -> str:
+    dados = json.dumps(evento, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {evento['id']}\nevent: {evento['entidade']}.{evento['acao']}\ndata: {dados}\n\n"
+
+
+async def transmitir(
+    usuario_id: Optional[int] = None, status: Optional[List[str]] = None, desde: Optional[int] = None
+) -> AsyncIterator[str]:
+    # Entrega pelo menos uma vez: após reconexão (ou eventos fora de ordem) um evento pode
+    # se repetir; o id identifica duplicatas.
+    condicoes = _condicoes(usuario_id, status)
+    assinante = Assinante(usuario_id, status)
+    # Assina antes de ler o histórico: nada commitado durante a leitura fica de fora.
+    distribuidor.adicionar(assinante)
+    enviados = deque(maxlen=EVENTOS_FILA_MAX * 2)
+    try:
+        yield f"retry: {EVENTOS_RETRY_MS}\n\n"
+        if desde is not None:
+            async with async_session() as session:
+                menor, maior = (await session.execute(
+                    select(func.min(PedidoEvento.id), func.max(PedidoEvento.id))
+                )).one()
+            # desde desconhecido (eventos seguintes já expurgados, outbox vazio, id além do
+            # último gravado): o cliente precisa recarregar o estado.
+            if menor is None:
+                desconhecido = desde > 0
+            else:
+                desconhecido = desde + 1 < menor or desde > maior
+            if desconhecido:
+                yield "event: reset\ndata: {}\n\n"
+            # Um id além do último gravado não serve de cursor: o feed segue do fim do outbox.
+            assinante.retomar_de = min(desde, maior or 0)
+        while True:
+            if assinante.retomar_de is not None:
+                cursor, assinante.retomar_de = assinante.retomar_de, None
+                while True:
+                    eventos = await ler_eventos(cursor, *condicoes)
+                    for evento in eventos:
+                        if evento["id"] not in enviados:
+                            enviados.append(evento["id"])
+                            yield _formatar(evento)
+                    if len(eventos) < EVENTOS_BLOCO:
+                        break
+                    cursor = eventos[-1]["id"]
+            while assinante.fila:
+                evento = assinante.fila.popleft()
+                if evento["id"] not in enviados:
+                    enviados.append(evento["id"])
+                    yield _formatar(evento)
+            try:
+                await asyncio.wait_for(assinante.sinal.wait(), EVENTOS_HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                # Comentário SSE: mantém a conexão viva em proxies sem gerar evento.
+                yield ": ping\n\n"
+            assinante.sinal.clear()
+    finally:
+        distribuidor.remover(assinante)
+
+
+def _ao_evento(evento: dict):
+    if evento["entidade"] in ENTIDADES or evento["acao"] == "resync":
+        distribuidor.acordar()
+
+
+async def iniciar_eventos_pedidos():
+    assinar("*", _ao_evento)
+
+
+async def encerrar_eventos_pedidos():
+    await distribuidor.encerrar()
+
+
+async def limpar(engine, horas: int = EVENTOS_RETENCAO_HORAS) -> int:
+    limite = datetime.now(timezone.utc) - timedelta(hours=horas)
+    async with engine.begin() as conn:
+        result = await conn.execute(delete(PedidoEvento).where(PedidoEvento.criado_em < limite))
+    logger.info(f"Outbox de eventos: {result.rowcount} evento(s) com mais de {horas}h removido(s)")
+    return result.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção do outbox de eventos de pedido")
+    parser.add_argument("--limpar", action="store_true", required=True, help="Remove eventos antigos")
+    parser.add_argument("--horas", type=int, default=EVENTOS_RETENCAO_HORAS, help="Retenção em horas")
+    args = parser.parse_args()
+
+    from app.database import engine
+
+    asyncio.run(limpar(engine, args.horas))
+
+
+if __name__ == "__main__":
+    main()
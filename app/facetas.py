@@ -0,0 +1,86 @@
+import os
+from collections import OrderedDict
+from typing import List, Optional
+from sqlalchemy import case
+from app.invalidacao import assinar
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+FACETAS_CACHE_MAX = int(os.getenv("FACETAS_CACHE_MAX", "1000"))
+FACETAS_FAIXAS_PRECO = [float(limite) for limite in os.getenv("FACETAS_FAIXAS_PRECO", "25,50,100,200").split(",")]
+
+# Entidades cujas escritas mudam as contagens ou os nomes exibidos nas facetas.
+ENTIDADES_CATALOGO = ("livro", "autor", "editora")
+
+
+def rotulos_faixas() -> List[str]:
+    limites = [0.0] + FACETAS_FAIXAS_PRECO
+    rotulos = [f"{inicio:g}-{fim:g}" for inicio, fim in zip(limites, limites[1:])]
+    return rotulos + [f"{limites[-1]:g}+"]
+
+
+def faixa_preco(coluna):
+    rotulos = rotulos_faixas()
+    return case(
+        *[(coluna < limite, rotulo) for limite, rotulo in zip(FACETAS_FAIXAS_PRECO, rotulos)],
+        else_=rotulos[-1],
+    )
+
+
+def chave_filtros(
+    titulo: Optional[str],
+    genero: Optional[str],
+    preco_min: Optional[float],
+    preco_max: Optional[float],
+    autor_id: Optional[int],
+    editora_id: Optional[int],
+) -> tuple:
+    # Filtros vazios e ids 0 não filtram em _filtros_livro; titulo usa ilike, então a caixa
+    # não importa. Variações equivalentes caem na mesma entrada do cache.
+    return (
+        titulo.lower() if titulo else None,
+        genero or None,
+        None if preco_min is None else float(preco_min),
+        None if preco_max is None else float(preco_max),
+        autor_id or None,
+        editora_id or None,
+    )
+
+
+class CacheFacetas:
+    def __init__(self, maximo: int = FACETAS_CACHE_MAX):
+        self.maximo = maximo
+        self.geracao = 0
+        self._itens: OrderedDict = OrderedDict()
+
+    def obter(self, chave: tuple):
+        valor = self._itens.get(chave)
+        if valor is not None:
+            self._itens.move_to_end(chave)
+        return valor
+
+    def guardar(self, chave: tuple, valor, geracao: int):
+        # Resultado calculado antes de uma invalidação não entra no cache.
+        if geracao != self.geracao:
+            return
+        self._itens[chave] = valor
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.maximo:
+            self._itens.popitem(last=False)
+
+    def limpar(self):
+        self._itens.clear()
+        self.geracao += 1
+
+
+cache_facetas = CacheFacetas()
+
+
+def _ao_evento(evento: dict):
+    if evento["acao"] == "resync" or evento["entidade"] in ENTIDADES_CATALOGO:
+        cache_facetas.limpar()
+
+
+async def iniciar_facetas():
+    assinar("*", _ao_evento)
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+import socket
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+INVALIDACAO_BACKEND = os.getenv("INVALIDACAO_BACKEND", "postgres")
+INVALIDACAO_CANAL = os.getenv("INVALIDACAO_CANAL", "mybooks_invalidacao")
+INVALIDACAO_SOCKET_DIR = os.getenv("INVALIDACAO_SOCKET_DIR", "/tmp/mybooks-invalidacao")
+INVALIDACAO_RECONEXAO_S = float(os.getenv("INVALIDACAO_RECONEXAO_S", "1"))
+
+ORIGEM = f"{socket.gethostname()}:{os.getpid()}"
+
+# entidade -> callbacks; "*" recebe todos os eventos, inclusive o "resync" após reconexão
+_assinantes: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+
+
+def assinar(entidade: str, callback: Callable[[dict], None]):
+    _assinantes[entidade].append(callback)
+
+
+def aplicar(evento: dict):
+    for callback in _assinantes.get(evento["entidade"], []) + _assinantes.get("*", []):
+        try:
+            callback(evento)
+        except Exception:
+            logger.error(f"Erro ao aplicar evento de invalidação {evento}", exc_info=True)
+
+
+def _evento_resync() -> dict:
+    return {"entidade": "*", "acao": "resync", "id": None, "origem": ORIGEM}
+
+
+def _resincronizar():
+    aplicar(_evento_resync())
+
+
+class BarramentoLocal:
+    async def iniciar(self):
+        pass
+
+    async def enviar(self, mensagem: str):
+        pass
+
+    async def encerrar(self):
+        pass
+
+
+class BarramentoPostgres:
+    # LISTEN/NOTIFY em uma conexão asyncpg dedicada, fora do pool do SQLAlchemy.
+
+    def __init__(self, dsn: str, canal: str = INVALIDACAO_CANAL):
+        self.dsn = dsn
+        self.canal = canal
+        self._conexao = None
+        self._lock = asyncio.Lock()
+        self._tarefa = None
+
+    async def iniciar(self):
+        self._tarefa = asyncio.create_task(self._manter_conexao())
+
+    async def _manter_conexao(self):
+        import asyncpg
+
+        primeira = True
+        while True:
+            perdida = asyncio.Event()
+            try:
+                self._conexao = await asyncpg.connect(self.dsn)
+                self._conexao.add_termination_listener(lambda _: perdida.set())
+                await self._conexao.add_listener(self.canal, self._receber)
+                logger.info(f"Barramento de invalidação conectado ao canal {self.canal}")
+                # Eventos publicados enquanto estávamos desconectados se perderam: descarta tudo.
+                if not primeira:
+                    _resincronizar()
+                primeira = False
+                await perdida.wait()
+                logger.warning("Conexão do barramento de invalidação perdida; reconectando")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Falha ao conectar barramento de invalidação: {e}")
+                primeira = False
+            self._conexao = None
+            await asyncio.sleep(INVALIDACAO_RECONEXAO_S)
+
+    def _receber(self, conexao, pid, canal, mensagem):
+        evento = json.loads(mensagem)
+        if evento.get("origem") != ORIGEM:
+            aplicar(evento)
+
+    async def enviar(self, mensagem: str):
+        if self._conexao is None:
+            logger.warning("Barramento de invalidação desconectado; evento não propagado")
+            return
+        async with self._lock:
+            await self._conexao.execute("SELECT pg_notify($1, $2)", self.canal, mensagem)
+
+    async def encerrar(self):
+        if self._tarefa:
+            self._tarefa.cancel()
+        if self._conexao is not None:
+            await self._conexao.close()
+
+
+class _ProtocoloSocket(asyncio.DatagramProtocol):
+    def datagram_received(self, dados, endereco):
+        evento = json.loads(dados)
+        if evento.get("origem") != ORIGEM:
+            aplicar(evento)
+
+
+class BarramentoSocket:
+    # Fallback sem banco: cada worker escuta um socket Unix de datagramas no mesmo diretório
+    # e a publicação é enviada a todos os sockets encontrados nele. Um worker com a fila
+    # cheia perde o evento: fica marcado, não recebe mais eventos avulsos e, assim que a
+    # fila dele esvazia, recebe um "resync", que descarta os caches locais como após uma
+    # reconexão do barramento Postgres.
+
+    def __init__(self, diretorio: str = INVALIDACAO_SOCKET_DIR):
+        self.diretorio = diretorio
+        self.caminho = os.path.join(diretorio, f"{os.getpid()}.sock")
+        self._transporte = None
+        self._envio = None
+        self._sem_resync: Set[str] = set()
+        self._reenvio: Optional[asyncio.Task] = None
+
+    async def iniciar(self):
+        os.makedirs(self.diretorio, exist_ok=True)
+        if os.path.exists(self.caminho):
+            os.unlink(self.caminho)
+        loop = asyncio.get_running_loop()
+        self._transporte, _ = await loop.create_datagram_endpoint(
+            _ProtocoloSocket, local_addr=self.caminho, family=socket.AF_UNIX
+        )
+        self._envio = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._envio.setblocking(False)
+
+    def _entregar(self, caminho: str, dados: bytes) -> bool:
+        # False só para fila cheia.
+        try:
+            self._envio.sendto(dados, caminho)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Worker encerrado sem remover o próprio socket; o que o substituir começa com
+            # os caches vazios.
+            self._sem_resync.discard(caminho)
+            try:
+                os.unlink(caminho)
+            except FileNotFoundError:
+                pass
+        except BlockingIOError:
+            return False
+        return True
+
+    async def enviar(self, mensagem: str):
+        dados = mensagem.encode()
+        for nome in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, nome)
+            if caminho == self.caminho or not nome.endswith(".sock") or caminho in self._sem_resync:
+                continue
+            if not self._entregar(caminho, dados):
+                logger.warning(f"Fila do socket {caminho} cheia; evento descartado, resync pendente")
+                self._sem_resync.add(caminho)
+                if self._reenvio is None or self._reenvio.done():
+                    self._reenvio = asyncio.create_task(self._enviar_resyncs())
+
+    async def _enviar_resyncs(self):
+        dados = json.dumps(_evento_resync()).encode()
+        while self._sem_resync:
+            await asyncio.sleep(INVALIDACAO_RECONEXAO_S)
+            for caminho in list(self._sem_resync):
+                if self._entregar(caminho, dados):
+                    self._sem_resync.discard(caminho)
+                    logger.info(f"Resync enviado ao socket {caminho}")
+
+    async def encerrar(self):
+        if self._reenvio:
+            self._reenvio.cancel()
+        if self._transporte:
+            self._transporte.close()
+        if self._envio:
+            self._envio.close()
+        if os.path.exists(self.caminho):
+            os.unlink(self.caminho)
+
+
+_barramento = None
+
+
+def _criar_barramento():
+    from app.database import DATABASE_URL
+
+    if INVALIDACAO_BACKEND == "postgres" and DATABASE_URL and DATABASE_URL.startswith("postgresql"):
+        return BarramentoPostgres(DATABASE_URL.replace("postgresql+asyncpg", "postgresql"))
+    if INVALIDACAO_BACKEND in ("postgres", "socket"):
+        return BarramentoSocket()
+    return BarramentoLocal()
+
+
+async def iniciar_barramento():
+    global _barramento
+    _barramento = _criar_barramento()
+    await _barramento.iniciar()
+
+
+async def encerrar_barramento():
+    if _barramento is not None:
+        await _barramento.encerrar()
+
+
+async def publicar(entidade: str, acao: str, id: Optional[int] = None):
+    evento = {"entidade": entidade, "acao": acao, "id": id, "origem": ORIGEM}
+    aplicar(evento)
+    if _barramento is None:
+        return
+    try:
+        await _barramento.enviar(json.dumps(evento))
+    except Exception:
+        logger.error(f"Erro ao publicar evento de invalidação {evento}", exc_info=True)
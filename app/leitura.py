@@ -0,0 +1,84 @@
+import json
+import os
+from datetime import date
+from typing import Dict, List, Optional
+from fastapi import Response
+from sqlalchemy import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.arquivamento import tabela_pagamentos, tabela_pedidos
+
+# Leituras quentes (obter_*_por_id, listar_*) via SQLAlchemy Core: linhas viram tuplas e
+# depois JSON, sem instâncias ORM, identity map ou validação do response_model. As chaves
+# são os nomes das colunas, os mesmos campos dos schemas *Read.
+LEITURA_LEVE = os.getenv("LEITURA_LEVE", "true").lower() in ("1", "true", "sim")
+
+
+def _padrao_json(valor):
+    if isinstance(valor, date):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+
+def resposta_json(conteudo) -> Response:
+    corpo = json.dumps(conteudo, ensure_ascii=False, separators=(",", ":"), default=_padrao_json)
+    return Response(content=corpo.encode("utf-8"), media_type="application/json")
+
+
+def _registros(result) -> List[Dict]:
+    chaves = tuple(result.keys())
+    return [dict(zip(chaves, linha)) for linha in result]
+
+
+async def ler_por_id(session: AsyncSession, modelo, id: int) -> Optional[Dict]:
+    tabela = modelo.__table__
+    # A conexão da sessão executa a instrução Core direto, sem passar pelo ORM.
+    conn = await session.connection()
+    result = await conn.execute(select(*tabela.columns).where(tabela.c.id == id))
+    registros = _registros(result)
+    return registros[0] if registros else None
+
+
+async def _pagina(session: AsyncSession, modelo, page: int, limit: int, condicoes: tuple):
+    # modelo SQLModel ou origem Core (tabela, união com o arquivo).
+    tabela = getattr(modelo, "__table__", modelo)
+    conn = await session.connection()
+    total = await conn.scalar(select(func.count()).select_from(tabela).where(*condicoes))
+    result = await conn.execute(
+        select(*tabela.columns).where(*condicoes).offset((page - 1) * limit).limit(limit)
+    )
+    return total, _registros(result)
+
+
+async def listar_pagina(
+    session: AsyncSession, modelo, page: int, limit: int, *condicoes, com_pagina: bool = True
+) -> Response:
+    total, itens = await _pagina(session, modelo, page, limit, condicoes)
+    if not com_pagina:
+        return resposta_json({"total": total, "items": itens})
+    return resposta_json({"page": page, "limit": limit, "total": total, "items": itens})
+
+
+async def anexar_pagamentos(session: AsyncSession, pedidos: List[Dict], incluir_arquivados: bool = False):
+    pagamentos = {}
+    if pedidos:
+        conn = await session.connection()
+        tabela = tabela_pagamentos(incluir_arquivados)
+        result = await conn.execute(
+            select(*tabela.columns)
+            .where(tabela.c.pedido_id.in_([pedido["id"] for pedido in pedidos]))
+            .order_by(tabela.c.id)
+        )
+        for pagamento in _registros(result):
+            # pedido.pagamento é um-para-um no mapeamento: vale o primeiro.
+            pagamentos.setdefault(pagamento["pedido_id"], pagamento)
+    for pedido in pedidos:
+        pedido["pagamento"] = pagamentos.get(pedido["id"])
+
+
+async def listar_pedidos_pagina(
+    session: AsyncSession, page: int, limit: int, *condicoes, incluir_arquivados: bool = False
+) -> Response:
+    # Com incluir_arquivados, as condições devem usar as colunas de tabela_pedidos(True).
+    total, pedidos = await _pagina(session, tabela_pedidos(incluir_arquivados), page, limit, condicoes)
+    await anexar_pagamentos(session, pedidos, incluir_arquivados)
+    return resposta_json({"page": page, "limit": limit, "total": total, "items": pedidos})
@@ -0,0 +1,55 @@
+import os
+from typing import Awaitable, Callable, List, Optional
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.invalidacao import publicar
+from app.schemas import ResultadoLote
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+LOTE_MAX_IDS = int(os.getenv("LOTE_MAX_IDS", "10000"))
+
+
+def validar_lote(ids: Optional[List[int]], **filtros):
+    if ids is not None and len(ids) > LOTE_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"Lote excede o limite de {LOTE_MAX_IDS} ids.")
+    # Lista vazia não é "sem filtro": os handlers a tratariam como ausente e a instrução
+    # atingiria mais linhas do que o pedido.
+    vazias = [nome for nome, valor in {"ids": ids, **filtros}.items() if isinstance(valor, list) and not valor]
+    if vazias:
+        raise HTTPException(status_code=422, detail=f"Lista vazia em {', '.join(vazias)}.")
+    # Sem ids nem filtros a instrução atingiria a tabela inteira.
+    if not ids and all(valor is None for valor in filtros.values()):
+        raise HTTPException(status_code=400, detail="Informe ids ou ao menos um filtro para a operação em lote.")
+
+
+async def executar_lote(
+    session: AsyncSession,
+    stmt,
+    entidade: str,
+    acao: str,
+    antes_commit: Optional[Callable[[List[int]], Awaitable]] = None,
+) -> ResultadoLote:
+    # stmt é um UPDATE/DELETE único com RETURNING da chave primária. antes_commit recebe
+    # os ids afetados e roda na mesma transação.
+    try:
+        result = await session.execute(stmt, execution_options={"synchronize_session": False})
+        ids = sorted(result.scalars().all())
+        if antes_commit is not None and ids:
+            await antes_commit(ids)
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        logger.error(f"Erro de integridade na operação em lote de {entidade}: {e}")
+        raise HTTPException(status_code=400, detail=f"Dados inválidos para a operação em lote de {entidade}.")
+    except Exception:
+        await session.rollback()
+        logger.error(f"Erro na operação em lote de {entidade}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Erro interno na operação em lote de {entidade}")
+
+    logger.info(f"Operação em lote de {entidade}: {len(ids)} registro(s) {acao}(s)")
+    if ids:
+        await publicar(entidade, "lote")
+    return ResultadoLote(afetados=len(ids), ids=ids)
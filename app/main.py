@@ -1,11 +1,64 @@
-from fastapi import FastAPI
-from app.routes import editoras, livros, usuarios, pedidos, pagamentos, autores
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import DBAPIError
+from app.admissao import ControleAdmissaoMiddleware
+from app.agrupamento import encerrar_agrupadores
+from app.consultas_lentas import ContextoRequisicaoMiddleware, registrar_consultas_lentas
+from app.database import engine
+from app.invalidacao import iniciar_barramento, encerrar_barramento
+from app.recomendacoes import iniciar_recomendacoes, encerrar_recomendacoes
+from app.catalogo import iniciar_catalogo
+from app.facetas import iniciar_facetas
+from app.autocompletar import iniciar_autocompletar
+from app.eventos_pedidos import iniciar_eventos_pedidos, encerrar_eventos_pedidos
+from app.codificacao import CompressaoMiddleware, MessagePackMiddleware, RespostaNegociada
+from app.timeouts import CancelamentoDesconexaoMiddleware, eh_timeout, tempo_esgotado
+from app.transacao import conflito_persistente, eh_transitorio
+from app.routes import editoras, livros, usuarios, pedidos, pagamentos, autores, metricas, autocompletar, batch
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await iniciar_barramento()
+    await iniciar_recomendacoes()
+    await iniciar_catalogo()
+    await iniciar_facetas()
+    await iniciar_autocompletar()
+    await iniciar_eventos_pedidos()
+    yield
+    await encerrar_eventos_pedidos()
+    await encerrar_recomendacoes()
+    await encerrar_agrupadores()
+    await encerrar_barramento()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=RespostaNegociada)
+app.add_middleware(ControleAdmissaoMiddleware)
+app.add_middleware(CancelamentoDesconexaoMiddleware)
+app.add_middleware(ContextoRequisicaoMiddleware)
+app.add_middleware(MessagePackMiddleware)
+app.add_middleware(CompressaoMiddleware)
+
+registrar_consultas_lentas(engine)
+
+
+@app.exception_handler(DBAPIError)
+async def tratar_erro_banco(request: Request, exc: DBAPIError):
+    if eh_timeout(exc):
+        erro = tempo_esgotado(f"processar {request.method} {request.url.path}")
+        return JSONResponse(status_code=erro.status_code, content={"detail": erro.detail})
+    if eh_transitorio(exc):
+        erro = conflito_persistente(f"processar {request.method} {request.url.path}")
+        return JSONResponse(status_code=erro.status_code, content={"detail": erro.detail}, headers=erro.headers)
+    raise exc
 
 app.include_router(usuarios.router)
 app.include_router(autores.router)
 app.include_router(editoras.router)
 app.include_router(livros.router)
 app.include_router(pedidos.router)
-app.include_router(pagamentos.router)
\ No newline at end of file
+app.include_router(pagamentos.router)
+app.include_router(metricas.router)
+app.include_router(autocompletar.router)
+app.include_router(batch.router)
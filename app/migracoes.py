@@ -0,0 +1,489 @@
+import math
+import os
+import random
+import re
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+import sqlalchemy as sa
+from alembic import context, op
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+# Helpers para as migrações em alembic/versions sobre tabelas grandes. No Postgres cada
+# passo roda fora da transação da migração (autocommit), com lock_timeout curto e novas
+# tentativas; no SQLite embutido viram as operações comuns do alembic. Uma revisão leva
+# cópia dos helpers que usa em vez de importá-los (ver c3e8a5f1d902): o histórico não pode
+# depender do app nem mudar junto com este módulo.
+MIGRACAO_LOCK_TIMEOUT_MS = int(os.getenv("MIGRACAO_LOCK_TIMEOUT_MS", "2000"))
+MIGRACAO_TENTATIVAS = int(os.getenv("MIGRACAO_TENTATIVAS", "10"))
+MIGRACAO_ESPERA_MAX_S = float(os.getenv("MIGRACAO_ESPERA_MAX_S", "30"))
+MIGRACAO_LOTE = int(os.getenv("MIGRACAO_LOTE", "5000"))
+MIGRACAO_PAUSA_MS = float(os.getenv("MIGRACAO_PAUSA_MS", "100"))
+# Vazões assumidas nas estimativas do dry-run; ajuste com medições do próprio ambiente.
+MIGRACAO_LINHAS_POR_S = float(os.getenv("MIGRACAO_LINHAS_POR_S", "10000"))
+MIGRACAO_MB_POR_S = float(os.getenv("MIGRACAO_MB_POR_S", "100"))
+
+# Esperas por lock que valem nova tentativa: lock_timeout estourado e deadlock.
+SQLSTATES_LOCK = {"55P03", "40P01"}
+
+_estimativas: List[Tuple[str, float, str]] = []
+# Dry-run: as revisões rodam como no --sql, com o SQL gravado em _saida; o catálogo é
+# consultado pela conexão real, só leitura.
+_conexao_catalogo = None
+_saida = None
+_lido = 0
+_renomeadas: Dict[str, str] = {}
+_criadas: Set[str] = set()
+
+
+def em_dry_run() -> bool:
+    # alembic -x dry_run=sim upgrade head (ou MIGRACAO_DRY_RUN=sim)
+    valor = context.get_x_argument(as_dictionary=True).get("dry_run") or os.getenv("MIGRACAO_DRY_RUN", "false")
+    return valor.lower() in ("1", "true", "sim")
+
+
+def _modo() -> str:
+    if em_dry_run():
+        return "dry_run"
+    if context.is_offline_mode():
+        raise RuntimeError("app.migracoes precisa de conexão: use -x dry_run=sim em vez de --sql")
+    return "postgres" if op.get_bind().dialect.name == "postgresql" else "outro"
+
+
+def _conexao():
+    # No dry-run op.get_bind() só escreve SQL na saída; leituras vão à conexão real.
+    return _conexao_catalogo if _conexao_catalogo is not None else op.get_bind()
+
+
+def _sqlstate(erro: sa.exc.DBAPIError):
+    return getattr(erro.orig, "pgcode", None) or getattr(erro.orig, "sqlstate", None)
+
+
+def _executar(descricao: str, comando: str, parametros: Optional[dict] = None, ao_falhar: Optional[Callable] = None):
+    # Um ALTER parado na fila de locks bloqueia todos que chegam depois dele: melhor
+    # desistir em MIGRACAO_LOCK_TIMEOUT_MS e tentar de novo do que travar o tráfego.
+    bind = op.get_bind()
+    tentativa = 1
+    while True:
+        bind.execute(sa.text(f"SET lock_timeout = {MIGRACAO_LOCK_TIMEOUT_MS}"))
+        try:
+            return bind.execute(sa.text(comando), parametros or {})
+        except sa.exc.DBAPIError as e:
+            if ao_falhar is not None:
+                ao_falhar()
+            if _sqlstate(e) not in SQLSTATES_LOCK or tentativa >= MIGRACAO_TENTATIVAS:
+                raise
+            espera = random.uniform(0, min(MIGRACAO_ESPERA_MAX_S, 0.5 * 2 ** tentativa))
+            logger.info(
+                f"Lock indisponível ao {descricao} "
+                f"(tentativa {tentativa}/{MIGRACAO_TENTATIVAS}); repetindo em {espera:.1f}s"
+            )
+            time.sleep(espera)
+            tentativa += 1
+        finally:
+            bind.execute(sa.text("RESET lock_timeout"))
+
+
+def _autocommit():
+    # Cada comando confirma sozinho: o lock de um passo não fica preso até o fim da
+    # migração, e CREATE INDEX CONCURRENTLY não roda dentro de transação.
+    return op.get_context().autocommit_block()
+
+
+def _tamanho(tabela: str) -> Tuple[int, int]:
+    # (linhas, bytes) pelas estatísticas do catálogo, somando as partições.
+    bind = _conexao()
+    if bind.dialect.name != "postgresql":
+        return bind.scalar(sa.text(f"SELECT count(*) FROM {tabela}")), 0
+    linhas, tamanho, sem_estatistica = bind.execute(sa.text(
+        "SELECT sum(greatest(c.reltuples, 0)), sum(pg_relation_size(c.oid)), bool_or(c.reltuples < 0) "
+        "FROM pg_partition_tree(CAST(:tabela AS regclass)) p "
+        "JOIN pg_class c ON c.oid = p.relid WHERE p.isleaf"
+    ), {"tabela": tabela}).one()
+    if sem_estatistica:
+        linhas = bind.scalar(sa.text(f"SELECT count(*) FROM {tabela}"))
+    return int(linhas or 0), int(tamanho or 0)
+
+
+def _varredura(tamanho: int) -> float:
+    return tamanho / 2 ** 20 / MIGRACAO_MB_POR_S
+
+
+def _estimar(passo: str, segundos: float, detalhe: str):
+    _estimativas.append((passo, segundos, detalhe))
+    logger.info(f"[dry-run] {passo}: ~{segundos:.1f}s ({detalhe})")
+
+
+def _estimar_bloqueio(passo: str):
+    pior = MIGRACAO_TENTATIVAS * MIGRACAO_LOCK_TIMEOUT_MS / 1000
+    _estimar(passo, 0, f"só catálogo; até {pior:.0f}s esperando lock no pior caso")
+
+
+def _particionada(tabela: str) -> bool:
+    relkind = op.get_bind().scalar(sa.text("SELECT relkind FROM pg_class WHERE oid = CAST(:tabela AS regclass)"), {"tabela": tabela})
+    return relkind == "p"
+
+
+def _particoes(tabela: str) -> List[str]:
+    result = op.get_bind().execute(sa.text(
+        "SELECT CAST(relid AS regclass)::text FROM pg_partition_tree(CAST(:tabela AS regclass)) "
+        "WHERE parentrelid = CAST(:tabela AS regclass) ORDER BY 1"
+    ), {"tabela": tabela})
+    return result.scalars().all()
+
+
+def _indice(nome: str):
+    # (válido, anexado a um índice pai) ou None se o índice não existe.
+    return op.get_bind().execute(sa.text(
+        "SELECT i.indisvalid, EXISTS (SELECT 1 FROM pg_inherits h WHERE h.inhrelid = i.indexrelid) "
+        "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :nome"
+    ), {"nome": nome}).first()
+
+
+def _constraint_existe(tabela: str, nome: str) -> bool:
+    return op.get_bind().scalar(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = CAST(:tabela AS regclass) AND conname = :nome)"
+    ), {"tabela": tabela, "nome": nome})
+
+
+def adicionar_coluna(tabela: str, coluna: sa.Column):
+    # Coluna anulável sem default volátil é só alteração de catálogo, sem reescrever a
+    # tabela. NOT NULL entra depois do backfill, com tornar_not_null.
+    if not coluna.nullable:
+        raise ValueError(f"{tabela}.{coluna.name}: adicione a coluna anulável e use tornar_not_null depois do backfill")
+    passo = f"adicionar {tabela}.{coluna.name}"
+    modo = _modo()
+    if modo == "dry_run":
+        _estimar_bloqueio(passo)
+    elif modo == "outro":
+        op.add_column(tabela, coluna)
+    else:
+        ddl = sa.schema.CreateColumn(coluna).compile(dialect=op.get_bind().dialect)
+        with _autocommit():
+            _executar(passo, f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS {ddl}")
+
+
+def preencher_em_lotes(
+    tabela: str,
+    atribuicoes: str,
+    pendente: str,
+    chave: str = "id",
+    lote: Optional[int] = None,
+    pausa_ms: Optional[float] = None,
+):
+    # UPDATE em faixas crescentes de `chave`, cada uma na sua transação e com pausa entre
+    # elas, para não disputar I/O e locks de linha com o tráfego. Só toca linhas em que
+    # `pendente` ainda vale: interrompido, basta rodar de novo.
+    lote = lote or MIGRACAO_LOTE
+    pausa = (MIGRACAO_PAUSA_MS if pausa_ms is None else pausa_ms) / 1000
+    passo = f"preencher {tabela} ({atribuicoes})"
+    modo = _modo()
+    if modo == "dry_run":
+        linhas, _ = _tamanho(tabela)
+        lotes = math.ceil(linhas / lote)
+        _estimar(passo, linhas / MIGRACAO_LINHAS_POR_S + lotes * pausa, f"até {linhas} linhas em {lotes} lotes de {lote}")
+        return
+
+    total, lotes, ultimo = 0, 0, None
+    inicio = aviso = time.perf_counter()
+    with _autocommit() if modo == "postgres" else nullcontext():
+        bind = op.get_bind()
+        while True:
+            apos = "" if ultimo is None else f"WHERE {chave} > :ultimo"
+            parametros = {} if ultimo is None else {"ultimo": ultimo}
+            fim = bind.scalar(
+                sa.text(f"SELECT max({chave}) FROM (SELECT {chave} FROM {tabela} {apos} ORDER BY {chave} LIMIT {lote}) t"),
+                parametros,
+            )
+            if fim is None:
+                break
+            faixa = f"{chave} <= :fim" if ultimo is None else f"{chave} > :ultimo AND {chave} <= :fim"
+            comando = f"UPDATE {tabela} SET {atribuicoes} WHERE {faixa} AND ({pendente})"
+            if modo == "postgres":
+                result = _executar(passo, comando, {**parametros, "fim": fim})
+            else:
+                result = bind.execute(sa.text(comando), {**parametros, "fim": fim})
+            total += max(result.rowcount, 0)
+            lotes += 1
+            ultimo = fim
+            if time.perf_counter() - aviso >= 10:
+                logger.info(f"{passo}: {total} linhas em {lotes} lotes, até {chave}={ultimo}")
+                aviso = time.perf_counter()
+            time.sleep(pausa)
+    logger.info(f"{passo}: {total} linhas em {lotes} lotes ({time.perf_counter() - inicio:.1f}s)")
+
+
+def _nome_indice_particao(nome: str, particao: str) -> str:
+    # Nomes no Postgres têm até 63 bytes.
+    return f"{particao}_{nome}"[:63]
+
+
+def _criar_indice_concorrente(nome: str, tabela: str, tipo: str, corpo: str):
+    # CREATE INDEX CONCURRENTLY interrompido deixa um índice inválido para trás: ele é
+    # descartado antes de cada tentativa, senão o IF NOT EXISTS o daria por pronto.
+    def descartar_invalido():
+        estado = _indice(nome)
+        if estado is not None and not estado[0]:
+            op.get_bind().execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}"))
+
+    descartar_invalido()
+    _executar(
+        f"criar índice {nome}",
+        f"CREATE {tipo} CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} {corpo}",
+        ao_falhar=descartar_invalido,
+    )
+
+
+def criar_indice(nome: str, tabela: str, colunas: Sequence[str], unico: bool = False, where: Optional[str] = None):
+    # Sem bloquear escritas: CONCURRENTLY na tabela comum; na particionada o índice pai é
+    # criado só no catálogo (ON ONLY), cada partição ganha o seu em CONCURRENTLY e é anexada.
+    tipo = "UNIQUE INDEX" if unico else "INDEX"
+    corpo = f"({', '.join(colunas)})" + (f" WHERE {where}" if where else "")
+    modo = _modo()
+    if modo == "dry_run":
+        linhas, tamanho = _tamanho(tabela)
+        # Duas varreduras da tabela, mais a ordenação das chaves.
+        _estimar(f"criar índice {nome}", 3 * _varredura(tamanho), f"{linhas} linhas, {tamanho / 2 ** 20:.0f} MB, sem bloquear escritas")
+        return
+    if modo == "outro":
+        op.execute(f"CREATE {tipo} IF NOT EXISTS {nome} ON {tabela} {corpo}")
+        return
+
+    with _autocommit():
+        if not _particionada(tabela):
+            _criar_indice_concorrente(nome, tabela, tipo, corpo)
+        else:
+            _executar(f"criar índice {nome}", f"CREATE {tipo} IF NOT EXISTS {nome} ON ONLY {tabela} {corpo}")
+            for particao in _particoes(tabela):
+                indice = _nome_indice_particao(nome, particao)
+                _criar_indice_concorrente(indice, particao, tipo, corpo)
+                if not _indice(indice)[1]:
+                    _executar(f"anexar índice {indice}", f"ALTER INDEX {nome} ATTACH PARTITION {indice}")
+    logger.info(f"Índice {nome} criado em {tabela}")
+
+
+def remover_indice(nome: str):
+    modo = _modo()
+    if modo == "dry_run":
+        _estimar_bloqueio(f"remover índice {nome}")
+    elif modo == "outro":
+        op.execute(f"DROP INDEX IF EXISTS {nome}")
+    else:
+        particionado = op.get_bind().scalar(sa.text("SELECT relkind = 'I' FROM pg_class WHERE relname = :nome"), {"nome": nome})
+        with _autocommit():
+            # Índice de tabela particionada não aceita CONCURRENTLY; o DROP dele só mexe no catálogo.
+            concorrente = "" if particionado else "CONCURRENTLY "
+            _executar(f"remover índice {nome}", f"DROP INDEX {concorrente}IF EXISTS {nome}")
+
+
+def adicionar_unique(nome: str, tabela: str, colunas: Sequence[str]):
+    # O índice único é construído sem bloquear escritas e a constraint só o adota.
+    # Em tabela particionada o Postgres não aceita USING INDEX: o índice único garante
+    # a unicidade sozinho (e precisa conter a chave de partição).
+    criar_indice(nome, tabela, colunas, unico=True)
+    modo = _modo()
+    if modo == "dry_run":
+        _estimar_bloqueio(f"adotar {nome} como UNIQUE")
+    elif modo == "outro":
+        with op.batch_alter_table(tabela) as batch_op:
+            batch_op.create_unique_constraint(nome, list(colunas))
+    elif not _particionada(tabela) and not _constraint_existe(tabela, nome):
+        with _autocommit():
+            _executar(f"adotar {nome} como UNIQUE", f"ALTER TABLE {tabela} ADD CONSTRAINT {nome} UNIQUE USING INDEX {nome}")
+
+
+def _validar(nome: str, tabela: str, adicionar: str):
+    # ADD ... NOT VALID só altera o catálogo; VALIDATE varre a tabela com SHARE UPDATE
+    # EXCLUSIVE, sem bloquear leituras nem escritas.
+    with _autocommit():
+        if not _constraint_existe(tabela, nome):
+            _executar(f"adicionar {nome}", f"ALTER TABLE {tabela} ADD CONSTRAINT {nome} {adicionar} NOT VALID")
+        _executar(f"validar {nome}", f"ALTER TABLE {tabela} VALIDATE CONSTRAINT {nome}")
+
+
+def adicionar_check(nome: str, tabela: str, condicao: str):
+    modo = _modo()
+    if modo == "dry_run":
+        linhas, tamanho = _tamanho(tabela)
+        _estimar(f"adicionar CHECK {nome}", _varredura(tamanho), f"NOT VALID + VALIDATE em {linhas} linhas, sem bloquear escritas")
+    elif modo == "outro":
+        with op.batch_alter_table(tabela) as batch_op:
+            batch_op.create_check_constraint(nome, sa.text(condicao))
+    else:
+        _validar(nome, tabela, f"CHECK ({condicao})")
+
+
+def adicionar_fk(
+    nome: str,
+    tabela: str,
+    colunas: Sequence[str],
+    referencia: str,
+    colunas_referencia: Sequence[str],
+    ondelete: Optional[str] = None,
+):
+    definicao = f"FOREIGN KEY ({', '.join(colunas)}) REFERENCES {referencia} ({', '.join(colunas_referencia)})"
+    if ondelete:
+        definicao += f" ON DELETE {ondelete}"
+    modo = _modo()
+    if modo == "dry_run":
+        linhas, tamanho = _tamanho(tabela)
+        _estimar(f"adicionar FK {nome}", _varredura(tamanho), f"NOT VALID + VALIDATE em {linhas} linhas, sem bloquear escritas")
+    elif modo == "outro":
+        with op.batch_alter_table(tabela) as batch_op:
+            batch_op.create_foreign_key(nome, referencia, list(colunas), list(colunas_referencia), ondelete=ondelete)
+    elif _particionada(tabela):
+        # Postgres < 18 não aceita FK NOT VALID em tabela particionada: a verificação
+        # acontece no próprio ADD, com o lock dele.
+        logger.warning(f"{tabela} é particionada: {nome} será validada junto com o ADD CONSTRAINT")
+        with _autocommit():
+            if not _constraint_existe(tabela, nome):
+                _executar(f"adicionar {nome}", f"ALTER TABLE {tabela} ADD CONSTRAINT {nome} {definicao}")
+    else:
+        _validar(nome, tabela, definicao)
+
+
+def tornar_not_null(tabela: str, coluna: str):
+    # SET NOT NULL direto varre a tabela segurando ACCESS EXCLUSIVE. Com um CHECK
+    # (coluna IS NOT NULL) já validado, o Postgres só altera o catálogo.
+    modo = _modo()
+    if modo == "outro":
+        with op.batch_alter_table(tabela) as batch_op:
+            batch_op.alter_column(coluna, nullable=False)
+        return
+    nome = f"{tabela}_{coluna}_not_null"
+    adicionar_check(nome, tabela, f"{coluna} IS NOT NULL")
+    if modo == "dry_run":
+        _estimar_bloqueio(f"SET NOT NULL em {tabela}.{coluna}")
+        return
+    with _autocommit():
+        _executar(f"SET NOT NULL em {tabela}.{coluna}", f"ALTER TABLE {tabela} ALTER COLUMN {coluna} SET NOT NULL")
+        _executar(f"remover {nome}", f"ALTER TABLE {tabela} DROP CONSTRAINT IF EXISTS {nome}")
+
+
+# Operações comuns das revisões, renderizadas no dry-run: (padrão, custo, trava). O custo
+# é "linhas" (DML sobre a tabela lida), "varredura", "indice" ou None (só catálogo); a
+# trava, a que bloqueia o tráfego e fica presa até o COMMIT da revisão.
+_TABELA = r'(?:IF (?:NOT )?EXISTS )?(?:ONLY )?"?(\w+)"?'
+_OPERACOES = [
+    # Índice pai de tabela particionada: só catálogo, as partições vêm em seguida.
+    (re.compile(r'^CREATE (?:UNIQUE )?INDEX (?:IF NOT EXISTS )?\S+ ON ONLY "?(\w+)"?', re.I), None, "SHARE"),
+    (re.compile(rf"^CREATE (?:UNIQUE )?INDEX CONCURRENTLY .*? ON {_TABELA}", re.I), "indice", None),
+    (re.compile(rf"^CREATE (?:UNIQUE )?INDEX .*? ON {_TABELA}", re.I), "indice", "SHARE"),
+    (re.compile(rf"^ALTER TABLE {_TABELA} VALIDATE CONSTRAINT", re.I), "varredura", None),
+    (re.compile(rf"^ALTER TABLE {_TABELA} .* NOT VALID$", re.I), None, "ACCESS EXCLUSIVE"),
+    (re.compile(rf"^ALTER TABLE {_TABELA} ATTACH PARTITION \"?(?P<lida>\w+)\"?", re.I), "varredura", "ACCESS EXCLUSIVE"),
+    (re.compile(
+        rf"^ALTER TABLE {_TABELA} .*\b(ADD (CONSTRAINT \S+ )?(CHECK|FOREIGN KEY|UNIQUE|PRIMARY KEY)|TYPE|SET NOT NULL)\b",
+        re.I,
+    ), "varredura", "ACCESS EXCLUSIVE"),
+    (re.compile(rf"^(?:ALTER|DROP) TABLE {_TABELA}", re.I), None, "ACCESS EXCLUSIVE"),
+    (re.compile(rf"^INSERT INTO \S+ .*?\bSELECT\b.*?\bFROM {_TABELA}", re.I), "linhas", None),
+    (re.compile(rf"^(?:WITH \w+ AS \()?(?:UPDATE|DELETE FROM) {_TABELA}", re.I), "linhas", None),
+]
+_RENOMEAR = re.compile(r'^ALTER TABLE "?(\w+)"? RENAME TO "?(\w+)"?$', re.I)
+_CRIAR = re.compile(r'^CREATE TABLE (?:IF NOT EXISTS )?"?(\w+)"?', re.I)
+
+
+def _tamanho_estimado(tabela: str) -> Tuple[int, int]:
+    # Tabelas renomeadas antes no dry-run mantêm o tamanho; as criadas nele estão vazias.
+    if tabela in _criadas:
+        return 0, 0
+    tabela = _renomeadas.get(tabela, tabela)
+    if not sa.inspect(_conexao()).has_table(tabela):
+        return 0, 0
+    return _tamanho(tabela)
+
+
+def _estimar_comando(comando: str) -> Tuple[float, Optional[str], Optional[str], str]:
+    # (segundos, tabela, trava, detalhe) de uma instrução renderizada.
+    renomeada = _RENOMEAR.match(comando)
+    if renomeada:
+        antiga, nova = renomeada.groups()
+        if antiga in _criadas:
+            _criadas.discard(antiga)
+            _criadas.add(nova)
+        else:
+            _renomeadas[nova] = _renomeadas.pop(antiga, antiga)
+        return 0, antiga, "ACCESS EXCLUSIVE", "só catálogo"
+    criada = _CRIAR.match(comando)
+    if criada:
+        _criadas.add(criada.group(1))
+        return 0, None, None, "só catálogo"
+    for padrao, custo, trava in _OPERACOES:
+        encontrado = padrao.search(comando)
+        if not encontrado:
+            continue
+        # ATTACH PARTITION varre a partição, não a tabela pai.
+        tabela = encontrado.group(1)
+        lida = encontrado.groupdict().get("lida") or tabela
+        if tabela == "alembic_version":
+            return 0, None, None, ""
+        if custo is None:
+            return 0, tabela, trava, "só catálogo"
+        linhas, tamanho = _tamanho_estimado(lida)
+        if custo == "linhas":
+            return linhas / MIGRACAO_LINHAS_POR_S, tabela, trava, f"{linhas} linhas de {lida}"
+        fator = 3 if custo == "indice" else 1
+        return fator * _varredura(tamanho), tabela, trava, f"varre {lida} ({linhas} linhas, {tamanho / 2 ** 20:.0f} MB)"
+    return 0, None, None, "só catálogo"
+
+
+def _estimar_saida(revisao: str):
+    # Estima o SQL que a revisão emitiu desde a anterior. As travas de cada instrução
+    # valem até o COMMIT seguinte (fim da revisão ou início de um bloco autocommit).
+    global _lido
+    texto = _saida.getvalue()
+    trecho, _lido = texto[_lido:], len(texto)
+    segundos_revisao, travas, segundos_travado = 0.0, {}, 0.0
+
+    def liberar():
+        nonlocal travas, segundos_travado
+        descricao = ", ".join(f"{modo} em {tabela}" for tabela, modo in travas.items())
+        if travas and segundos_travado:
+            logger.warning(f"[dry-run] revisão {revisao}: {descricao} por ~{segundos_travado:.1f}s, bloqueando o tráfego")
+        elif travas:
+            logger.info(f"[dry-run] revisão {revisao}: {descricao}, só durante alterações de catálogo")
+        travas, segundos_travado = {}, 0.0
+
+    for bruto in trecho.split(";\n\n"):
+        comando = " ".join(
+            linha for linha in (parte.strip() for parte in bruto.splitlines()) if linha and not linha.startswith("--")
+        )
+        if not comando:
+            continue
+        if comando.upper() == "COMMIT":
+            liberar()
+            continue
+        segundos, tabela, trava, detalhe = _estimar_comando(comando)
+        if trava and tabela:
+            travas.setdefault(tabela, trava)
+        if travas:
+            segundos_travado += segundos
+        if segundos:
+            _estimar(f"revisão {revisao}: {comando[:80]}", segundos, detalhe)
+        segundos_revisao += segundos
+    liberar()
+    return segundos_revisao
+
+
+def iniciar_dry_run(conexao, saida):
+    global _conexao_catalogo, _saida, _lido
+    _estimativas.clear()
+    _renomeadas.clear()
+    _criadas.clear()
+    _conexao_catalogo, _saida, _lido = conexao, saida, 0
+
+
+def registrar_revisao(ctx, step, heads, run_args):
+    # on_version_apply do dry-run: nada da revisão rodou; as operações comuns dela são
+    # estimadas pelo SQL renderizado e os helpers acima já registraram as próprias.
+    _estimar_saida(step.up_revision_id)
+
+
+def resumir_dry_run():
+    global _conexao_catalogo, _saida
+    _conexao_catalogo, _saida = None, None
+    total = sum(segundos for _, segundos, _ in _estimativas)
+    logger.info(f"[dry-run] {len(_estimativas)} passo(s), ~{total:.1f}s no total; nada foi executado no banco")
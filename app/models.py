@@ -1,7 +1,10 @@
 from typing import Optional, List
-from datetime import date
+from datetime import date, datetime, timezone
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import (
+    JSON, BigInteger, CheckConstraint, Column, DateTime, Integer, Index, UniqueConstraint, func, text
+)
+from app.status_pedido import CONDICAO_STATUS_ABERTOS, CONDICAO_STATUS_VALIDO
 
 
 class Autor(SQLModel, table=True):
@@ -24,8 +27,9 @@ class Editora(SQLModel, table=True):
     livros: List["Livro"] = Relationship(back_populates="editora")
 
 
+# pedido_id sem FK: pedido é particionada e a PK dela inclui data_pedido (ver abaixo).
 class PedidoLivroLink(SQLModel, table=True):
-    pedido_id: Optional[int] = Field(default=None, foreign_key="pedido.id", primary_key=True)
+    pedido_id: Optional[int] = Field(default=None, primary_key=True)
     livro_id: Optional[int] = Field(default=None, foreign_key="livro.id", primary_key=True)
 
 
@@ -39,7 +43,14 @@ class Livro(SQLModel, table=True):
 
     autor: Optional[Autor] = Relationship(back_populates="livros")
     editora: Optional[Editora] = Relationship(back_populates="livros")
-    pedidos: List["Pedido"] = Relationship(back_populates="livros", link_model=PedidoLivroLink)
+    pedidos: List["Pedido"] = Relationship(
+        back_populates="livros",
+        link_model=PedidoLivroLink,
+        sa_relationship_kwargs={
+            "primaryjoin": "Livro.id == foreign(PedidoLivroLink.livro_id)",
+            "secondaryjoin": "foreign(PedidoLivroLink.pedido_id) == Pedido.id",
+        },
+    )
 
 
 class Usuario(SQLModel, table=True):
@@ -52,7 +63,31 @@ class Usuario(SQLModel, table=True):
     pedidos: List["Pedido"] = Relationship(back_populates="usuario")
 
 
+# pedido e pagamento são particionadas por mês no banco (ver app/particoes.py): a PK real
+# inclui a coluna de data, então nenhuma FK aponta para pedido.id; as relações abaixo
+# declaram a junção explicitamente. A PK do mapeamento continua só em id (única pela
+# sequência), que é também a PK no SQLite embutido.
+#
+# No Postgres as FKs para pedido.id e a UNIQUE(pedido_id) de pagamento são triggers
+# (revisão 5b8e2d41c7fa): vínculo ou pagamento para pedido inexistente, segundo pagamento
+# do mesmo pedido e remoção de pedido ainda referenciado falham com IntegrityError. Os
+# handlers ainda travam o pedido (travar_retornando, em ordem de id) e conferem existência
+# e dependências antes de escrever, para responder 404/409 em vez do erro do banco:
+#   - criar_pagamento (também agrupado), criar_pagamentos_lote, atualizar_pagamento;
+#   - criar_pedido: os vínculos entram na transação que cria o pedido (também agrupado);
+#   - deletar_pedido e deletar_pedidos_lote;
+#   - app/arquivamento.py, que trava pedidos e pagamentos antes de movê-los.
 class Pedido(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_pedido_usuario_id_data_pedido", "usuario_id", text("data_pedido DESC"), text("id DESC")),
+        CheckConstraint(CONDICAO_STATUS_VALIDO, name="ck_pedido_status"),
+        # Só os pedidos em aberto (app/status_pedido.py): o índice não cresce com o histórico.
+        Index(
+            "ix_pedido_status_abertos", "status", "data_pedido",
+            postgresql_where=text(CONDICAO_STATUS_ABERTOS), sqlite_where=text(CONDICAO_STATUS_ABERTOS),
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     usuario_id: Optional[int] = Field(default=None, foreign_key="usuario.id")
     data_pedido: date
@@ -60,19 +95,131 @@ class Pedido(SQLModel, table=True):
     valor_total: float
 
     usuario: Optional[Usuario] = Relationship(back_populates="pedidos")
-    livros: List[Livro] = Relationship(back_populates="pedidos", link_model=PedidoLivroLink)
-    pagamento: Optional["Pagamento"] = Relationship(back_populates="pedido")
+    livros: List[Livro] = Relationship(
+        back_populates="pedidos",
+        link_model=PedidoLivroLink,
+        sa_relationship_kwargs={
+            "primaryjoin": "Pedido.id == foreign(PedidoLivroLink.pedido_id)",
+            "secondaryjoin": "Livro.id == foreign(PedidoLivroLink.livro_id)",
+        },
+    )
+    pagamento: Optional["Pagamento"] = Relationship(
+        back_populates="pedido",
+        sa_relationship_kwargs={"primaryjoin": "Pedido.id == foreign(Pagamento.pedido_id)", "uselist": False},
+    )
 
 
 class Pagamento(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("pedido_id", "data_pagamento"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    pedido_id: Optional[int] = Field(
-        default=None,
-        sa_column=Column(Integer, ForeignKey("pedido.id"), unique=True)
-    )
+    # 1:1 com pedido: trigger no Postgres (ver acima) e conferido pelos handlers.
+    pedido_id: Optional[int] = None
     data_pagamento: date
     valor: float
     forma_pagamento: str
 
-    pedido: Optional[Pedido] = Relationship(back_populates="pagamento")
+    pedido: Optional[Pedido] = Relationship(
+        back_populates="pagamento",
+        sa_relationship_kwargs={"primaryjoin": "foreign(Pagamento.pedido_id) == Pedido.id"},
+    )
+
+
+class PagamentoIdempotencia(SQLModel, table=True):
+    chave: str = Field(primary_key=True)
+    pedido_id: int
+    criado_em: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+# Modelo de leitura desnormalizado de pedido (ver app/pedido_view.py): mantido pelos
+# handlers de escrita na mesma transação, sem FKs para não travar as tabelas de origem.
+class PedidoView(SQLModel, table=True):
+    __tablename__ = "pedido_view"
+    __table_args__ = (
+        Index("ix_pedido_view_usuario_id_data_pedido", "usuario_id", "data_pedido"),
+        Index("ix_pedido_view_data_pedido", "data_pedido"),
+        Index("ix_pedido_view_pagamento_id", "pagamento_id"),
+        Index(
+            "ix_pedido_view_status_abertos", "status", "pedido_id",
+            postgresql_where=text(CONDICAO_STATUS_ABERTOS), sqlite_where=text(CONDICAO_STATUS_ABERTOS),
+        ),
+    )
+
+    pedido_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    usuario_id: Optional[int] = None
+    data_pedido: date
+    status: str
+    valor_total: float
+    usuario_nome: Optional[str] = None
+    pagamento_id: Optional[int] = None
+    pagamento_data: Optional[date] = None
+    pagamento_valor: Optional[float] = None
+    pagamento_forma: Optional[str] = None
+    quantidade_livros: int = 0
+    titulos: List[str] = Field(default_factory=list, sa_column=Column(JSON, nullable=False))
+
+
+# Outbox do feed de eventos de pedido/pagamento (ver app/eventos_pedidos.py): uma linha
+# compacta por alteração, gravada na mesma transação da escrita.
+class PedidoEvento(SQLModel, table=True):
+    __tablename__ = "pedido_evento"
+    __table_args__ = (
+        Index("ix_pedido_evento_criado_em", "criado_em"),
+    )
+
+    # No SQLite só INTEGER PRIMARY KEY é autoincremental.
+    id: Optional[int] = Field(
+        default=None, sa_column=Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    )
+    entidade: str
+    acao: str
+    registro_id: int
+    pedido_id: Optional[int] = None
+    usuario_id: Optional[int] = None
+    status: Optional[str] = None
+    criado_em: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    )
+
+
+# Arquivo frio dos pedidos antigos (ver app/arquivamento.py): mesmas colunas das tabelas
+# quentes, sem particionamento, para o job só copiar e apagar linhas.
+class PedidoArquivado(SQLModel, table=True):
+    __tablename__ = "pedido_arquivado"
+    __table_args__ = (
+        Index("ix_pedido_arquivado_usuario_id_data_pedido", "usuario_id", "data_pedido"),
+        CheckConstraint(CONDICAO_STATUS_VALIDO, name="ck_pedido_arquivado_status"),
+    )
+
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    usuario_id: Optional[int] = Field(default=None, foreign_key="usuario.id")
+    data_pedido: date
+    status: str
+    valor_total: float
+    arquivado_em: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    )
+
 
+# A FK para livro fica: livro de pedido arquivado não é removido (ver app/routes/livros.py).
+class PedidoLivroLinkArquivado(SQLModel, table=True):
+    __tablename__ = "pedidolivrolink_arquivado"
+
+    pedido_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    livro_id: int = Field(foreign_key="livro.id", primary_key=True, sa_column_kwargs={"autoincrement": False})
+
+
+class PagamentoArquivado(SQLModel, table=True):
+    __tablename__ = "pagamento_arquivado"
+    __table_args__ = (
+        Index("ix_pagamento_arquivado_pedido_id", "pedido_id"),
+    )
+
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    pedido_id: Optional[int] = None
+    data_pagamento: date
+    valor: float
+    forma_pagamento: str
+    arquivado_em: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    )
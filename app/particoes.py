@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import re
+from datetime import date
+from typing import List
+from sqlalchemy import text
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+# tabela particionada -> coluna da chave de particionamento (RANGE mensal)
+TABELAS_PARTICIONADAS = {
+    "pedido": "data_pedido",
+    "pagamento": "data_pagamento",
+}
+
+
+def inicio_do_mes(dia: date) -> date:
+    return dia.replace(day=1)
+
+
+def somar_meses(mes: date, quantidade: int) -> date:
+    total = mes.year * 12 + mes.month - 1 + quantidade
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def nome_particao(tabela: str, mes: date) -> str:
+    return f"{tabela}_p{mes:%Y_%m}"
+
+
+_PARTICAO = re.compile(rf"^({'|'.join(TABELAS_PARTICIONADAS)})_(p\d{{4}}_\d{{2}}|padrao)$")
+
+
+def eh_particao(nome: str) -> bool:
+    # Partições (e a padrão) não estão nos modelos: o autogenerate do alembic as ignora.
+    return _PARTICAO.match(nome) is not None
+
+
+def sql_criar_particao(tabela: str, coluna: str, mes: date) -> List[str]:
+    # Cria a partição como tabela comum, move para ela as linhas do mês que caíram na
+    # partição padrão e só então a anexa; assim o ATTACH não falha se a padrão tiver dados.
+    nome = nome_particao(tabela, mes)
+    fim = somar_meses(mes, 1)
+    return [
+        f"CREATE TABLE {nome} (LIKE {tabela} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)",
+        f"WITH movidos AS (DELETE FROM {tabela}_padrao WHERE {coluna} >= '{mes}' AND {coluna} < '{fim}' RETURNING *) "
+        f"INSERT INTO {nome} SELECT * FROM movidos",
+        f"ALTER TABLE {tabela} ATTACH PARTITION {nome} FOR VALUES FROM ('{mes}') TO ('{fim}')",
+    ]
+
+
+def sql_desanexar_particao(tabela: str, mes: date) -> List[str]:
+    nome = nome_particao(tabela, mes)
+    comandos = [f"ALTER TABLE {tabela} DETACH PARTITION {nome}"]
+    if tabela == "pedido":
+        # As referências a pedido são triggers (ver app/models.py), que o DETACH não
+        # consulta: a checagem vem logo depois, na mesma transação, e desfaz o DETACH.
+        comandos.append(
+            f"DO $$ BEGIN IF EXISTS (SELECT 1 FROM {nome} p WHERE "
+            f"EXISTS (SELECT 1 FROM pagamento WHERE pedido_id = p.id) "
+            f"OR EXISTS (SELECT 1 FROM pedidolivrolink WHERE pedido_id = p.id)) THEN "
+            f"RAISE foreign_key_violation USING MESSAGE = '{nome} tem pedidos com pagamento ou livros: "
+            f"arquive-os antes (python -m app.arquivamento)'; END IF; END $$"
+        )
+    return comandos
+
+
+async def listar_particoes(conn, tabela: str) -> List[date]:
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :tabela"
+    ), {"tabela": tabela})
+    padrao = re.compile(rf"^{tabela}_p(\d{{4}})_(\d{{2}})$")
+    meses = []
+    for (nome,) in result.all():
+        encontrado = padrao.match(nome)
+        if encontrado:
+            meses.append(date(int(encontrado.group(1)), int(encontrado.group(2)), 1))
+    return sorted(meses)
+
+
+async def manter_particoes(engine, meses_futuros: int, reter_meses=None, dry_run: bool = False, hoje: date = None):
+    mes_atual = inicio_do_mes(hoje or date.today())
+
+    for tabela, coluna in TABELAS_PARTICIONADAS.items():
+        async with engine.connect() as conn:
+            existentes = set(await listar_particoes(conn, tabela))
+
+        operacoes = []
+        for deslocamento in range(meses_futuros + 1):
+            mes = somar_meses(mes_atual, deslocamento)
+            if mes not in existentes:
+                operacoes.append((f"criar {nome_particao(tabela, mes)}", sql_criar_particao(tabela, coluna, mes)))
+
+        if reter_meses is not None:
+            limite = somar_meses(mes_atual, -reter_meses)
+            for mes in sorted(existentes):
+                if mes < limite:
+                    operacoes.append((f"desanexar {nome_particao(tabela, mes)}", sql_desanexar_particao(tabela, mes)))
+
+        for descricao, comandos in operacoes:
+            if dry_run:
+                logger.info(f"[dry-run] Partições: {descricao}")
+                continue
+            async with engine.begin() as conn:
+                for comando in comandos:
+                    await conn.execute(text(comando))
+            logger.info(f"Partições: {descricao}")
+
+        if not operacoes:
+            logger.info(f"Partições de {tabela} já estão em dia")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção das partições mensais de pedido e pagamento")
+    parser.add_argument("--meses-futuros", type=int, default=3, help="Quantidade de meses à frente com partição criada")
+    parser.add_argument("--reter-meses", type=int, default=None, help="Desanexa partições mais antigas que N meses")
+    parser.add_argument("--dry-run", action="store_true", help="Apenas lista as operações")
+    args = parser.parse_args()
+
+    from app.database import engine
+    asyncio.run(manter_particoes(engine, args.meses_futuros, args.reter_meses, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import os
+from datetime import date
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import Text, cast, delete, except_, func, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import EH_SQLITE
+from app.escrita import insert_com_conflito
+from app.models import Livro, Pagamento, Pedido, PedidoLivroLink, PedidoView, Usuario
+from app.status_pedido import condicao_abertos, status_em
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+# Listagem e filtro de pedidos leem só de pedido_view, sem joins.
+PEDIDO_VIEW_LEITURA = os.getenv("PEDIDO_VIEW_LEITURA", "false").lower() in ("1", "true", "sim")
+PEDIDO_VIEW_BLOCO = int(os.getenv("PEDIDO_VIEW_BLOCO", "5000"))
+# O asyncpg aceita até 32767 parâmetros por comando, e sincronizar_pedidos repete a lista
+# de ids em até 6 deles (travas, delete e os filtros de consulta_view).
+BLOCO_SINCRONIZACAO = min(PEDIDO_VIEW_BLOCO, 32767 // 6)
+
+COLUNAS_VIEW = [coluna.name for coluna in PedidoView.__table__.columns]
+
+
+def consulta_view(pedido_ids: Optional[List[int]] = None):
+    # Linhas de pedido_view calculadas a partir das tabelas de origem, na ordem de COLUNAS_VIEW.
+    # O filtro por ids é repetido dentro de cada agregação: o planner não o propaga sozinho
+    # para subconsultas com GROUP BY.
+    def filtro(coluna):
+        return () if pedido_ids is None else (coluna.in_(pedido_ids),)
+
+    if EH_SQLITE:
+        # SQLite < 3.44 não aceita ORDER BY dentro do agregado: json_group_array segue a
+        # ordem das linhas de entrada, então a ordenação vai para uma subconsulta.
+        itens = (
+            select(PedidoLivroLink.pedido_id, Livro.titulo)
+            .join(Livro, Livro.id == PedidoLivroLink.livro_id)
+            .where(*filtro(PedidoLivroLink.pedido_id))
+            .order_by(PedidoLivroLink.pedido_id, Livro.id)
+            .subquery()
+        )
+        livros = (
+            select(itens.c.pedido_id, func.count().label("quantidade"), func.json_group_array(itens.c.titulo).label("titulos"))
+            .group_by(itens.c.pedido_id)
+            .subquery()
+        )
+    else:
+        livros = (
+            select(
+                PedidoLivroLink.pedido_id,
+                func.count().label("quantidade"),
+                func.json_agg(Livro.titulo).aggregate_order_by(Livro.id).label("titulos"),
+            )
+            .join(Livro, Livro.id == PedidoLivroLink.livro_id)
+            .where(*filtro(PedidoLivroLink.pedido_id))
+            .group_by(PedidoLivroLink.pedido_id)
+            .subquery()
+        )
+    # pedido.pagamento é um-para-um no mapeamento: vale o pagamento de menor id.
+    primeiro_pagamento = (
+        select(Pagamento.pedido_id, func.min(Pagamento.id).label("id"))
+        .where(*filtro(Pagamento.pedido_id))
+        .group_by(Pagamento.pedido_id)
+        .subquery()
+    )
+    return (
+        select(
+            Pedido.id,
+            Pedido.usuario_id,
+            Pedido.data_pedido,
+            Pedido.status,
+            Pedido.valor_total,
+            Usuario.nome,
+            Pagamento.id,
+            Pagamento.data_pagamento,
+            Pagamento.valor,
+            Pagamento.forma_pagamento,
+            func.coalesce(livros.c.quantidade, 0),
+            func.coalesce(livros.c.titulos, func.json_array() if EH_SQLITE else func.json_build_array()),
+        )
+        .outerjoin(Usuario, Usuario.id == Pedido.usuario_id)
+        .outerjoin(livros, livros.c.pedido_id == Pedido.id)
+        .outerjoin(primeiro_pagamento, primeiro_pagamento.c.pedido_id == Pedido.id)
+        .outerjoin(Pagamento, (Pagamento.pedido_id == Pedido.id) & (Pagamento.id == primeiro_pagamento.c.id))
+        .where(*filtro(Pedido.id))
+    )
+
+
+async def sincronizar_pedidos(session: AsyncSession, pedido_ids: Iterable[int]):
+    # Recalcula as linhas dos pedidos informados na transação do chamador (sem commit), em
+    # blocos de BLOCO_SINCRONIZACAO. Pedidos que não existem mais não são reinseridos.
+    pedido_ids = sorted(set(pedido_ids))
+    for inicio in range(0, len(pedido_ids), BLOCO_SINCRONIZACAO):
+        await _sincronizar_bloco(session, pedido_ids[inicio:inicio + BLOCO_SINCRONIZACAO])
+
+
+async def _sincronizar_bloco(session: AsyncSession, pedido_ids: List[int]):
+    # Trava os pedidos antes de recalcular: escritas concorrentes no mesmo pedido se
+    # enfileiram, e a última a gravar já enxerga o commit das anteriores.
+    result = await session.execute(
+        select(Pedido.id).where(Pedido.id.in_(pedido_ids)).order_by(Pedido.id).with_for_update()
+    )
+    existentes = result.scalars().all()
+    removidos = set(pedido_ids) - set(existentes)
+    if removidos:
+        await session.execute(delete(PedidoView).where(PedidoView.pedido_id.in_(removidos)))
+    if not existentes:
+        return
+    # Nome e títulos são atualizados direto na view (sincronizar_usuario/sincronizar_livro),
+    # sem travar os pedidos: a trava compartilhada no usuário e nos livros faz a renomeação
+    # concorrente esperar este commit, ou este recálculo esperar o dela.
+    await session.execute(
+        select(Usuario.id).where(Usuario.id.in_(select(Pedido.usuario_id).where(Pedido.id.in_(existentes))))
+        .order_by(Usuario.id).with_for_update(read=True)
+    )
+    await session.execute(
+        select(Livro.id).where(Livro.id.in_(select(PedidoLivroLink.livro_id).where(PedidoLivroLink.pedido_id.in_(existentes))))
+        .order_by(Livro.id).with_for_update(read=True)
+    )
+    stmt = insert_com_conflito(PedidoView).from_select(COLUNAS_VIEW, consulta_view(existentes))
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[PedidoView.pedido_id],
+        set_={coluna: stmt.excluded[coluna] for coluna in COLUNAS_VIEW[1:]},
+    ))
+
+
+async def sincronizar_pagamentos(session: AsyncSession, pagamento_ids: Iterable[int], pedido_ids: Iterable[int] = ()):
+    # Pagamentos alterados ou removidos: além dos pedidos atuais, recalcula os pedidos que
+    # a view ainda associa a eles (pedido_id trocado ou pagamento apagado).
+    pagamento_ids = list(pagamento_ids)
+    anteriores = []
+    if pagamento_ids:
+        result = await session.execute(
+            select(PedidoView.pedido_id).where(PedidoView.pagamento_id.in_(pagamento_ids))
+        )
+        anteriores = result.scalars().all()
+    await sincronizar_pedidos(session, [*anteriores, *pedido_ids])
+
+
+def _titulos_do_pedido():
+    # titulos de consulta_view para a linha de pedido_view sendo atualizada.
+    if EH_SQLITE:
+        itens = (
+            select(Livro.titulo)
+            .join(PedidoLivroLink, PedidoLivroLink.livro_id == Livro.id)
+            .where(PedidoLivroLink.pedido_id == PedidoView.pedido_id)
+            .order_by(Livro.id)
+            .correlate(PedidoView)
+            .subquery()
+        )
+        return select(func.json_group_array(itens.c.titulo)).scalar_subquery()
+    return (
+        select(func.coalesce(func.json_agg(Livro.titulo).aggregate_order_by(Livro.id), func.json_build_array()))
+        .join(PedidoLivroLink, PedidoLivroLink.livro_id == Livro.id)
+        .where(PedidoLivroLink.pedido_id == PedidoView.pedido_id)
+        .scalar_subquery()
+    )
+
+
+async def sincronizar_usuario(session: AsyncSession, usuario_id: int):
+    # Nome alterado: um UPDATE só na view, sem carregar nem travar os pedidos do usuário.
+    await session.execute(
+        update(PedidoView)
+        .where(PedidoView.usuario_id == usuario_id)
+        .values(usuario_nome=select(Usuario.nome).where(Usuario.id == usuario_id).scalar_subquery())
+    )
+
+
+async def sincronizar_livro(session: AsyncSession, livro_id: int):
+    # Título alterado: recalcula os títulos dos pedidos que contêm o livro num UPDATE só.
+    await session.execute(
+        update(PedidoView)
+        .where(PedidoView.pedido_id.in_(select(PedidoLivroLink.pedido_id).where(PedidoLivroLink.livro_id == livro_id)))
+        .values(titulos=_titulos_do_pedido())
+    )
+
+
+async def reconstruir(engine):
+    async with engine.begin() as conn:
+        await conn.execute(delete(PedidoView))
+        await conn.execute(insert(PedidoView).from_select(COLUNAS_VIEW, consulta_view()))
+        total = await conn.scalar(select(func.count()).select_from(PedidoView))
+    logger.info(f"pedido_view reconstruída: {total} pedidos")
+    return total
+
+
+def _item(linha) -> dict:
+    # Mesmo formato de PedidoRead, mais os campos desnormalizados.
+    pagamento = None
+    if linha.pagamento_id is not None:
+        pagamento = {
+            "id": linha.pagamento_id,
+            "pedido_id": linha.pedido_id,
+            "data_pagamento": linha.pagamento_data,
+            "valor": linha.pagamento_valor,
+            "forma_pagamento": linha.pagamento_forma,
+        }
+    return {
+        "id": linha.pedido_id,
+        "usuario_id": linha.usuario_id,
+        "data_pedido": linha.data_pedido,
+        "status": linha.status,
+        "valor_total": linha.valor_total,
+        "pagamento": pagamento,
+        "usuario_nome": linha.usuario_nome,
+        "quantidade_livros": linha.quantidade_livros,
+        "titulos": linha.titulos,
+    }
+
+
+async def listar_da_view(session: AsyncSession, page: int, limit: int, *condicoes) -> Tuple[int, List[dict]]:
+    tabela = PedidoView.__table__
+    conn = await session.connection()
+    total = await conn.scalar(select(func.count()).select_from(tabela).where(*condicoes))
+    result = await conn.execute(
+        select(*tabela.columns).where(*condicoes)
+        .order_by(tabela.c.pedido_id).offset((page - 1) * limit).limit(limit)
+    )
+    return total, [_item(linha) for linha in result]
+
+
+def condicoes_filtro(
+    usuario_id: Optional[int] = None,
+    status: Optional[List[str]] = None,
+    data_pedido: Optional[date] = None,
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    valor_min: Optional[float] = None,
+    valor_max: Optional[float] = None,
+    tabela=None,
+    abertos: bool = False,
+) -> list:
+    # Mesma semântica de filtrar_pedidos, mas com valor_min/valor_max aplicados no banco.
+    # tabela: outra origem com as mesmas colunas de pedido (ex.: a união com o arquivo).
+    c = (PedidoView.__table__ if tabela is None else tabela).c
+    condicoes = []
+    if usuario_id is not None:
+        condicoes.append(c.usuario_id == usuario_id)
+    if status:
+        condicoes.append(status_em(c.status, status))
+    if abertos:
+        condicoes.append(condicao_abertos(c.status))
+    if data_pedido:
+        condicoes.append(c.data_pedido == data_pedido)
+    if data_inicio:
+        condicoes.append(c.data_pedido >= data_inicio)
+    if data_fim:
+        condicoes.append(c.data_pedido <= data_fim)
+    if valor_min is not None:
+        condicoes.append(c.valor_total >= valor_min)
+    if valor_max is not None:
+        condicoes.append(c.valor_total <= valor_max)
+    return condicoes
+
+
+def _comparavel(consulta):
+    # json não tem operador de igualdade; titulos é comparado como texto.
+    colunas = list(consulta.selected_columns)
+    colunas[-1] = cast(colunas[-1], Text)
+    return consulta.with_only_columns(*colunas)
+
+
+async def verificar(engine, corrigir: bool = False) -> List[int]:
+    tabela = PedidoView.__table__
+    gravado = _comparavel(select(*tabela.columns))
+    esperado = _comparavel(consulta_view())
+    async with engine.connect() as conn:
+        faltando = await conn.execute(select(except_(esperado, gravado).subquery().c[0]))
+        sobrando = await conn.execute(select(except_(gravado, esperado).subquery().c[0]))
+        divergentes = sorted(set(faltando.scalars().all()) | set(sobrando.scalars().all()))
+
+    if not divergentes:
+        logger.info("pedido_view consistente com as tabelas de origem")
+        return divergentes
+    logger.warning(f"pedido_view: {len(divergentes)} pedido(s) divergente(s): {divergentes[:20]}")
+    if corrigir:
+        async with AsyncSession(engine) as session:
+            for inicio in range(0, len(divergentes), PEDIDO_VIEW_BLOCO):
+                await sincronizar_pedidos(session, divergentes[inicio:inicio + PEDIDO_VIEW_BLOCO])
+                await session.commit()
+        logger.info(f"pedido_view: {len(divergentes)} pedido(s) corrigido(s)")
+    return divergentes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção do modelo de leitura pedido_view")
+    acao = parser.add_mutually_exclusive_group(required=True)
+    acao.add_argument("--reconstruir", action="store_true", help="Recalcula a tabela inteira")
+    acao.add_argument("--verificar", action="store_true", help="Compara a tabela com as tabelas de origem")
+    parser.add_argument("--corrigir", action="store_true", help="Com --verificar, recalcula os pedidos divergentes")
+    args = parser.parse_args()
+
+    from app.database import engine
+
+    async def executar():
+        if args.reconstruir:
+            await reconstruir(engine)
+        else:
+            divergentes = await verificar(engine, args.corrigir)
+            if divergentes and not args.corrigir:
+                raise SystemExit(1)
+
+    asyncio.run(executar())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import asyncio
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+from app.arquivamento import tabela_vinculos
+from app.database import async_session
+from app.invalidacao import ORIGEM, assinar
+from app.models import PedidoLivroLink
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+RECOMENDACOES_TOP_K = int(os.getenv("RECOMENDACOES_TOP_K", "20"))
+RECOMENDACOES_RECONSTRUIR_S = float(os.getenv("RECOMENDACOES_RECONSTRUIR_S", "3600"))
+RECOMENDACOES_BLOCO_LEITURA = int(os.getenv("RECOMENDACOES_BLOCO_LEITURA", "100000"))
+
+
+def calcular_top_k(pedidos: np.ndarray, livros: np.ndarray, k: int) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    # pedidos/livros são as colunas de pedidolivrolink. A matriz de incidência A (pedido x livro)
+    # gera a coocorrência C = AᵀA; a diagonal (o próprio livro) é descartada.
+    if len(pedidos) == 0:
+        return {}
+    ids_pedido, linha = np.unique(pedidos, return_inverse=True)
+    ids_livro, coluna = np.unique(livros, return_inverse=True)
+    incidencia = sparse.csr_matrix(
+        (np.ones(len(linha), dtype=np.int32), (linha, coluna)),
+        shape=(len(ids_pedido), len(ids_livro)),
+    )
+    incidencia.data[:] = 1
+    coocorrencia = (incidencia.T @ incidencia).tocsr()
+    coocorrencia.setdiag(0)
+    coocorrencia.eliminate_zeros()
+
+    # Ordena todas as entradas por (linha, contagem desc, livro) de uma vez e mantém as k
+    # primeiras de cada linha, sem laço por livro.
+    linhas = np.repeat(np.arange(coocorrencia.shape[0]), np.diff(coocorrencia.indptr))
+    ordem = np.lexsort((coocorrencia.indices, -coocorrencia.data, linhas))
+    posicao = np.arange(len(ordem)) - coocorrencia.indptr[linhas[ordem]]
+    selecionados = ordem[posicao < k]
+
+    linhas_sel = linhas[selecionados]
+    recomendados = ids_livro[coocorrencia.indices[selecionados]].astype(np.int64)
+    contagens = coocorrencia.data[selecionados].astype(np.int32)
+    cortes = np.flatnonzero(np.diff(linhas_sel)) + 1
+    return {
+        int(ids_livro[linhas_sel[inicio]]): (ids, cont)
+        for inicio, ids, cont in zip(
+            np.concatenate(([0], cortes)), np.split(recomendados, cortes), np.split(contagens, cortes)
+        )
+    }
+
+
+class IndiceRecomendacoes:
+    # Guarda, por livro, só os k livros mais comprados junto com ele (dois arrays de tamanho k).
+    # Pedidos novos incrementam as contagens em memória. Pares fora do top-k não são guardados,
+    # então um livro só entra numa lista já cheia na próxima reconstrução periódica, que também
+    # volta às contagens exatas.
+
+    def __init__(self, k: int = RECOMENDACOES_TOP_K):
+        self.k = k
+        self._top: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pronto = False
+        self._lock = asyncio.Lock()
+        self._pendentes: Optional[Dict[int, List[int]]] = None
+        self._primeira_construcao: Optional[asyncio.Task] = None
+
+    @property
+    def pronto(self) -> bool:
+        return self._pronto
+
+    def recomendados(self, livro_id: int, limite: int) -> List[Tuple[int, int]]:
+        entrada = self._top.get(livro_id)
+        if entrada is None:
+            return []
+        ids, contagens = entrada
+        return list(zip(ids[:limite].tolist(), contagens[:limite].tolist()))
+
+    def registrar_pedido(self, pedido_id: int, livro_ids: Iterable[int]):
+        livro_ids = list(dict.fromkeys(livro_ids))
+        if self._pendentes is not None:
+            # Reconstrução em andamento: reaplicado depois se o pedido não estiver no snapshot.
+            self._pendentes[pedido_id] = livro_ids
+        for livro_id in livro_ids:
+            for outro in livro_ids:
+                if outro != livro_id:
+                    self._incrementar(livro_id, outro)
+
+    def _incrementar(self, livro_id: int, outro: int):
+        ids, contagens = self._top.get(livro_id, (np.empty(0, np.int64), np.empty(0, np.int32)))
+        posicao = np.flatnonzero(ids == outro)
+        if len(posicao):
+            contagens = contagens.copy()
+            contagens[posicao[0]] += 1
+        elif len(ids) < self.k:
+            ids = np.append(ids, outro)
+            contagens = np.append(contagens, np.int32(1))
+        else:
+            return
+        # Reordena só os k itens do livro (contagem desc, id asc), como na reconstrução.
+        ordem = np.lexsort((ids, -contagens))
+        self._top[livro_id] = (ids[ordem], contagens[ordem])
+
+    async def reconstruir(self):
+        async with self._lock:
+            self._pendentes = {}
+            try:
+                pedidos, livros = await self._ler_vinculos()
+                top = await asyncio.to_thread(calcular_top_k, pedidos, livros, self.k)
+                no_snapshot = set(np.unique(pedidos).tolist())
+                pendentes = {p: ids for p, ids in self._pendentes.items() if p not in no_snapshot}
+            finally:
+                self._pendentes = None
+            self._top = top
+            self._pronto = True
+            for pedido_id, livro_ids in pendentes.items():
+                self.registrar_pedido(pedido_id, livro_ids)
+            logger.info(f"Recomendações reconstruídas: {len(livros)} vínculos, {len(top)} livros")
+
+    async def _ler_vinculos(self) -> Tuple[np.ndarray, np.ndarray]:
+        pedidos, livros = [], []
+        # Co-compras de todo o histórico, inclusive dos pedidos já arquivados.
+        vinculos = tabela_vinculos(incluir_arquivados=True)
+        async with async_session() as session:
+            result = await session.stream(
+                select(vinculos.c.pedido_id, vinculos.c.livro_id),
+                execution_options={"yield_per": RECOMENDACOES_BLOCO_LEITURA},
+            )
+            async for bloco in result.partitions():
+                colunas = np.array(bloco, dtype=np.int64)
+                pedidos.append(colunas[:, 0])
+                livros.append(colunas[:, 1])
+        if not pedidos:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        return np.concatenate(pedidos), np.concatenate(livros)
+
+    async def garantir_pronto(self):
+        if self._pronto:
+            return
+        # Requisições que chegam antes da primeira construção esperam a mesma tarefa.
+        if self._primeira_construcao is None or self._primeira_construcao.done():
+            self._primeira_construcao = asyncio.create_task(self.reconstruir())
+        await asyncio.shield(self._primeira_construcao)
+
+
+indice_recomendacoes = IndiceRecomendacoes()
+_tarefas = set()
+
+
+def _agendar(coro):
+    tarefa = asyncio.get_running_loop().create_task(coro)
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
+
+
+async def _carregar_pedido_remoto(pedido_id: int):
+    async with async_session() as session:
+        result = await session.execute(
+            select(PedidoLivroLink.livro_id).where(PedidoLivroLink.pedido_id == pedido_id)
+        )
+        indice_recomendacoes.registrar_pedido(pedido_id, result.scalars().all())
+
+
+def _ao_evento(evento: dict):
+    if not indice_recomendacoes.pronto:
+        return
+    if evento["acao"] == "resync":
+        _agendar(indice_recomendacoes.reconstruir())
+    elif evento["entidade"] == "pedido" and evento["acao"] == "criado" and evento.get("origem") != ORIGEM:
+        # Pedidos criados neste worker já foram registrados por criar_pedido.
+        _agendar(_carregar_pedido_remoto(evento["id"]))
+
+
+async def _reconstruir_periodicamente():
+    while True:
+        await asyncio.sleep(RECOMENDACOES_RECONSTRUIR_S)
+        try:
+            await indice_recomendacoes.reconstruir()
+        except Exception:
+            logger.error("Erro ao reconstruir recomendações", exc_info=True)
+
+
+_tarefa_periodica = None
+
+
+async def iniciar_recomendacoes():
+    global _tarefa_periodica
+    assinar("*", _ao_evento)
+    _agendar(indice_recomendacoes.garantir_pronto())
+    if RECOMENDACOES_RECONSTRUIR_S > 0:
+        _tarefa_periodica = asyncio.create_task(_reconstruir_periodicamente())
+
+
+async def encerrar_recomendacoes():
+    if _tarefa_periodica is not None:
+        _tarefa_periodica.cancel()
@@ -0,0 +1,25 @@
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query
+from app.autocompletar import AUTOCOMPLETE_LIMITE_PADRAO, TIPOS, autocompletar
+from app.schemas import AutocompleteItem
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+router = APIRouter(prefix="/autocomplete", tags=["Autocomplete"])
+
+@router.get("", response_model=List[AutocompleteItem])
+async def sugerir(
+    q: str = Query(..., min_length=1, description="Início de um título, autor ou editora"),
+    limit: int = Query(AUTOCOMPLETE_LIMITE_PADRAO, ge=1, le=50),
+    tipos: Optional[str] = Query(None, description="Tipos separados por vírgula: livro, autor, editora"),
+):
+    tipos_busca = TIPOS
+    if tipos:
+        tipos_busca = tuple(sorted({tipo.strip() for tipo in tipos.split(",") if tipo.strip()}))
+        invalidos = set(tipos_busca) - set(TIPOS)
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"Tipos inválidos: {', '.join(sorted(invalidos))}.")
+
+    indice = await autocompletar.garantir_pronto()
+    return indice.buscar(q, limit, tipos_busca)
@@ -5,7 +5,11 @@ from sqlalchemy import func
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.future import select
 from app.database import get_session
-from app.models import Autor
+from app.leitura import LEITURA_LEVE, ler_por_id, listar_pagina, resposta_json
+from app.timeouts import sessao_com_timeout
+from app.invalidacao import publicar
+from app.escrita import inserir_retornando, atualizar_retornando, deletar_retornando, desvincular_retornando
+from app.models import Autor, Livro
 from app.schemas import AutorCreate, AutorUpdate, AutorRead, AutorCount, PaginatedAutor
 from logs.logger import get_logger
 
@@ -14,6 +18,12 @@ router = APIRouter(prefix="/autores", tags=["Autores"])
 
 @router.get("/autores/{id}", response_model=Autor)
 async def obter_autor_por_id(id: int, session: AsyncSession = Depends(get_session)):
+    if LEITURA_LEVE:
+        autor = await ler_por_id(session, Autor, id)
+        if not autor:
+            raise HTTPException(status_code=404, detail="Autor não encontrado")
+        return resposta_json(autor)
+
     result = await session.execute(select(Autor).where(Autor.id == id))
     autor = result.scalar_one_or_none()
     if not autor:
@@ -22,11 +32,10 @@ async def obter_autor_por_id(id: int, session: AsyncSession = Depends(get_sessio
 
 @router.post("/", response_model=Autor)
 async def criar_autor(autor: AutorCreate, session: AsyncSession = Depends(get_session)):
-    novo_autor = Autor(**autor.dict())
-    session.add(novo_autor)
+    novo_autor = await inserir_retornando(session, Autor, autor.dict())
     await session.commit()
-    await session.refresh(novo_autor)
     logger.info(f"Autor criado: {novo_autor.id} - {novo_autor.nome} ({novo_autor.email})")
+    await publicar("autor", "criado", novo_autor.id)
     return novo_autor
 
 @router.patch("/{autor_id}", response_model=Autor)
@@ -35,22 +44,16 @@ async def atualizar_autor(
     autor_update: AutorUpdate,
     session: AsyncSession = Depends(get_session)
 ):
-    query = select(Autor).where(Autor.id == autor_id)
-    result = await session.execute(query)
-    autor = result.scalar_one_or_none()
+    update_data = autor_update.dict(exclude_unset=True)
+    autor = await atualizar_retornando(session, Autor, autor_id, update_data)
 
     if not autor:
         logger.warning(f"Tentativa de atualizar autor não encontrado: ID {autor_id}")
         raise HTTPException(status_code=404, detail="Autor não encontrado")
 
-    update_data = autor_update.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(autor, key, value)
-
-    session.add(autor)
     await session.commit()
-    await session.refresh(autor)
     logger.info(f"Autor atualizado: {autor.id} - {autor.nome}")
+    await publicar("autor", "atualizado", autor.id)
     return autor
 
 @router.get("/", response_model=PaginatedAutor)
@@ -59,6 +62,9 @@ async def listar_autores(
     limit: int = Query(10, ge=1, le=100, description="Quantidade de registros por página"),
     session: AsyncSession = Depends(get_session),
 ):
+    if LEITURA_LEVE:
+        return await listar_pagina(session, Autor, page, limit)
+
     offset = (page - 1) * limit
 
     result_total = await session.execute(select(Autor))
@@ -81,14 +87,17 @@ async def contar_autores(session: AsyncSession = Depends(get_session)):
 
 @router.delete("/", response_model=dict)
 async def deletar_autor(autor_id: int, session: AsyncSession = Depends(get_session)):
-    autor = await session.get(Autor, autor_id)
-    if not autor:
+    # Como no delete do ORM: os livros do autor ficam, com autor_id nulo.
+    livro_ids = await desvincular_retornando(session, Livro, Livro.autor_id, autor_id)
+    if await deletar_retornando(session, Autor, autor_id) is None:
         logger.warning(f"Tentativa de deletar autor não encontrado: ID {autor_id}")
         raise HTTPException(status_code=404, detail="Autor não encontrado")
 
-    await session.delete(autor)
     await session.commit()
     logger.info(f"Autor deletado: ID {autor_id}")
+    await publicar("autor", "removido", autor_id)
+    if livro_ids:
+        await publicar("livro", "lote")
     return {"message": "Autor deletado com sucesso"}
 
 @router.get("/filtrar", response_model=PaginatedAutor)
@@ -99,7 +108,7 @@ async def filtrar_autores(
     nacionalidade: Optional[str] = Query(None, description="Filtro pela nacionalidade do autor"),
     page: int = Query(1, ge=1, description="Número da página"),
     limit: int = Query(10, ge=1, le=100, description="Quantidade de registros por página"),
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(sessao_com_timeout("filtrar_autores"))
 ):
     query = select(Autor)
 
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+from collections import deque
+from urllib.parse import urlencode
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.asyncexitstack import AsyncExitStackMiddleware
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from app.codificacao import msgpack_negociado
+from app.database import async_session, sessao_compartilhada
+from app.schemas import BatchRequest, BatchResponse, OperacaoBatch
+from app.timeouts import eh_timeout
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+BATCH_MAX_OPERACOES = int(os.getenv("BATCH_MAX_OPERACOES", "20"))
+BATCH_CONCORRENCIA = int(os.getenv("BATCH_CONCORRENCIA", "4"))
+# Cada consulta simultânea ocupa uma conexão do pool.
+BATCH_CONCORRENCIA_MAX = int(os.getenv("BATCH_CONCORRENCIA_MAX", "8"))
+# Limite de cada operação; a que estourar responde 504 e não segura as demais.
+BATCH_TIMEOUT_OPERACAO_S = float(os.getenv("BATCH_TIMEOUT_OPERACAO_S", "30"))
+# Streams não terminam sozinhos; num batch eles só prenderiam o trabalhador.
+CAMINHOS_STREAMING = ("/pedidos/eventos",)
+TIPOS_STREAMING = (b"text/event-stream",)
+
+router = APIRouter(prefix="/batch", tags=["Batch"])
+
+
+def _resposta_erro(status: int, detail) -> tuple:
+    return status, json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+
+
+async def _executar_operacao(app, operacao: OperacaoBatch) -> tuple:
+    caminho, _, query = operacao.path.partition("?")
+    if not caminho.startswith("/") or caminho.rstrip("/") == router.prefix:
+        return _resposta_erro(400, f"Caminho inválido para operação em batch: {operacao.path}")
+    if caminho.rstrip("/").startswith(CAMINHOS_STREAMING):
+        return _resposta_erro(400, f"Streams não podem ser executados em batch: {operacao.path}")
+    if operacao.params:
+        query = "&".join(filter(None, (query, urlencode(operacao.params, doseq=True))))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": caminho,
+        "raw_path": caminho.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"accept", b"application/json")],
+        "client": None,
+        "server": None,
+        "app": app,
+        "state": {},
+    }
+    entregue = False
+    # Sinaliza a desconexão para respostas que a escutam (StreamingResponse): sai quando a
+    # resposta se revela um stream.
+    encerrar = asyncio.Event()
+
+    async def receber():
+        nonlocal entregue
+        if not entregue:
+            entregue = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await encerrar.wait()
+        return {"type": "http.disconnect"}
+
+    resposta = {"status": 500, "headers": [], "partes": [], "streaming": False}
+
+    async def enviar(mensagem):
+        if resposta["streaming"]:
+            return
+        if mensagem["type"] == "http.response.start":
+            resposta["status"] = mensagem["status"]
+            resposta["headers"] = mensagem.get("headers", [])
+            if dict(resposta["headers"]).get(b"content-type", b"").startswith(TIPOS_STREAMING):
+                resposta["streaming"] = True
+                encerrar.set()
+        elif mensagem["type"] == "http.response.body":
+            resposta["partes"].append(mensagem.get("body", b""))
+
+    # Chama o roteador diretamente: os middlewares (admissão, compressão) já valem
+    # para a requisição /batch como um todo.
+    try:
+        await asyncio.wait_for(AsyncExitStackMiddleware(app.router)(scope, receber, enviar), BATCH_TIMEOUT_OPERACAO_S)
+    except asyncio.TimeoutError:
+        logger.warning(f"Operação em batch {operacao.path} excedeu {BATCH_TIMEOUT_OPERACAO_S}s")
+        return _resposta_erro(504, f"Tempo limite excedido ao processar {operacao.path}.")
+    except (HTTPException, StarletteHTTPException) as e:
+        return _resposta_erro(e.status_code, e.detail)
+    except RequestValidationError as e:
+        return _resposta_erro(422, jsonable_encoder(e.errors()))
+    except Exception as e:
+        if eh_timeout(e):
+            return _resposta_erro(504, f"Tempo limite excedido ao processar {operacao.path}.")
+        logger.error(f"Erro na operação em batch {operacao.path}", exc_info=True)
+        return _resposta_erro(500, "Erro interno ao executar operação.")
+
+    if resposta["streaming"]:
+        return _resposta_erro(400, f"Streams não podem ser executados em batch: {operacao.path}")
+    corpo = b"".join(resposta["partes"])
+    tipo = dict(resposta["headers"]).get(b"content-type", b"")
+    if not tipo.startswith(b"application/json"):
+        corpo = json.dumps(corpo.decode("utf-8", "replace") or None, ensure_ascii=False).encode("utf-8")
+    return resposta["status"], corpo
+
+
+async def _trabalhador(app, fila: deque, resultados: list):
+    # Todas as operações executadas por este trabalhador usam a mesma sessão (e conexão).
+    # Os corpos são montados em JSON, seja qual for o formato negociado para o /batch.
+    msgpack_negociado.set(False)
+    async with async_session() as session:
+        token = sessao_compartilhada.set(session)
+        try:
+            while fila:
+                indice, operacao = fila.popleft()
+                status, corpo = await _executar_operacao(app, operacao)
+                if status >= 500:
+                    # Uma consulta com erro invalida a transação; as próximas começam do zero.
+                    await session.rollback()
+                resultados[indice] = (operacao.id, status, corpo)
+        finally:
+            sessao_compartilhada.reset(token)
+
+
+@router.post("", response_model=BatchResponse)
+async def executar_batch(batch: BatchRequest, request: Request):
+    if len(batch.operacoes) > BATCH_MAX_OPERACOES:
+        raise HTTPException(status_code=413, detail=f"Batch excede o limite de {BATCH_MAX_OPERACOES} operações.")
+    concorrencia = BATCH_CONCORRENCIA if batch.concorrencia is None else batch.concorrencia
+    if concorrencia < 1:
+        raise HTTPException(status_code=400, detail="concorrencia deve ser maior que zero.")
+    concorrencia = min(concorrencia, BATCH_CONCORRENCIA_MAX, len(batch.operacoes) or 1)
+
+    fila = deque(enumerate(batch.operacoes))
+    resultados = [None] * len(batch.operacoes)
+    await asyncio.gather(*(_trabalhador(request.app, fila, resultados) for _ in range(concorrencia)))
+
+    # Os corpos já estão em JSON; são montados na resposta sem decodificar de novo.
+    itens = [
+        b'{"id":' + json.dumps(id_operacao).encode("utf-8") + b',"status":' + str(status).encode()
+        + b',"body":' + (corpo or b"null") + b"}"
+        for id_operacao, status, corpo in resultados
+    ]
+    return Response(content=b'{"resultados":[' + b",".join(itens) + b"]}", media_type="application/json")
@@ -4,7 +4,11 @@ from sqlmodel import Session
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.future import select
 from app.database import get_session
-from app.models import Editora
+from app.leitura import LEITURA_LEVE, ler_por_id, listar_pagina, resposta_json
+from app.timeouts import sessao_com_timeout
+from app.invalidacao import publicar
+from app.escrita import inserir_retornando, atualizar_retornando, deletar_retornando, desvincular_retornando
+from app.models import Editora, Livro
 from app.schemas import EditoraCreate,  EditoraUpdate, EditoraRead, EditoraCount, PaginatedEditoras
 from logs.logger import get_logger
 
@@ -13,6 +17,12 @@ router = APIRouter(prefix="/editoras", tags=["Editoras"])
 
 @router.get("/editoras/{id}", response_model=Editora)
 async def obter_editora_por_id(id: int, session: AsyncSession = Depends(get_session)):
+    if LEITURA_LEVE:
+        editora = await ler_por_id(session, Editora, id)
+        if not editora:
+            raise HTTPException(status_code=404, detail="Editora não encontrada")
+        return resposta_json(editora)
+
     result = await session.execute(select(Editora).where(Editora.id == id))
     editora = result.scalar_one_or_none()
     if not editora:
@@ -21,11 +31,10 @@ async def obter_editora_por_id(id: int, session: AsyncSession = Depends(get_sess
 
 @router.post("/", response_model=Editora)
 async def criar_editora(editora: EditoraCreate, session: AsyncSession = Depends(get_session)):
-    nova_editora = Editora(**editora.dict())
-    session.add(nova_editora)
+    nova_editora = await inserir_retornando(session, Editora, editora.dict())
     await session.commit()
-    await session.refresh(nova_editora)
     logger.info(f"Editora criada: {nova_editora.id} - {nova_editora.nome}")
+    await publicar("editora", "criado", nova_editora.id)
     return nova_editora
 
 @router.patch("/", response_model=Editora)
@@ -34,24 +43,16 @@ async def atualizar_editora(
     editora_update: EditoraUpdate,
     session: AsyncSession = Depends(get_session)
 ):
-    
-    query = select(Editora).where(Editora.id == editora_id)
-    result = await session.execute(query)
-    editora = result.scalar_one_or_none()
+    update_data = editora_update.dict(exclude_unset=True)
+    editora = await atualizar_retornando(session, Editora, editora_id, update_data)
 
     if not editora:
         logger.warning(f"Tentativa de atualizar editora não encontrada: ID {editora_id}")
         raise HTTPException(status_code=404, detail="Editora não encontrada")
 
-
-    update_data = editora_update.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(editora, key, value)
-
-    session.add(editora)
     await session.commit()
-    await session.refresh(editora)
     logger.info(f"Editora atualizada: {editora.id} - {editora.nome}")
+    await publicar("editora", "atualizado", editora.id)
     return editora
 
 @router.get("/", response_model=PaginatedEditoras)
@@ -60,6 +61,9 @@ async def listar_editoras(
     limit: int = Query(10, ge=1),
     session: AsyncSession = Depends(get_session)
 ):
+    if LEITURA_LEVE:
+        return await listar_pagina(session, Editora, page, limit)
+
     query = select(Editora)
 
     offset = (page - 1) * limit
@@ -87,14 +91,17 @@ async def contar_editoras(session: AsyncSession = Depends(get_session)):
 
 @router.delete("/", response_model=dict)
 async def deletar_editora(editora_id: int, session: AsyncSession = Depends(get_session)):
-    editora = await session.get(Editora, editora_id)
-    if not editora:
+    # Como no delete do ORM: os livros da editora ficam, com editora_id nulo.
+    livro_ids = await desvincular_retornando(session, Livro, Livro.editora_id, editora_id)
+    if await deletar_retornando(session, Editora, editora_id) is None:
         logger.warning(f"Tentativa de deletar editora não encontrada: ID {editora_id}")
         raise HTTPException(status_code=404, detail="Editora não encontrada")
 
-    await session.delete(editora)
     await session.commit()
     logger.info(f"Editora deletada: ID {editora_id}")
+    await publicar("editora", "removido", editora_id)
+    if livro_ids:
+        await publicar("livro", "lote")
     return {"message": "Editora deletada com sucesso"}
 
 @router.get("/filtro", response_model=PaginatedEditoras)
@@ -105,7 +112,7 @@ async def filtrar_editoras(
     email: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(sessao_com_timeout("filtrar_editoras"))
 ):
     query = select(Editora)
     filtros_aplicados = []
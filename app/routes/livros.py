@@ -1,13 +1,28 @@
 from typing import List, Optional
-from sqlalchemy import desc, func
+from sqlalchemy import Numeric, cast, delete, desc, exists, func, literal, null, tuple_, union_all, update
 from sqlalchemy.orm import joinedload
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.future import select
 from logs.logger import get_logger
-from app.database import get_session
-from app.models import Livro, PedidoLivroLink
-from app.schemas import LivroCreate, LivroUpdate, LivroRead, LivroCount, PaginatedLivros, LivroInfo
+from app.database import EH_SQLITE, get_session
+from app.leitura import LEITURA_LEVE, ler_por_id, listar_pagina, resposta_json
+from app.timeouts import sessao_com_timeout
+from app.coalescencia import compartilhar
+from app.invalidacao import publicar
+from app.escrita import inserir_retornando, atualizar_retornando, deletar_retornando
+from app.agrupamento import ESCRITA_AGRUPADA, agrupador_para
+from app.lote import executar_lote, validar_lote
+from app.recomendacoes import indice_recomendacoes
+from app.pedido_view import sincronizar_livro, sincronizar_pedidos
+from app.eventos_pedidos import registrar_eventos
+from app.catalogo import CATALOGO_MEMORIA, CATALOGO_VERIFICAR, catalogo
+from app.facetas import cache_facetas, chave_filtros, faixa_preco, rotulos_faixas
+from app.models import Autor, Editora, Livro, PedidoLivroLink, PedidoLivroLinkArquivado
+from app.schemas import (
+    LivroCreate, LivroUpdate, LivroRead, LivroCount, PaginatedLivros, LivroInfo, LivroPrecoLote, ResultadoLote,
+    LivroRecomendado, LivroFacetas, FacetaItem
+)
 
 logger = get_logger("MyBooks")
 
@@ -15,6 +30,12 @@ router = APIRouter(prefix="/livros", tags=["Livros"])
 
 @router.get("/livros/{id}", response_model=Livro)
 async def obter_livro_por_id(id: int, session: AsyncSession = Depends(get_session)):
+    if LEITURA_LEVE:
+        livro = await ler_por_id(session, Livro, id)
+        if not livro:
+            raise HTTPException(status_code=404, detail="Livro não encontrado")
+        return resposta_json(livro)
+
     result = await session.execute(select(Livro).where(Livro.id == id))
     livro = result.scalar_one_or_none()
     if not livro:
@@ -23,11 +44,14 @@ async def obter_livro_por_id(id: int, session: AsyncSession = Depends(get_sessio
 
 @router.post("/", response_model=Livro)
 async def criar_livro(livro: LivroCreate, session: AsyncSession = Depends(get_session)):
-    novo_livro = Livro(**livro.dict())
-    session.add(novo_livro)
-    await session.commit()
-    await session.refresh(novo_livro)
+    if ESCRITA_AGRUPADA:
+        novo_livro = await agrupador_para(Livro).inserir(livro.dict())
+    else:
+        novo_livro = await inserir_retornando(session, Livro, livro.dict())
+        await session.commit()
+    catalogo.gravar(novo_livro)
     logger.info(f"Livro criado: {novo_livro.id} - {novo_livro.titulo}")
+    await publicar("livro", "criado", novo_livro.id)
     return novo_livro
 
 @router.patch("/{livro_id}", response_model=Livro)
@@ -36,24 +60,57 @@ async def atualizar_livro(
     livro_update: LivroUpdate,
     session: AsyncSession = Depends(get_session)
 ):
-    query = select(Livro).where(Livro.id == livro_id)
-    result = await session.execute(query)
-    livro = result.scalar_one_or_none()
+    update_data = livro_update.dict(exclude_unset=True)
+    livro = await atualizar_retornando(session, Livro, livro_id, update_data)
 
     if not livro:
         logger.warning(f"Tentativa de atualizar livro não encontrado: ID {livro_id}")
         raise HTTPException(status_code=404, detail="Livro não encontrado")
 
-    update_data = livro_update.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(livro, key, value)
-
-    session.add(livro)
+    if "titulo" in update_data:
+        await sincronizar_livro(session, livro_id)
     await session.commit()
-    await session.refresh(livro)
+    catalogo.gravar(livro)
     logger.info(f"Livro atualizado: {livro.id} - {livro.titulo}")
+    await publicar("livro", "atualizado", livro.id)
     return livro
 
+@router.patch("/lote/preco", response_model=ResultadoLote)
+async def reajustar_precos_lote(lote: LivroPrecoLote, session: AsyncSession = Depends(get_session)):
+    validar_lote(lote.ids, editora_id=lote.editora_id, autor_id=lote.autor_id, genero=lote.genero)
+    if lote.percentual <= -100:
+        raise HTTPException(status_code=400, detail="Percentual deve ser maior que -100.")
+
+    fator = 1 + lote.percentual / 100
+    stmt = update(Livro).values(preco=func.round(cast(Livro.preco * fator, Numeric), 2))
+    if lote.ids is not None:
+        stmt = stmt.where(Livro.id.in_(lote.ids))
+    if lote.editora_id is not None:
+        stmt = stmt.where(Livro.editora_id == lote.editora_id)
+    if lote.autor_id is not None:
+        stmt = stmt.where(Livro.autor_id == lote.autor_id)
+    if lote.genero is not None:
+        stmt = stmt.where(Livro.genero == lote.genero)
+
+    logger.info(f"Reajustando preços em lote: {lote.percentual}%")
+    return await executar_lote(session, stmt.returning(Livro.id), "livro", "reajustado")
+
+@router.delete("/lote", response_model=ResultadoLote)
+async def deletar_livros_lote(ids: List[int] = Query(...), session: AsyncSession = Depends(get_session)):
+    validar_lote(ids)
+    # Livros com pedidos vinculados (quentes ou arquivados) ficam de fora e não aparecem nos ids retornados.
+    stmt = (
+        delete(Livro)
+        .where(Livro.id.in_(ids))
+        .where(~exists().where(PedidoLivroLink.livro_id == Livro.id))
+        .where(~exists().where(PedidoLivroLinkArquivado.livro_id == Livro.id))
+        .returning(Livro.id)
+    )
+    resultado = await executar_lote(session, stmt, "livro", "removido")
+    if resultado.afetados < len(set(ids)):
+        logger.warning(f"{len(set(ids)) - resultado.afetados} livro(s) não encontrados ou com pedidos vinculados")
+    return resultado
+
 @router.get("/", response_model=PaginatedLivros)
 async def listar_livros(
     page: int = Query(1, ge=1),
@@ -62,6 +119,10 @@ async def listar_livros(
     session: AsyncSession = Depends(get_session)
 ):
     logger.info(f"Listando livros - página {page}, limite {limit}, autor_id={autor_id}")
+    if LEITURA_LEVE:
+        condicoes = () if autor_id is None else (Livro.autor_id == autor_id,)
+        return await listar_pagina(session, Livro, page, limit, *condicoes, com_pagina=False)
+
     offset = (page - 1) * limit
 
     query = select(Livro)
@@ -79,9 +140,12 @@ async def listar_livros(
 
 @router.get("/count", response_model=LivroCount)
 async def contar_livros(
-    autor_id: Optional[int] = Query(None),
-    session: AsyncSession = Depends(get_session)
+    request: Request,
+    autor_id: Optional[int] = Query(None)
 ):
+    return await compartilhar(request, "contar_livros", _contar_livros, autor_id)
+
+async def _contar_livros(session: AsyncSession, autor_id: Optional[int]):
     stmt = select(func.count()).select_from(Livro)
 
     if autor_id is not None:
@@ -99,14 +163,25 @@ async def contar_livros(
 
 @router.delete("/", response_model=dict)
 async def deletar_livro(livro_id: int, session: AsyncSession = Depends(get_session)):
-    livro = await session.get(Livro, livro_id)
-    if not livro:
+    # O arquivo é histórico e não se reescreve: livro de pedido arquivado não sai (como no lote).
+    if await session.scalar(select(exists().where(PedidoLivroLinkArquivado.livro_id == livro_id))):
+        raise HTTPException(status_code=409, detail="Livro consta em pedidos arquivados.")
+    # Como no delete do ORM: o livro sai dos pedidos quentes em que estava.
+    result = await session.execute(
+        delete(PedidoLivroLink).where(PedidoLivroLink.livro_id == livro_id).returning(PedidoLivroLink.pedido_id)
+    )
+    pedido_ids = result.scalars().all()
+    if await deletar_retornando(session, Livro, livro_id) is None:
         logger.warning(f"Tentativa de deletar livro não encontrado: ID {livro_id}")
         raise HTTPException(status_code=404, detail="Livro não encontrado")
 
-    await session.delete(livro)
+    if pedido_ids:
+        await registrar_eventos(session, "pedido", "atualizado", pedido_ids)
+        await sincronizar_pedidos(session, pedido_ids)
     await session.commit()
+    catalogo.remover(livro_id)
     logger.info(f"Livro deletado: ID {livro_id}")
+    await publicar("livro", "removido", livro_id)
     return {"message": "Livro deletado com sucesso"}
 
 @router.get("/filtro", response_model=PaginatedLivros)
@@ -119,32 +194,42 @@ async def filtrar_livros(
     editora_id: Optional[int] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(sessao_com_timeout("filtrar_livros"))
 ):
-    query = select(Livro)
-    filtros_aplicados = []
-
-    if titulo:
-        query = query.where(Livro.titulo.ilike(f"%{titulo}%"))
-        filtros_aplicados.append(f"titulo='{titulo}'")
-    if genero:
-        query = query.where(Livro.genero == genero)
-        filtros_aplicados.append(f"genero='{genero}'")
-    if preco_min is not None:
-        query = query.where(Livro.preco >= preco_min)
-        filtros_aplicados.append(f"preco_min={preco_min}")
-    if preco_max is not None:
-        query = query.where(Livro.preco <= preco_max)
-        filtros_aplicados.append(f"preco_max={preco_max}")
-    if autor_id:
-        query = query.where(Livro.autor_id == autor_id)
-        filtros_aplicados.append(f"autor_id={autor_id}")
-    if editora_id:
-        query = query.where(Livro.editora_id == editora_id)
-        filtros_aplicados.append(f"editora_id={editora_id}")
-
+    condicoes, filtros_aplicados = _filtros_livro(titulo, genero, preco_min, preco_max, autor_id, editora_id)
     offset = (page - 1) * limit
 
+    # Sem filtro de título, o snapshot colunar responde sem ir ao banco.
+    if CATALOGO_MEMORIA and not titulo:
+        snapshot = await catalogo.garantir_pronto()
+        posicoes = snapshot.filtrar(genero, preco_min, preco_max, autor_id, editora_id)
+        consistente = True
+        if CATALOGO_VERIFICAR:
+            result = await session.execute(
+                select(Livro.id, Livro.preco, Livro.genero, Livro.autor_id, Livro.editora_id)
+                .where(*condicoes)
+                .order_by(Livro.id)
+            )
+            consistente = catalogo.conferir(snapshot.registros(posicoes), [tuple(linha) for linha in result.all()])
+        if consistente:
+            if not len(posicoes):
+                logger.warning(
+                    f"Nenhum livro encontrado com filtros: {', '.join(filtros_aplicados) or 'nenhum'}"
+                )
+                raise HTTPException(status_code=404, detail="Nenhum livro encontrado")
+            logger.info(
+                f"Filtro de livros (catálogo em memória) retornou {min(limit, max(len(posicoes) - offset, 0))} "
+                f"de {len(posicoes)} registros - Filtros usados: {', '.join(filtros_aplicados) or 'nenhum'}"
+            )
+            return {
+                "page": page,
+                "limit": limit,
+                "total": len(posicoes),
+                "items": snapshot.linhas(posicoes[offset:offset + limit])
+            }
+
+    query = select(Livro).where(*condicoes)
+
     paginated_query = query.offset(offset).limit(limit)
     result = await session.execute(paginated_query)
     livros = result.scalars().all()
@@ -170,6 +255,147 @@ async def filtrar_livros(
         "items": livros
     }
 
+def _filtros_livro(
+    titulo: Optional[str],
+    genero: Optional[str],
+    preco_min: Optional[float],
+    preco_max: Optional[float],
+    autor_id: Optional[int],
+    editora_id: Optional[int],
+):
+    condicoes = []
+    filtros_aplicados = []
+
+    if titulo:
+        condicoes.append(Livro.titulo.ilike(f"%{titulo}%"))
+        filtros_aplicados.append(f"titulo='{titulo}'")
+    if genero:
+        condicoes.append(Livro.genero == genero)
+        filtros_aplicados.append(f"genero='{genero}'")
+    if preco_min is not None:
+        condicoes.append(Livro.preco >= preco_min)
+        filtros_aplicados.append(f"preco_min={preco_min}")
+    if preco_max is not None:
+        condicoes.append(Livro.preco <= preco_max)
+        filtros_aplicados.append(f"preco_max={preco_max}")
+    if autor_id:
+        condicoes.append(Livro.autor_id == autor_id)
+        filtros_aplicados.append(f"autor_id={autor_id}")
+    if editora_id:
+        condicoes.append(Livro.editora_id == editora_id)
+        filtros_aplicados.append(f"editora_id={editora_id}")
+
+    return condicoes, filtros_aplicados
+
+@router.get("/facetas", response_model=LivroFacetas)
+async def facetas_livros(
+    titulo: Optional[str] = Query(None),
+    genero: Optional[str] = Query(None),
+    preco_min: Optional[float] = Query(None),
+    preco_max: Optional[float] = Query(None),
+    autor_id: Optional[int] = Query(None),
+    editora_id: Optional[int] = Query(None),
+    session: AsyncSession = Depends(sessao_com_timeout("facetas_livros"))
+):
+    chave = chave_filtros(titulo, genero, preco_min, preco_max, autor_id, editora_id)
+    facetas = cache_facetas.obter(chave)
+    if facetas is not None:
+        logger.info(f"Facetas de livros servidas do cache: {chave}")
+        return facetas
+
+    geracao = cache_facetas.geracao
+    condicoes, filtros_aplicados = _filtros_livro(titulo, genero, preco_min, preco_max, autor_id, editora_id)
+    facetas = await _calcular_facetas(session, condicoes)
+    cache_facetas.guardar(chave, facetas, geracao)
+    logger.info(
+        f"Facetas de livros calculadas para {facetas.total} livros - "
+        f"Filtros usados: {', '.join(filtros_aplicados) or 'nenhum'}"
+    )
+    return facetas
+
+async def _calcular_facetas(session: AsyncSession, condicoes: list) -> LivroFacetas:
+    base = (
+        select(
+            Livro.genero,
+            faixa_preco(Livro.preco).label("faixa_preco"),
+            Livro.editora_id,
+            Editora.nome.label("editora_nome"),
+            Livro.autor_id,
+            Autor.nome.label("autor_nome"),
+        )
+        .outerjoin(Editora, Editora.id == Livro.editora_id)
+        .outerjoin(Autor, Autor.id == Livro.autor_id)
+        .where(*condicoes)
+        .subquery()
+    )
+    conjuntos = (
+        (base.c.genero,),
+        (base.c.faixa_preco,),
+        (base.c.editora_id, base.c.editora_nome),
+        (base.c.autor_id, base.c.autor_nome),
+        (),
+    )
+    if EH_SQLITE:
+        # Sem GROUPING SETS no SQLite: um SELECT agrupado por conjunto, unidos, com os
+        # indicadores de GROUPING() como literais.
+        colunas = [coluna for conjunto in conjuntos for coluna in conjunto]
+        sinalizadores = ("sem_genero", "sem_faixa", "sem_editora", "sem_autor")
+        stmt = union_all(*(
+            select(
+                *(coluna if any(coluna is c for c in conjunto) else null().label(coluna.name) for coluna in colunas),
+                *(literal(int(i != indice)).label(nome) for i, nome in enumerate(sinalizadores)),
+                func.count().label("total"),
+            ).select_from(base).group_by(*conjunto)
+            for indice, conjunto in enumerate(conjuntos)
+        ))
+        result = await session.execute(stmt)
+        return _montar_facetas(result.all())
+
+    # Um único GROUP BY com um conjunto por faceta e () para o total; GROUPING() diz a que
+    # conjunto cada linha pertence (um editora_id nulo também é um grupo válido).
+    stmt = select(
+        base.c.genero,
+        base.c.faixa_preco,
+        base.c.editora_id,
+        base.c.editora_nome,
+        base.c.autor_id,
+        base.c.autor_nome,
+        func.grouping(base.c.genero).label("sem_genero"),
+        func.grouping(base.c.faixa_preco).label("sem_faixa"),
+        func.grouping(base.c.editora_id).label("sem_editora"),
+        func.grouping(base.c.autor_id).label("sem_autor"),
+        func.count().label("total"),
+    ).group_by(func.grouping_sets(*(tuple_(*conjunto) for conjunto in conjuntos)))
+    result = await session.execute(stmt)
+    return _montar_facetas(result.all())
+
+def _montar_facetas(linhas) -> LivroFacetas:
+    total = 0
+    generos, faixas, editoras, autores = [], [], [], []
+    for linha in linhas:
+        if not linha.sem_genero:
+            generos.append(FacetaItem(valor=linha.genero, total=linha.total))
+        elif not linha.sem_faixa:
+            faixas.append(FacetaItem(valor=linha.faixa_preco, total=linha.total))
+        elif not linha.sem_editora:
+            editoras.append(FacetaItem(id=linha.editora_id, valor=linha.editora_nome, total=linha.total))
+        elif not linha.sem_autor:
+            autores.append(FacetaItem(id=linha.autor_id, valor=linha.autor_nome, total=linha.total))
+        else:
+            total = linha.total
+
+    def por_total(item: FacetaItem):
+        return (-item.total, item.valor or "", item.id or 0)
+
+    ordem_faixas = {rotulo: i for i, rotulo in enumerate(rotulos_faixas())}
+    return LivroFacetas(
+        total=total,
+        genero=sorted(generos, key=por_total),
+        faixa_preco=sorted(faixas, key=lambda item: ordem_faixas[item.valor]),
+        editora=sorted(editoras, key=por_total),
+        autor=sorted(autores, key=por_total),
+    )
+
 @router.get("/detalhes", response_model=LivroInfo)
 async def detalhes_livro(
     id: int = Query(..., description="ID do livro"),
@@ -195,10 +421,12 @@ async def detalhes_livro(
 
 @router.get("/mais-vendidos", response_model=List[LivroRead])
 async def listar_livros_mais_vendidos(
-    limit: int = Query(10, ge=1),
-    session: AsyncSession = Depends(get_session)
+    request: Request,
+    limit: int = Query(10, ge=1)
 ):
+    return await compartilhar(request, "listar_livros_mais_vendidos", _livros_mais_vendidos, limit)
 
+async def _livros_mais_vendidos(session: AsyncSession, limit: int):
     subquery = (
         select(
             PedidoLivroLink.livro_id,
@@ -223,4 +451,26 @@ async def listar_livros_mais_vendidos(
     if not livros:
         raise HTTPException(status_code=404, detail="Nenhum livro vendido encontrado")
 
-    return livros
\ No newline at end of file
+    return [LivroRead(**livro.dict()) for livro in livros]
+
+@router.get("/{livro_id}/recomendados", response_model=List[LivroRecomendado])
+async def listar_recomendados(
+    livro_id: int,
+    limit: int = Query(10, ge=1, le=100),
+    session: AsyncSession = Depends(get_session)
+):
+    await indice_recomendacoes.garantir_pronto()
+    recomendados = indice_recomendacoes.recomendados(livro_id, limit)
+
+    ids = [livro_id] + [id_recomendado for id_recomendado, _ in recomendados]
+    result = await session.execute(select(Livro).where(Livro.id.in_(ids)))
+    livros = {livro.id: livro for livro in result.scalars().all()}
+    if livro_id not in livros:
+        raise HTTPException(status_code=404, detail="Livro não encontrado")
+
+    logger.info(f"Recomendações para o livro {livro_id}: {len(recomendados)} encontradas")
+    return [
+        LivroRecomendado(**livros[id_recomendado].dict(), compras_em_comum=contagem)
+        for id_recomendado, contagem in recomendados
+        if id_recomendado in livros
+    ]
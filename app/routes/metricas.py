@@ -0,0 +1,8 @@
+from fastapi import APIRouter
+from app.admissao import controle_admissao
+
+router = APIRouter(prefix="/metricas", tags=["Métricas"])
+
+@router.get("/admissao", response_model=dict)
+async def metricas_admissao():
+    return controle_admissao.metricas()
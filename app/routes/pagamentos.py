@@ -1,39 +1,277 @@
-from datetime import datetime
+import os
+from datetime import date, datetime, timezone
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import func
+from sqlalchemy import bindparam, delete, func, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.future import select
 from app.database import get_session
-from app.models import Pagamento
-from app.schemas import PagamentoCreate, PagamentoUpdate, PagamentoRead, PagamentoCount, PaginatedPagamentos
+from app.leitura import LEITURA_LEVE, ler_por_id, listar_pagina, resposta_json
+from app.arquivamento import tabela_pagamentos
+from app.timeouts import sessao_com_timeout, eh_timeout, tempo_esgotado
+from app.transacao import conflito_persistente, eh_transitorio, unidade_de_trabalho
+from app.invalidacao import publicar
+from app.escrita import (
+    inserir_retornando, atualizar_retornando, deletar_retornando, insert_com_conflito, travar_retornando
+)
+from app.agrupamento import ESCRITA_AGRUPADA, agrupador_para
+from app.lote import executar_lote, validar_lote
+from app.pedido_view import sincronizar_pagamentos, sincronizar_pedidos
+from app.eventos_pedidos import registrar_eventos
+from app.models import Pagamento, PagamentoIdempotencia, Pedido
+from app.schemas import (
+    PagamentoCreate, PagamentoUpdate, PagamentoRead, PagamentoCount, PaginatedPagamentos,
+    PagamentoLote, PagamentoLoteResultado, PagamentoFormaLote, ResultadoLote
+)
 from logs.logger import get_logger
 
 logger = get_logger("MyBooks")
 
+PAGAMENTO_LOTE_MAX = int(os.getenv("PAGAMENTO_LOTE_MAX", "10000"))
+PAGAMENTO_LOTE_BLOCO = int(os.getenv("PAGAMENTO_LOTE_BLOCO", "500"))
+CAMPOS_PAGAMENTO = ("data_pagamento", "valor", "forma_pagamento")
+
 router = APIRouter(prefix="/pagamentos", tags=["Pagamentos"])
 
 @router.get("/pagamentos/{id}", response_model=Pagamento)
 async def obter_pagamento_por_id(id: int, session: AsyncSession = Depends(get_session)):
+    if LEITURA_LEVE:
+        pagamento = await ler_por_id(session, Pagamento, id)
+        if not pagamento:
+            raise HTTPException(status_code=404, detail="Pagamento não encontrado")
+        return resposta_json(pagamento)
+
     result = await session.execute(select(Pagamento).where(Pagamento.id == id))
     pagamento = result.scalar_one_or_none()
     if not pagamento:
         raise HTTPException(status_code=404, detail="Pagamento não encontrado")
     return pagamento
 
+async def _validar_novo_pagamento(session: AsyncSession, pedido_id: int, pagamento_id: Optional[int] = None):
+    # Existência do pedido e unicidade de pedido_id, que os triggers de pagamento também
+    # garantem: conferidas aqui para responder 404/409. O pedido fica travado até o commit:
+    # requisições para o mesmo pedido passam uma de cada vez e a seguinte já vê o
+    # pagamento gravado.
+    if not await travar_retornando(session, Pedido, Pedido.id == pedido_id):
+        raise HTTPException(status_code=404, detail="Pedido não encontrado")
+    outro = select(Pagamento.id).where(Pagamento.pedido_id == pedido_id)
+    if pagamento_id is not None:
+        outro = outro.where(Pagamento.id != pagamento_id)
+    if await session.scalar(outro.limit(1)):
+        raise HTTPException(status_code=409, detail="Pagamento já registrado para este pedido.")
+
+async def _validar_pagamentos_agrupados(session: AsyncSession, lote: List[dict]):
+    # Regras de _validar_novo_pagamento para o lote inteiro, na transação do agrupador: os
+    # pedidos ficam travados até o commit que grava os pagamentos. Qualquer recusa desfaz o
+    # lote, e cada pagamento é refeito sozinho e recebe o próprio 404/409.
+    pedido_ids = [dados["pedido_id"] for dados in lote]
+    if len(set(pedido_ids)) < len(pedido_ids):
+        raise HTTPException(status_code=409, detail="Pagamento já registrado para este pedido.")
+    if len(await travar_retornando(session, Pedido, Pedido.id.in_(pedido_ids))) < len(pedido_ids):
+        raise HTTPException(status_code=404, detail="Pedido não encontrado")
+    if await session.scalar(select(Pagamento.id).where(Pagamento.pedido_id.in_(pedido_ids)).limit(1)):
+        raise HTTPException(status_code=409, detail="Pagamento já registrado para este pedido.")
+
+async def _gravar_dependentes(session: AsyncSession, pagamentos: List[Pagamento], _extras=None):
+    # Outbox e pedido_view, na transação que insere os pagamentos (também a do agrupador).
+    await registrar_eventos(session, "pagamento", "criado", [pagamento.id for pagamento in pagamentos])
+    await sincronizar_pedidos(session, [pagamento.pedido_id for pagamento in pagamentos])
+
 @router.post("/", response_model=Pagamento)
 async def criar_pagamento(pagamento: PagamentoCreate, session: AsyncSession = Depends(get_session)):
     try:
-        novo_pagamento = Pagamento(**pagamento.dict())
-        session.add(novo_pagamento)
-        await session.commit()
-        await session.refresh(novo_pagamento)
+        if ESCRITA_AGRUPADA:
+            # Validação, pagamento, outbox e view no mesmo commit do agrupador.
+            agrupador = agrupador_para(Pagamento, antes=_validar_pagamentos_agrupados, depois=_gravar_dependentes)
+            novo_pagamento = await agrupador.inserir(pagamento.dict())
+        else:
+            async def gravar():
+                await _validar_novo_pagamento(session, pagamento.pedido_id)
+                novo = await inserir_retornando(session, Pagamento, pagamento.dict())
+                await _gravar_dependentes(session, [novo])
+                return novo
+
+            novo_pagamento = await unidade_de_trabalho(session, gravar, "criar pagamento")
         logger.info(f"Pagamento criado: {novo_pagamento.id} - Pedido {novo_pagamento.pedido_id}")
+        await publicar("pagamento", "criado", novo_pagamento.id)
         return novo_pagamento
-    except Exception:
+    except IntegrityError as e:
+        logger.warning(f"Erro de integridade ao criar pagamento para o pedido {pagamento.pedido_id}: {e}")
+        raise HTTPException(status_code=409, detail="Pagamento já registrado ou pedido inexistente.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        if eh_transitorio(e):
+            raise conflito_persistente("criar pagamento")
         logger.error("Erro ao criar pagamento", exc_info=True)
         raise HTTPException(status_code=500, detail="Erro interno ao criar pagamento")
 
+@router.post("/lote", response_model=PagamentoLoteResultado)
+async def criar_pagamentos_lote(lote: PagamentoLote, session: AsyncSession = Depends(get_session)):
+    recebidos = len(lote.pagamentos)
+    if recebidos > PAGAMENTO_LOTE_MAX:
+        raise HTTPException(status_code=413, detail=f"Lote excede o limite de {PAGAMENTO_LOTE_MAX} pagamentos.")
+
+    criados = atualizados = ignorados = 0
+    bloco_atual = 0
+    try:
+        for inicio in range(0, recebidos, PAGAMENTO_LOTE_BLOCO):
+            bloco_atual = inicio // PAGAMENTO_LOTE_BLOCO + 1
+            bloco = lote.pagamentos[inicio:inicio + PAGAMENTO_LOTE_BLOCO]
+
+            # Itens com a mesma chave são reenvios do mesmo pagamento: vale o primeiro. Entre
+            # chaves diferentes, um mesmo pedido_id não pode aparecer duas vezes no mesmo
+            # INSERT ... ON CONFLICT; a última ocorrência do bloco prevalece.
+            vistas = set()
+            por_pedido = {}
+            for pagamento in bloco:
+                chave = pagamento.chave_idempotencia
+                if chave in vistas or pagamento.pedido_id in por_pedido:
+                    ignorados += 1
+                if chave in vistas:
+                    continue
+                if chave:
+                    vistas.add(chave)
+                por_pedido[pagamento.pedido_id] = pagamento
+
+            if not por_pedido:
+                continue
+
+            tabela = Pagamento.__table__
+            # Mesma trava de _validar_novo_pagamento, em ordem de id para não gerar deadlock.
+            pedidos_existentes = set(await travar_retornando(session, Pedido, Pedido.id.in_(por_pedido)))
+            for pedido_id in set(por_pedido) - pedidos_existentes:
+                logger.warning(f"Lote de pagamentos: pedido {pedido_id} inexistente, pagamento ignorado")
+                ignorados += 1
+                del por_pedido[pedido_id]
+
+            # Só as chaves dos itens que chegam ao upsert são gravadas: a de um item descartado
+            # continua livre. Um lote concorrente com a mesma chave espera pelo índice único até
+            # este commit e então cai no DO NOTHING. Em ordem de chave para dois lotes não se
+            # travarem mutuamente.
+            com_chave = {p.chave_idempotencia: p for p in por_pedido.values() if p.chave_idempotencia}
+            if com_chave:
+                agora = datetime.now(timezone.utc)
+                stmt = insert_com_conflito(PagamentoIdempotencia.__table__).values([
+                    {"chave": chave, "pedido_id": com_chave[chave].pedido_id, "criado_em": agora}
+                    for chave in sorted(com_chave)
+                ]).on_conflict_do_nothing().returning(PagamentoIdempotencia.chave)
+                chaves_novas = set((await session.execute(stmt)).scalars().all())
+                for chave in com_chave.keys() - chaves_novas:
+                    ignorados += 1
+                    del por_pedido[com_chave[chave].pedido_id]
+
+            if not por_pedido:
+                await session.commit()
+                continue
+
+            # A UNIQUE de pagamento é (pedido_id, data_pagamento) por causa do particionamento;
+            # pagamentos já gravados com outra data são atualizados (e mudam de partição) antes do upsert.
+            result = await session.execute(
+                select(tabela.c.pedido_id, tabela.c.data_pagamento).where(tabela.c.pedido_id.in_(por_pedido))
+            )
+            datas_gravadas = dict(result.all())
+            movidos = [
+                p for p in por_pedido.values()
+                if p.pedido_id in datas_gravadas and datas_gravadas[p.pedido_id] != p.data_pagamento
+            ]
+            if movidos:
+                await session.execute(
+                    update(tabela)
+                    .where(tabela.c.pedido_id == bindparam("b_pedido_id"))
+                    .values({campo: bindparam(f"b_{campo}") for campo in CAMPOS_PAGAMENTO}),
+                    [
+                        {"b_pedido_id": p.pedido_id, **{f"b_{campo}": getattr(p, campo) for campo in CAMPOS_PAGAMENTO}}
+                        for p in movidos
+                    ],
+                )
+                atualizados += len(movidos)
+
+            pedidos_movidos = {p.pedido_id for p in movidos}
+            novos = [p for p in por_pedido.values() if p.pedido_id not in pedidos_movidos]
+            linhas = []
+            if novos:
+                stmt = insert_com_conflito(tabela).values([p.dict(exclude={"chave_idempotencia"}) for p in novos])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[tabela.c.pedido_id, tabela.c.data_pagamento],
+                    set_={campo: stmt.excluded[campo] for campo in CAMPOS_PAGAMENTO},
+                    where=or_(*(tabela.c[campo].is_distinct_from(stmt.excluded[campo]) for campo in CAMPOS_PAGAMENTO)),
+                ).returning(tabela.c.pedido_id, tabela.c.id)
+                linhas = (await session.execute(stmt)).all()
+
+            # Partições não expõem xmax no RETURNING; quem já tinha pagamento foi atualizado.
+            inseridos = sum(1 for linha in linhas if linha.pedido_id not in datas_gravadas)
+            criados += inseridos
+            atualizados += len(linhas) - inseridos
+            ignorados += len(novos) - len(linhas)
+
+            ids_movidos = []
+            if movidos:
+                result = await session.execute(select(tabela.c.id).where(tabela.c.pedido_id.in_(pedidos_movidos)))
+                ids_movidos = result.scalars().all()
+            await registrar_eventos(
+                session, "pagamento", "criado", [linha.id for linha in linhas if linha.pedido_id not in datas_gravadas]
+            )
+            await registrar_eventos(
+                session, "pagamento", "atualizado",
+                [*ids_movidos, *(linha.id for linha in linhas if linha.pedido_id in datas_gravadas)],
+            )
+            await sincronizar_pedidos(session, por_pedido)
+            await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        logger.error(f"Erro de integridade no lote de pagamentos (bloco {bloco_atual}): {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Dados inválidos no bloco {bloco_atual} do lote; blocos anteriores foram gravados."
+        )
+    except Exception:
+        await session.rollback()
+        logger.error(f"Erro ao processar lote de pagamentos (bloco {bloco_atual})", exc_info=True)
+        raise HTTPException(status_code=500, detail="Erro interno ao processar lote de pagamentos")
+
+    logger.info(
+        f"Lote de pagamentos processado: {recebidos} recebidos, {criados} criados, "
+        f"{atualizados} atualizados, {ignorados} ignorados"
+    )
+    if criados or atualizados:
+        await publicar("pagamento", "lote")
+    return PagamentoLoteResultado(recebidos=recebidos, criados=criados, atualizados=atualizados, ignorados=ignorados)
+
+async def _registrar_e_sincronizar(session: AsyncSession, acao: str, ids: List[int]):
+    await registrar_eventos(session, "pagamento", acao, ids)
+    await sincronizar_pagamentos(session, ids)
+
+@router.patch("/lote/forma-pagamento", response_model=ResultadoLote)
+async def atualizar_forma_pagamento_lote(lote: PagamentoFormaLote, session: AsyncSession = Depends(get_session)):
+    validar_lote(lote.ids, pedido_ids=lote.pedido_ids, forma_atual=lote.forma_atual)
+    if lote.pedido_ids is not None:
+        validar_lote(lote.pedido_ids)
+
+    stmt = update(Pagamento).values(forma_pagamento=lote.forma_pagamento)
+    if lote.ids is not None:
+        stmt = stmt.where(Pagamento.id.in_(lote.ids))
+    if lote.pedido_ids is not None:
+        stmt = stmt.where(Pagamento.pedido_id.in_(lote.pedido_ids))
+    if lote.forma_atual is not None:
+        stmt = stmt.where(Pagamento.forma_pagamento == lote.forma_atual)
+
+    logger.info(f"Atualizando forma de pagamento em lote para '{lote.forma_pagamento}'")
+    return await executar_lote(
+        session, stmt.returning(Pagamento.id), "pagamento", "atualizado",
+        antes_commit=lambda ids: _registrar_e_sincronizar(session, "atualizado", ids),
+    )
+
+@router.delete("/lote", response_model=ResultadoLote)
+async def deletar_pagamentos_lote(ids: List[int] = Query(...), session: AsyncSession = Depends(get_session)):
+    validar_lote(ids)
+    stmt = delete(Pagamento).where(Pagamento.id.in_(ids)).returning(Pagamento.id)
+    return await executar_lote(
+        session, stmt, "pagamento", "removido",
+        antes_commit=lambda ids: _registrar_e_sincronizar(session, "removido", ids),
+    )
+
 @router.patch("/{pagamento_id}", response_model=Pagamento)
 async def atualizar_pagamento(
     pagamento_id: int,
@@ -41,22 +279,20 @@ async def atualizar_pagamento(
     session: AsyncSession = Depends(get_session)
 ):
     try:
-        query = select(Pagamento).where(Pagamento.id == pagamento_id)
-        result = await session.execute(query)
-        pagamento = result.scalar_one_or_none()
+        update_data = pagamento_update.dict(exclude_unset=True)
+        if update_data.get("pedido_id") is not None:
+            await _validar_novo_pagamento(session, update_data["pedido_id"], pagamento_id)
+        pagamento = await atualizar_retornando(session, Pagamento, pagamento_id, update_data)
 
         if not pagamento:
             logger.warning(f"Tentativa de atualizar pagamento não encontrado: ID {pagamento_id}")
             raise HTTPException(status_code=404, detail="Pagamento não encontrado")
 
-        update_data = pagamento_update.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(pagamento, key, value)
-
-        session.add(pagamento)
+        await registrar_eventos(session, "pagamento", "atualizado", [pagamento.id])
+        await sincronizar_pagamentos(session, [pagamento.id], [pagamento.pedido_id])
         await session.commit()
-        await session.refresh(pagamento)
         logger.info(f"Pagamento atualizado: {pagamento.id}")
+        await publicar("pagamento", "atualizado", pagamento.id)
         return pagamento
     except HTTPException:
         raise
@@ -69,8 +305,15 @@ async def listar_pagamentos(
     pedido_id: Optional[int] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
+    incluir_arquivados: bool = Query(False, description="Inclui os pagamentos movidos para o arquivo"),
     session: AsyncSession = Depends(get_session)
 ):
+    # A união com o arquivo só existe no caminho Core.
+    if LEITURA_LEVE or incluir_arquivados:
+        origem = tabela_pagamentos(incluir_arquivados)
+        condicoes = () if pedido_id is None else (origem.c.pedido_id == pedido_id,)
+        return await listar_pagina(session, origem, page, limit, *condicoes)
+
     offset = (page - 1) * limit
 
     query = select(Pagamento)
@@ -100,14 +343,15 @@ async def contar_pagamentos(session: AsyncSession = Depends(get_session)):
 @router.delete("/", response_model=dict)
 async def deletar_pagamento(pagamento_id: int, session: AsyncSession = Depends(get_session)):
     try:
-        pagamento = await session.get(Pagamento, pagamento_id)
-        if not pagamento:
+        if await deletar_retornando(session, Pagamento, pagamento_id) is None:
             logger.warning(f"Tentativa de deletar pagamento não encontrado: ID {pagamento_id}")
             raise HTTPException(status_code=404, detail="Pagamento não encontrado")
 
-        await session.delete(pagamento)
+        await registrar_eventos(session, "pagamento", "removido", [pagamento_id])
+        await sincronizar_pagamentos(session, [pagamento_id])
         await session.commit()
         logger.info(f"Pagamento deletado: ID {pagamento_id}")
+        await publicar("pagamento", "removido", pagamento_id)
         return {"message": "Pagamento deletado com sucesso"}
     except HTTPException:
         raise
@@ -119,34 +363,45 @@ async def deletar_pagamento(pagamento_id: int, session: AsyncSession = Depends(g
 async def filtrar_pagamentos(
     pedido_id: Optional[int] = Query(None),
     data_pagamento: Optional[str] = Query(None),
+    data_inicio: Optional[date] = Query(None, description="Data de pagamento inicial (AAAA-MM-DD), inclusiva"),
+    data_fim: Optional[date] = Query(None, description="Data de pagamento final (AAAA-MM-DD), inclusiva"),
     valor_min: Optional[float] = Query(None),
     valor_max: Optional[float] = Query(None),
     forma_pagamento: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
-    session: AsyncSession = Depends(get_session)
+    incluir_arquivados: bool = Query(False, description="Inclui os pagamentos movidos para o arquivo"),
+    session: AsyncSession = Depends(sessao_com_timeout("filtrar_pagamentos"))
 ):
     try:
-        query = select(Pagamento)
+        # Com o arquivo, a consulta é Core sobre a união e devolve linhas em vez de instâncias.
+        origem = tabela_pagamentos(incluir_arquivados)
+        query = select(*origem.columns) if incluir_arquivados else select(Pagamento)
         filtros_aplicados = []
 
         if pedido_id is not None:
-            query = query.where(Pagamento.pedido_id == pedido_id)
+            query = query.where(origem.c.pedido_id == pedido_id)
             filtros_aplicados.append(f"pedido_id={pedido_id}")
         if forma_pagamento:
-            query = query.where(Pagamento.forma_pagamento.ilike(f"%{forma_pagamento}%"))
+            query = query.where(origem.c.forma_pagamento.ilike(f"%{forma_pagamento}%"))
             filtros_aplicados.append(f"forma_pagamento='{forma_pagamento}'")
-
-        result = await session.execute(query)
-        pagamentos = result.scalars().all()
-
         if data_pagamento:
             try:
                 data_obj = datetime.strptime(data_pagamento, "%d-%m-%Y").date()
-                pagamentos = [p for p in pagamentos if p.data_pagamento == data_obj]
-                filtros_aplicados.append(f"data_pagamento={data_pagamento}")
             except ValueError:
                 raise HTTPException(status_code=400, detail="Formato de data_pagamento inválido (use DD-MM-AAAA).")
+            query = query.where(origem.c.data_pagamento == data_obj)
+            filtros_aplicados.append(f"data_pagamento={data_pagamento}")
+        # Filtros por intervalo na própria coluna de partição permitem ao planner descartar partições.
+        if data_inicio:
+            query = query.where(origem.c.data_pagamento >= data_inicio)
+            filtros_aplicados.append(f"data_inicio={data_inicio}")
+        if data_fim:
+            query = query.where(origem.c.data_pagamento <= data_fim)
+            filtros_aplicados.append(f"data_fim={data_fim}")
+
+        result = await session.execute(query)
+        pagamentos = result.all() if incluir_arquivados else result.scalars().all()
 
         if valor_min is not None:
             pagamentos = [p for p in pagamentos if p.valor >= valor_min]
@@ -163,9 +418,14 @@ async def filtrar_pagamentos(
         pagamentos_paginados = pagamentos[offset:offset + limit]
 
         logger.info(f"{len(pagamentos_paginados)} pagamento(s) retornado(s) com filtros: {', '.join(filtros_aplicados) or 'nenhum'}")
+        if incluir_arquivados:
+            itens = [dict(linha._mapping) for linha in pagamentos_paginados]
+            return resposta_json({"page": page, "limit": limit, "total": total, "items": itens})
         return PaginatedPagamentos(page=page, limit=limit, total=total, items=pagamentos_paginados)
     except HTTPException:
         raise
-    except Exception:
+    except Exception as e:
+        if eh_timeout(e):
+            raise tempo_esgotado("filtrar pagamentos")
         logger.error("Erro ao filtrar pagamentos com paginação", exc_info=True)
         raise HTTPException(status_code=500, detail="Erro interno ao filtrar pagamentos")
\ No newline at end of file
@@ -1,14 +1,30 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import date, datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
-from sqlalchemy import func
+from sqlalchemy import delete, exists, func, insert, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from app.database import get_session
-from app.models import Pedido, Livro, PedidoLivroLink, Usuario
-from app.schemas import PedidoCreate, PedidoUpdate, PedidoRead, ContagemPedidos, PaginatedPedido
+from app.leitura import LEITURA_LEVE, anexar_pagamentos, ler_por_id, listar_pedidos_pagina, resposta_json
+from app.arquivamento import tabela_pedidos
+from app.timeouts import sessao_com_timeout, eh_timeout, tempo_esgotado
+from app.transacao import conflito_persistente, eh_transitorio, unidade_de_trabalho
+from app.coalescencia import compartilhar
+from app.invalidacao import publicar
+from app.escrita import inserir_retornando, atualizar_retornando, deletar_retornando, travar_retornando
+from app.agrupamento import ESCRITA_AGRUPADA, agrupador_para
+from app.lote import executar_lote, validar_lote
+from app.recomendacoes import indice_recomendacoes
+from app.pedido_view import PEDIDO_VIEW_LEITURA, condicoes_filtro, listar_da_view, sincronizar_pedidos
+from app.eventos_pedidos import registrar_eventos, transmitir
+from app.status_pedido import StatusPedido, condicao_abertos, origens, status_em, transicao_valida
+from app.models import Pedido, Livro, PedidoLivroLink, Usuario, Pagamento
+from app.schemas import (
+    PedidoCreate, PedidoUpdate, PedidoRead, ContagemPedidos, PaginatedPedido, PedidoStatusLote, ResultadoLote
+)
 from logs.logger import get_logger
 
 logger = get_logger("MyBooks")
@@ -17,12 +33,38 @@ router = APIRouter(prefix="/pedidos", tags=["Pedidos"])
 
 @router.get("/pedidos/{id}", response_model=Pedido)
 async def obter_pedido_por_id(id: int, session: AsyncSession = Depends(get_session)):
+    if LEITURA_LEVE:
+        pedido = await ler_por_id(session, Pedido, id)
+        if not pedido:
+            raise HTTPException(status_code=404, detail="Pedido não encontrado")
+        return resposta_json(pedido)
+
     result = await session.execute(select(Pedido).where(Pedido.id == id))
     pedido = result.scalar_one_or_none()
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido não encontrado")
     return pedido
 
+async def _validar_livros(session: AsyncSession, livro_ids: List[int]):
+    encontrados = set()
+    if livro_ids:
+        result = await session.execute(select(Livro.id).where(Livro.id.in_(livro_ids)))
+        encontrados = set(result.scalars().all())
+    for livro_id in livro_ids:
+        if livro_id not in encontrados:
+            raise HTTPException(status_code=404, detail=f"Livro com ID {livro_id} não encontrado")
+
+async def _gravar_dependentes(session: AsyncSession, pedidos: List[Pedido], livro_ids: List[List[int]]):
+    # Vínculos, outbox e pedido_view, na transação que insere os pedidos (também a do agrupador).
+    vinculos = [
+        {"pedido_id": pedido.id, "livro_id": livro_id} for pedido, ids in zip(pedidos, livro_ids) for livro_id in ids
+    ]
+    if vinculos:
+        await session.execute(insert(PedidoLivroLink), vinculos)
+    ids = [pedido.id for pedido in pedidos]
+    await registrar_eventos(session, "pedido", "criado", ids)
+    await sincronizar_pedidos(session, ids)
+
 @router.post("/", response_model=PedidoRead)
 async def criar_pedido(pedido: PedidoCreate, session: AsyncSession = Depends(get_session)):
     try:
@@ -30,29 +72,33 @@ async def criar_pedido(pedido: PedidoCreate, session: AsyncSession = Depends(get
 
         livro_ids = pedido.livro_ids
         pedido_data = pedido.dict(exclude={"livro_ids"})
-        novo_pedido = Pedido(**pedido_data)
-
-        session.add(novo_pedido)
-        await session.commit()
-        await session.refresh(novo_pedido)
-
-        for livro_id in livro_ids:
-            result = await session.execute(select(Livro).where(Livro.id == livro_id))
-            livro = result.scalar_one_or_none()
-            if not livro:
-                raise HTTPException(status_code=404, detail=f"Livro com ID {livro_id} não encontrado")
-            
-            link = PedidoLivroLink(pedido_id=novo_pedido.id, livro_id=livro_id)
-            session.add(link)
+        if ESCRITA_AGRUPADA:
+            # Livros conferidos antes de entrar no lote: um 404 não deixa pedido gravado. Um
+            # livro removido no intervalo faz a FK do vínculo desfazer o pedido junto.
+            await _validar_livros(session, livro_ids)
+            agrupador = agrupador_para(Pedido, depois=_gravar_dependentes)
+            novo_pedido = await agrupador.inserir(pedido_data, livro_ids)
+        else:
+            async def gravar():
+                novo = await inserir_retornando(session, Pedido, pedido_data)
+                await _validar_livros(session, livro_ids)
+                await _gravar_dependentes(session, [novo], [livro_ids])
+                return novo
 
-        await session.commit()
+            novo_pedido = await unidade_de_trabalho(session, gravar, "criar pedido")
+        indice_recomendacoes.registrar_pedido(novo_pedido.id, livro_ids)
         logger.info(f"Pedido criado com ID {novo_pedido.id}")
-        return novo_pedido
+        await publicar("pedido", "criado", novo_pedido.id)
+        return PedidoRead(**novo_pedido.dict())
 
     except IntegrityError as e:
         logger.error(f"Erro de integridade ao criar pedido: {e}")
         raise HTTPException(status_code=400, detail="Dados inválidos para criar pedido.")
+    except HTTPException:
+        raise
     except Exception as e:
+        if eh_transitorio(e):
+            raise conflito_persistente("criar pedido")
         logger.error(f"Erro inesperado: {e}")
         raise HTTPException(status_code=500, detail="Erro interno ao criar pedido.")
     
@@ -64,21 +110,26 @@ async def atualizar_pedido(
 ):
     try:
         logger.info(f"Atualizando pedido ID {pedido_id}")
-        result = await session.execute(select(Pedido).where(Pedido.id == pedido_id))
-        pedido = result.scalar_one_or_none()
+        update_data = pedido_update.dict(exclude_unset=True)
+        novo_status = update_data.get("status")
+        # A transição é conferida no próprio UPDATE: uma mudança concorrente de status entre
+        # a leitura e a escrita não passa.
+        condicoes = [Pedido.status.in_(origens(novo_status))] if novo_status else []
+        pedido = await atualizar_retornando(session, Pedido, pedido_id, update_data, *condicoes)
 
         if not pedido:
-            logger.info(f"Pedido ID {pedido_id} não encontrado")
-            raise HTTPException(status_code=404, detail="Pedido não encontrado")
-
-        update_data = pedido_update.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(pedido, key, value)
+            atual = await session.scalar(select(Pedido.status).where(Pedido.id == pedido_id)) if condicoes else None
+            if atual is None:
+                logger.info(f"Pedido ID {pedido_id} não encontrado")
+                raise HTTPException(status_code=404, detail="Pedido não encontrado")
+            logger.warning(f"Transição de status inválida no pedido ID {pedido_id}: {atual} → {novo_status}")
+            raise HTTPException(status_code=409, detail=f"Transição de status inválida: {atual} → {novo_status}")
 
-        session.add(pedido)
+        await registrar_eventos(session, "pedido", "atualizado", [pedido_id])
+        await sincronizar_pedidos(session, [pedido_id])
         await session.commit()
-        await session.refresh(pedido)
         logger.info(f"Pedido ID {pedido_id} atualizado")
+        await publicar("pedido", "atualizado", pedido_id)
         return pedido
     except IntegrityError as e:
         logger.error(f"Erro de integridade ao atualizar pedido ID {pedido_id}: {e}")
@@ -93,8 +144,19 @@ async def listar_pedidos(
     usuario_id: Optional[int] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
+    incluir_arquivados: bool = Query(False, description="Inclui os pedidos movidos para o arquivo"),
     session: AsyncSession = Depends(get_session),
 ):
+    if PEDIDO_VIEW_LEITURA and not incluir_arquivados:
+        total, itens = await listar_da_view(session, page, limit, *condicoes_filtro(usuario_id=usuario_id))
+        return resposta_json({"page": page, "limit": limit, "total": total, "items": itens})
+
+    # A união com o arquivo só existe no caminho Core.
+    if LEITURA_LEVE or incluir_arquivados:
+        origem = tabela_pedidos(incluir_arquivados)
+        condicoes = () if usuario_id is None else (origem.c.usuario_id == usuario_id,)
+        return await listar_pedidos_pagina(session, page, limit, *condicoes, incluir_arquivados=incluir_arquivados)
+
     offset = (page - 1) * limit
 
     if usuario_id is not None:
@@ -116,8 +178,29 @@ async def listar_pedidos(
     return PaginatedPedido(page=page, limit=limit, total=total, items=pedidos)
 
 
+@router.get("/eventos")
+async def eventos_pedidos(
+    usuario_id: Optional[int] = Query(None),
+    status: Optional[List[StatusPedido]] = Query(None, description="Um ou mais status exatos"),
+    desde: Optional[int] = Query(None, description="Retoma após este id de evento"),
+    last_event_id: Optional[int] = Header(None),
+):
+    # Server-sent events de criação, alteração e remoção de pedidos e pagamentos. O
+    # EventSource do navegador reenvia Last-Event-ID ao reconectar; sem ele (nem desde),
+    # o feed começa a partir do momento da conexão.
+    status = [valor.value for valor in status] if status else None
+    logger.info(f"Abrindo feed de eventos de pedidos (usuario_id={usuario_id}, status={status})")
+    return StreamingResponse(
+        transmitir(usuario_id, status, last_event_id if last_event_id is not None else desde),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/contar", response_model=ContagemPedidos)
-async def contar_pedidos(session: AsyncSession = Depends(get_session)):
+async def contar_pedidos(request: Request):
+    return await compartilhar(request, "contar_pedidos", _contar_pedidos)
+
+async def _contar_pedidos(session: AsyncSession):
     try:
         logger.info("Contando pedidos")
         result = await session.execute(select(func.count(Pedido.id)))
@@ -127,18 +210,83 @@ async def contar_pedidos(session: AsyncSession = Depends(get_session)):
     except Exception:
         raise HTTPException(status_code=500, detail="Erro interno ao contar pedidos")
 
+async def _registrar_e_sincronizar(session: AsyncSession, acao: str, ids: List[int]):
+    await registrar_eventos(session, "pedido", acao, ids)
+    await sincronizar_pedidos(session, ids)
+
+@router.patch("/lote/status", response_model=ResultadoLote)
+async def atualizar_status_lote(lote: PedidoStatusLote, session: AsyncSession = Depends(get_session)):
+    validar_lote(lote.ids, usuario_id=lote.usuario_id, status_atual=lote.status_atual)
+    if lote.status_atual is not None and not transicao_valida(lote.status_atual, lote.status):
+        raise HTTPException(status_code=409, detail=f"Transição de status inválida: {lote.status_atual} → {lote.status}")
+
+    # Pedidos cujo status atual não permite a transição ficam de fora do lote.
+    stmt = update(Pedido).values(status=lote.status).where(Pedido.status.in_(origens(lote.status)))
+    if lote.ids is not None:
+        stmt = stmt.where(Pedido.id.in_(lote.ids))
+    if lote.usuario_id is not None:
+        stmt = stmt.where(Pedido.usuario_id == lote.usuario_id)
+    if lote.status_atual is not None:
+        stmt = stmt.where(Pedido.status == lote.status_atual)
+
+    logger.info(f"Atualizando status de pedidos em lote para '{lote.status}'")
+    resultado = await executar_lote(
+        session, stmt.returning(Pedido.id), "pedido", "atualizado",
+        antes_commit=lambda ids: _registrar_e_sincronizar(session, "atualizado", ids),
+    )
+    if lote.ids is not None and resultado.afetados < len(set(lote.ids)):
+        logger.warning(
+            f"{len(set(lote.ids)) - resultado.afetados} pedido(s) não encontrados ou sem transição válida para '{lote.status}'"
+        )
+    return resultado
+
+# Declarada antes de /{pedido_id} para que "lote" não seja lido como id.
+@router.delete("/lote", response_model=ResultadoLote)
+async def deletar_pedidos_lote(ids: List[int] = Query(...), session: AsyncSession = Depends(get_session)):
+    validar_lote(ids)
+    # Mesma regra de deletar_pedido: pedidos com livros ou pagamento vinculados são mantidos.
+    # A trava vem antes do DELETE para que ele já veja pagamentos gravados por quem a
+    # segurava (ver app/models.py).
+    await travar_retornando(session, Pedido, Pedido.id.in_(ids))
+    stmt = (
+        delete(Pedido)
+        .where(Pedido.id.in_(ids))
+        .where(~exists().where(PedidoLivroLink.pedido_id == Pedido.id))
+        .where(~exists().where(Pagamento.pedido_id == Pedido.id))
+        .returning(Pedido.id)
+    )
+    resultado = await executar_lote(
+        session, stmt, "pedido", "removido", antes_commit=lambda ids: _registrar_e_sincronizar(session, "removido", ids)
+    )
+    if resultado.afetados < len(set(ids)):
+        logger.warning(f"{len(set(ids)) - resultado.afetados} pedido(s) não encontrados ou com dependências")
+    return resultado
+
 @router.delete("/{pedido_id}", response_model=dict)
 async def deletar_pedido(pedido_id: int, session: AsyncSession = Depends(get_session)):
     try:
         logger.info(f"Tentando deletar pedido ID {pedido_id}")
-        pedido = await session.get(Pedido, pedido_id)
-        if not pedido:
-            logger.info(f"Pedido ID {pedido_id} não encontrado para deletar")
-            raise HTTPException(status_code=404, detail="Pedido não encontrado")
+        # Sem FKs apontando para pedido particionado, as dependências entram na própria instrução,
+        # depois da trava do pedido: um pagamento gravado por quem a segurava já é visto.
+        await travar_retornando(session, Pedido, Pedido.id == pedido_id)
+        removido = await deletar_retornando(
+            session, Pedido, pedido_id,
+            ~exists().where(PedidoLivroLink.pedido_id == Pedido.id),
+            ~exists().where(Pagamento.pedido_id == Pedido.id),
+        )
+        if removido is None:
+            # Só no caminho de erro: distingue pedido inexistente de pedido com dependências.
+            if await session.scalar(select(Pedido.id).where(Pedido.id == pedido_id)) is None:
+                logger.info(f"Pedido ID {pedido_id} não encontrado para deletar")
+                raise HTTPException(status_code=404, detail="Pedido não encontrado")
+            logger.error(f"Pedido ID {pedido_id} possui livros ou pagamento vinculados")
+            raise HTTPException(status_code=400, detail="Não é possível deletar pedido com dependências.")
 
-        await session.delete(pedido)
+        await registrar_eventos(session, "pedido", "removido", [pedido_id])
+        await sincronizar_pedidos(session, [pedido_id])
         await session.commit()
         logger.info(f"Pedido ID {pedido_id} deletado com sucesso")
+        await publicar("pedido", "removido", pedido_id)
         return {"message": "Pedido deletado com sucesso"}
     except IntegrityError as e:
         logger.error(f"Erro de integridade ao deletar pedido ID {pedido_id}: {e}")
@@ -151,37 +299,82 @@ async def deletar_pedido(pedido_id: int, session: AsyncSession = Depends(get_ses
 @router.get("/filtrar", response_model=PaginatedPedido)
 async def filtrar_pedidos(
     usuario_id: Optional[int] = Query(None),
-    status: Optional[str] = Query(None),
+    status: Optional[List[StatusPedido]] = Query(None, description="Um ou mais status exatos"),
+    abertos: bool = Query(False, description="Só pedidos em aberto (pendente, pago, enviado)"),
     data_pedido: Optional[str] = Query(None),
+    data_inicio: Optional[date] = Query(None, description="Data do pedido inicial (AAAA-MM-DD), inclusiva"),
+    data_fim: Optional[date] = Query(None, description="Data do pedido final (AAAA-MM-DD), inclusiva"),
     valor_min: Optional[float] = Query(None),
     valor_max: Optional[float] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
-    session: AsyncSession = Depends(get_session)
+    incluir_arquivados: bool = Query(False, description="Inclui os pedidos movidos para o arquivo"),
+    session: AsyncSession = Depends(sessao_com_timeout("filtrar_pedidos"))
 ):
     try:
         logger.info("Filtrando pedidos com paginação")
-        query = select(Pedido)
+        data_obj = None
+        if data_pedido:
+            try:
+                data_obj = datetime.strptime(data_pedido, "%Y-%m-%d").date()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Formato de data_pedido inválido (use AAAA-MM-DD).")
+
+        if PEDIDO_VIEW_LEITURA and not incluir_arquivados:
+            condicoes = condicoes_filtro(
+                usuario_id, status, data_obj, data_inicio, data_fim, valor_min, valor_max, abertos=abertos
+            )
+            total, itens = await listar_da_view(session, page, limit, *condicoes)
+            if not total:
+                raise HTTPException(status_code=404, detail="Nenhum pedido encontrado com os filtros informados.")
+            return resposta_json({"page": page, "limit": limit, "total": total, "items": itens})
+
+        if incluir_arquivados:
+            # Quentes e arquivados numa consulta Core, com todos os filtros no banco.
+            origem = tabela_pedidos(True)
+            condicoes = condicoes_filtro(
+                usuario_id, status, data_obj, data_inicio, data_fim, valor_min, valor_max,
+                tabela=origem, abertos=abertos,
+            )
+            conn = await session.connection()
+            total = await conn.scalar(select(func.count()).select_from(origem).where(*condicoes))
+            if not total:
+                raise HTTPException(status_code=404, detail="Nenhum pedido encontrado com os filtros informados.")
+            result = await conn.execute(
+                select(*origem.columns).where(*condicoes)
+                .order_by(origem.c.id).offset((page - 1) * limit).limit(limit)
+            )
+            itens = [dict(linha._mapping) for linha in result]
+            await anexar_pagamentos(session, itens, incluir_arquivados=True)
+            logger.info(f"{len(itens)} pedido(s) retornado(s), incluindo arquivados")
+            return resposta_json({"page": page, "limit": limit, "total": total, "items": itens})
+
+        query = select(Pedido).options(selectinload(Pedido.pagamento))
         filtros_aplicados = []
 
         if usuario_id is not None:
             query = query.where(Pedido.usuario_id == usuario_id)
             filtros_aplicados.append(f"usuario_id={usuario_id}")
         if status:
-            query = query.where(Pedido.status.ilike(f"%{status}%"))
-            filtros_aplicados.append(f"status='{status}'")
+            query = query.where(status_em(Pedido.status, status))
+            filtros_aplicados.append(f"status={','.join(s.value for s in status)}")
+        if abertos:
+            query = query.where(condicao_abertos(Pedido.status))
+            filtros_aplicados.append("abertos")
+        if data_obj:
+            query = query.where(Pedido.data_pedido == data_obj)
+            filtros_aplicados.append(f"data_pedido={data_pedido}")
+        # Filtros por intervalo na própria coluna de partição permitem ao planner descartar partições.
+        if data_inicio:
+            query = query.where(Pedido.data_pedido >= data_inicio)
+            filtros_aplicados.append(f"data_inicio={data_inicio}")
+        if data_fim:
+            query = query.where(Pedido.data_pedido <= data_fim)
+            filtros_aplicados.append(f"data_fim={data_fim}")
 
         result = await session.execute(query)
         pedidos = result.scalars().all()
 
-        if data_pedido:
-            try:
-                data_obj = datetime.strptime(data_pedido, "%Y-%m-%d").date()
-                pedidos = [p for p in pedidos if p.data_pedido == data_obj]
-                filtros_aplicados.append(f"data_pedido={data_pedido}")
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Formato de data_pedido inválido (use AAAA-MM-DD).")
-
         if valor_min is not None:
             pedidos = [p for p in pedidos if p.valor_total >= valor_min]
             filtros_aplicados.append(f"valor_min={valor_min}")
@@ -200,7 +393,9 @@ async def filtrar_pedidos(
         return PaginatedPedido(page=page, limit=limit, total=total, items=pedidos_paginados)
     except HTTPException:
         raise
-    except Exception:
+    except Exception as e:
+        if eh_timeout(e):
+            raise tempo_esgotado("filtrar pedidos")
         logger.error("Erro ao filtrar pedidos com paginação", exc_info=True)
         raise HTTPException(status_code=500, detail="Erro interno ao filtrar pedidos")
 
@@ -1,11 +1,23 @@
-from datetime import datetime
-from typing import List, Optional
+import base64
+from datetime import date, datetime
+from typing import List, Optional, Tuple
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select, func
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_session
-from app.models import Usuario
-from app.schemas import UsuarioCreate, UsuarioUpdate, UsuarioRead, ContagemUsuarios, PaginatedUsuario
+from app.leitura import LEITURA_LEVE, ler_por_id, listar_pagina, resposta_json
+from app.timeouts import sessao_com_timeout
+from app.invalidacao import publicar
+from app.escrita import inserir_retornando, atualizar_retornando, deletar_retornando, desvincular_retornando
+from app.agrupamento import ESCRITA_AGRUPADA, agrupador_para
+from app.pedido_view import sincronizar_pedidos, sincronizar_usuario
+from app.eventos_pedidos import registrar_eventos
+from app.models import Usuario, Pedido, PedidoArquivado
+from app.schemas import (
+    UsuarioCreate, UsuarioUpdate, UsuarioRead, ContagemUsuarios, PaginatedUsuario,
+    HistoricoPedidos, PedidoHistorico, LivroDoPedido, PagamentoRead
+)
 from logs.logger import get_logger
 from fastapi import HTTPException
 
@@ -14,6 +26,12 @@ router = APIRouter(prefix="/usuarios", tags=["Usuarios"])
 
 @router.get("/usuarios/{id}", response_model=Usuario)
 async def obter_usuario_por_id(id: int, session: AsyncSession = Depends(get_session)):
+    if LEITURA_LEVE:
+        usuario = await ler_por_id(session, Usuario, id)
+        if not usuario:
+            raise HTTPException(status_code=404, detail="Usuário não encontrado")
+        return resposta_json(usuario)
+
     result = await session.execute(select(Usuario).where(Usuario.id == id))
     usuario = result.scalar_one_or_none()
     if not usuario:
@@ -30,11 +48,13 @@ async def criar_usuario(usuario: UsuarioCreate, session: AsyncSession = Depends(
         logger.info(f"Tentativa de criar usuário com CPF já cadastrado: CPF={usuario.cpf}, Nome={usuario.nome}, Email={usuario.email}")
         raise HTTPException(status_code=400, detail="CPF já cadastrado")
 
-    novo_usuario = Usuario(**usuario.dict())
-    session.add(novo_usuario)
-    await session.commit()
-    await session.refresh(novo_usuario)
+    if ESCRITA_AGRUPADA:
+        novo_usuario = await agrupador_para(Usuario).inserir(usuario.dict())
+    else:
+        novo_usuario = await inserir_retornando(session, Usuario, usuario.dict())
+        await session.commit()
     logger.info(f"Usuário criado com sucesso: {novo_usuario.id} - {novo_usuario.nome} ({novo_usuario.email})")
+    await publicar("usuario", "criado", novo_usuario.id)
     return novo_usuario
 
 @router.get("/", response_model=PaginatedUsuario)
@@ -43,6 +63,9 @@ async def listar_usuarios(
     limit: int = Query(10, ge=1),
     session: AsyncSession = Depends(get_session)
 ):
+    if LEITURA_LEVE:
+        return await listar_pagina(session, Usuario, page, limit)
+
     offset = (page - 1) * limit
     result = await session.execute(select(Usuario).offset(offset).limit(limit))
     usuarios = result.scalars().all()
@@ -58,22 +81,18 @@ async def atualizar_usuario(
     usuario_update: UsuarioUpdate,
     session: AsyncSession = Depends(get_session)
 ):
-    query = select(Usuario).where(Usuario.id == usuario_id)
-    result = await session.execute(query)
-    usuario = result.scalar_one_or_none()
+    update_data = usuario_update.dict(exclude_unset=True)
+    usuario = await atualizar_retornando(session, Usuario, usuario_id, update_data)
 
     if not usuario:
         logger.warning(f"Tentativa de atualizar usuário não encontrado: id={usuario_id}")
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
-    update_data = usuario_update.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(usuario, key, value)
-
-    session.add(usuario)
+    if "nome" in update_data:
+        await sincronizar_usuario(session, usuario_id)
     await session.commit()
-    await session.refresh(usuario)
     logger.info(f"Usuário atualizado: id={usuario.id}")
+    await publicar("usuario", "atualizado", usuario.id)
     return usuario
 
 @router.get("/contar", response_model=ContagemUsuarios)
@@ -90,15 +109,20 @@ async def contar_usuarios(session:
         
 @router.delete("/", response_model=dict)
 async def deletar_usuario(usuario_id: int, session: AsyncSession = Depends(get_session)):
-    usuario = await session.get(Usuario, usuario_id)
-    if not usuario:
+    # Como no delete do ORM: os pedidos do usuário ficam, com usuario_id nulo, também no arquivo.
+    pedido_ids = await desvincular_retornando(session, Pedido, Pedido.usuario_id, usuario_id)
+    await desvincular_retornando(session, PedidoArquivado, PedidoArquivado.usuario_id, usuario_id)
+    if await deletar_retornando(session, Usuario, usuario_id) is None:
         logger.warning(f"Tentativa de deletar usuário não encontrado: id={usuario_id}")
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
-    await session.delete(usuario)
+    if pedido_ids:
+        await registrar_eventos(session, "pedido", "atualizado", pedido_ids)
+        await sincronizar_pedidos(session, pedido_ids)
     await session.commit()
     
     logger.info(f"Usuário deletado: id={usuario_id}")
+    await publicar("usuario", "removido", usuario_id)
     return {"message": "Usuário deletado com sucesso"}
 
 @router.get("/filtrar", response_model=PaginatedUsuario)
@@ -109,7 +133,7 @@ async def filtrar_usuarios(
     data_cadastro: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1),
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(sessao_com_timeout("filtrar_usuarios"))
 ):
     query = select(Usuario)
 
@@ -144,4 +168,60 @@ async def filtrar_usuarios(
         f"{total} encontrados, página {page} com limite {limit}"
     )
 
-    return PaginatedUsuario(page=page, limit=limit, total=total, items=usuarios_paginados)
\ No newline at end of file
+    return PaginatedUsuario(page=page, limit=limit, total=total, items=usuarios_paginados)
+
+
+def _codificar_cursor(pedido: Pedido) -> str:
+    return base64.urlsafe_b64encode(f"{pedido.data_pedido.isoformat()}|{pedido.id}".encode()).decode()
+
+
+def _decodificar_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        data_pedido, pedido_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return date.fromisoformat(data_pedido), int(pedido_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+
+
+@router.get("/{usuario_id}/pedidos", response_model=HistoricoPedidos)
+async def listar_pedidos_usuario(
+    usuario_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="proximo_cursor devolvido pela página anterior"),
+    session: AsyncSession = Depends(get_session)
+):
+    # Paginação por chave (data_pedido, id) decrescente sobre ix_pedido_usuario_id_data_pedido;
+    # livros e pagamento da página inteira vêm em uma consulta cada (3 consultas no total).
+    query = (
+        select(Pedido)
+        .where(Pedido.usuario_id == usuario_id)
+        .options(selectinload(Pedido.livros), selectinload(Pedido.pagamento))
+        .order_by(Pedido.data_pedido.desc(), Pedido.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(Pedido.data_pedido, Pedido.id) < _decodificar_cursor(cursor))
+
+    result = await session.execute(query)
+    pedidos = result.scalars().all()
+
+    if not pedidos and not cursor:
+        usuario = await session.scalar(select(Usuario.id).where(Usuario.id == usuario_id))
+        if usuario is None:
+            raise HTTPException(status_code=404, detail="Usuário não encontrado")
+
+    proximo_cursor = _codificar_cursor(pedidos[limit - 1]) if len(pedidos) > limit else None
+    pedidos = pedidos[:limit]
+
+    logger.info(f"Histórico de pedidos do usuário {usuario_id}: {len(pedidos)} pedido(s) retornado(s)")
+    return HistoricoPedidos(
+        items=[
+            PedidoHistorico(
+                **pedido.dict(),
+                livros=[LivroDoPedido(id=livro.id, titulo=livro.titulo, preco=livro.preco) for livro in pedido.livros],
+                pagamento=PagamentoRead(**pedido.pagamento.dict()) if pedido.pagamento else None,
+            )
+            for pedido in pedidos
+        ],
+        proximo_cursor=proximo_cursor,
+    )
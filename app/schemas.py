@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import date
+from app.status_pedido import StatusPedido
 
 
 
@@ -123,6 +124,21 @@ class LivroInfo(BaseModel):
     titulo: str
     autor: Optional[str]
     editora: Optional[str]
+
+class LivroRecomendado(LivroRead):
+    compras_em_comum: int
+
+class FacetaItem(BaseModel):
+    id: Optional[int] = None
+    valor: Optional[str] = None
+    total: int
+
+class LivroFacetas(BaseModel):
+    total: int
+    genero: List[FacetaItem]
+    faixa_preco: List[FacetaItem]
+    editora: List[FacetaItem]
+    autor: List[FacetaItem]
     
 
 # ----------- USUÁRIO -----------
@@ -192,22 +208,40 @@ class PaginatedPagamentos(BaseModel):
     total: int
     items: List[PagamentoRead]
 
+class PagamentoLoteItem(PagamentoCreate):
+    chave_idempotencia: Optional[str] = None
+
+class PagamentoLote(BaseModel):
+    pagamentos: List[PagamentoLoteItem]
+
+class PagamentoLoteResultado(BaseModel):
+    recebidos: int
+    criados: int
+    atualizados: int
+    ignorados: int
+
 # ----------- PEDIDO -----------
 
 class PedidoCreate(BaseModel):
     usuario_id: int
     data_pedido: date
-    status: str
+    status: StatusPedido = StatusPedido.pendente.value
     valor_total: float
     livro_ids: List[int]
 
+    class Config:
+        use_enum_values = True
+
 
 class PedidoUpdate(BaseModel):
     usuario_id: Optional[int] = None
     data_pedido: Optional[date] = None
-    status: Optional[str] = None
+    status: Optional[StatusPedido] = None
     valor_total: Optional[float] = None
 
+    class Config:
+        use_enum_values = True
+
 class PedidoRead(BaseModel):
     id: int
     usuario_id: Optional[int]
@@ -231,4 +265,76 @@ class PaginatedPedido(BaseModel):
     total: int
     items: List[PedidoRead]
 
+class LivroDoPedido(BaseModel):
+    id: int
+    titulo: str
+    preco: float
+
+class PedidoHistorico(BaseModel):
+    id: int
+    data_pedido: date
+    status: str
+    valor_total: float
+    livros: List[LivroDoPedido]
+    pagamento: Optional[PagamentoRead] = None
+
+class HistoricoPedidos(BaseModel):
+    items: List[PedidoHistorico]
+    proximo_cursor: Optional[str] = None
 
+
+
+# ----------- OPERAÇÕES EM LOTE -----------
+
+class LivroPrecoLote(BaseModel):
+    percentual: float
+    ids: Optional[List[int]] = None
+    editora_id: Optional[int] = None
+    autor_id: Optional[int] = None
+    genero: Optional[str] = None
+
+class PedidoStatusLote(BaseModel):
+    status: StatusPedido
+    ids: Optional[List[int]] = None
+    usuario_id: Optional[int] = None
+    status_atual: Optional[StatusPedido] = None
+
+    class Config:
+        use_enum_values = True
+
+class PagamentoFormaLote(BaseModel):
+    forma_pagamento: str
+    ids: Optional[List[int]] = None
+    pedido_ids: Optional[List[int]] = None
+    forma_atual: Optional[str] = None
+
+class ResultadoLote(BaseModel):
+    afetados: int
+    ids: List[int]
+
+# ----------- BATCH -----------
+
+class OperacaoBatch(BaseModel):
+    id: Optional[str] = None
+    path: str
+    params: Optional[Dict[str, Any]] = None
+
+class BatchRequest(BaseModel):
+    operacoes: List[OperacaoBatch]
+    concorrencia: Optional[int] = None
+
+class ResultadoOperacao(BaseModel):
+    id: Optional[str] = None
+    status: int
+    body: Any = None
+
+class BatchResponse(BaseModel):
+    resultados: List[ResultadoOperacao]
+
+# ----------- AUTOCOMPLETAR -----------
+
+class AutocompleteItem(BaseModel):
+    tipo: str
+    id: int
+    texto: str
+    popularidade: int
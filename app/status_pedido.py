@@ -0,0 +1,55 @@
+from enum import Enum
+from typing import Iterable, List
+from sqlalchemy import bindparam
+
+
+class StatusPedido(str, Enum):
+    pendente = "pendente"
+    pago = "pago"
+    enviado = "enviado"
+    entregue = "entregue"
+    cancelado = "cancelado"
+
+
+# Pedidos em aberto: a fila de operação. Os índices parciais ix_pedido_status_abertos e
+# ix_pedido_view_status_abertos cobrem só essas linhas.
+STATUS_ABERTOS = (StatusPedido.pendente, StatusPedido.pago, StatusPedido.enviado)
+
+TRANSICOES = {
+    StatusPedido.pendente: {StatusPedido.pago, StatusPedido.cancelado},
+    StatusPedido.pago: {StatusPedido.enviado, StatusPedido.cancelado},
+    StatusPedido.enviado: {StatusPedido.entregue},
+    StatusPedido.entregue: set(),
+    StatusPedido.cancelado: set(),
+}
+
+
+def _lista(valores: Iterable[str]) -> str:
+    return ", ".join(f"'{StatusPedido(valor).value}'" for valor in valores)
+
+
+# Mesmo texto nas constraints, nos índices parciais e no filtro `abertos`: o SQLite só usa
+# um índice parcial quando a consulta repete o predicado dele.
+CONDICAO_STATUS_VALIDO = f"status IN ({_lista(StatusPedido)})"
+CONDICAO_STATUS_ABERTOS = f"status IN ({_lista(STATUS_ABERTOS)})"
+
+
+def transicao_valida(atual: str, novo: str) -> bool:
+    # Repetir o status atual é aceito: o PATCH continua idempotente.
+    return atual == novo or novo in TRANSICOES.get(atual, ())
+
+
+def origens(novo: str) -> List[str]:
+    # Status a partir dos quais `novo` pode ser atingido, para entrar no WHERE do UPDATE.
+    return [status.value for status in StatusPedido if transicao_valida(status, novo)]
+
+
+def status_em(coluna, valores: Iterable[str]):
+    # IN com os valores como literais no SQL: o planner do Postgres só prova o predicado de
+    # um índice parcial com constantes, e um plano genérico com parâmetros o ignoraria.
+    valores = [StatusPedido(valor).value for valor in valores]
+    return coluna.in_(bindparam(None, valores, expanding=True, literal_execute=True))
+
+
+def condicao_abertos(coluna):
+    return status_em(coluna, STATUS_ABERTOS)
@@ -0,0 +1,158 @@
+import asyncio
+import os
+from typing import Dict
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from app.database import EH_SQLITE, async_session, sessao_compartilhada
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+
+def _ler_timeouts(valor: str) -> Dict[str, int]:
+    # "filtrar_pedidos=5000,filtrar_usuarios=3000" -> {handler: milissegundos}
+    timeouts = {}
+    for item in filter(None, (parte.strip() for parte in valor.split(","))):
+        handler, _, ms = item.partition("=")
+        timeouts[handler] = int(ms)
+    return timeouts
+
+
+STATEMENT_TIMEOUT_PADRAO_MS = int(os.getenv("STATEMENT_TIMEOUT_PADRAO_MS", "0"))
+STATEMENT_TIMEOUT_ROTAS = {
+    "filtrar_pedidos": 10000,
+    "filtrar_pagamentos": 10000,
+    "filtrar_usuarios": 10000,
+    "filtrar_livros": 10000,
+    "filtrar_autores": 10000,
+    "filtrar_editoras": 10000,
+    "facetas_livros": 10000,
+    **_ler_timeouts(os.getenv("STATEMENT_TIMEOUT_ROTAS", "")),
+}
+# Streams SSE já tratam a desconexão na própria resposta.
+CANCELAMENTO_ROTAS_IGNORADAS = ("/docs", "/redoc", "/openapi.json", "/pedidos/eventos")
+
+# SQLSTATE 57014 (query_canceled) cobre statement_timeout e cancelamentos explícitos.
+SQLSTATE_CANCELADO = "57014"
+
+
+def sessao_com_timeout(handler: str):
+    timeout_ms = STATEMENT_TIMEOUT_ROTAS.get(handler, STATEMENT_TIMEOUT_PADRAO_MS)
+
+    definir = text("SELECT set_config('statement_timeout', :valor, true)")
+
+    def definir_timeout(session, transaction, connection):
+        # is_local=true: vale só para a transação que acabou de ser aberta.
+        connection.execute(definir, {"valor": f"{timeout_ms}ms"})
+
+    async def get_session_com_timeout():
+        compartilhada = sessao_compartilhada.get()
+        if compartilhada is not None:
+            if not timeout_ms or EH_SQLITE:
+                yield compartilhada
+                return
+            # Operação de um batch: a sessão do trabalhador segue para as próximas operações,
+            # então o timeout desta rota é desfeito ao final.
+            event.listen(compartilhada.sync_session, "after_begin", definir_timeout)
+            try:
+                if compartilhada.in_transaction():
+                    await compartilhada.execute(definir, {"valor": f"{timeout_ms}ms"})
+                yield compartilhada
+            finally:
+                event.remove(compartilhada.sync_session, "after_begin", definir_timeout)
+                if compartilhada.in_transaction():
+                    try:
+                        await compartilhada.execute(text("SET LOCAL statement_timeout TO DEFAULT"))
+                    except DBAPIError:
+                        # Transação já abortada: o trabalhador faz o rollback.
+                        pass
+            return
+        async with async_session() as session:
+            # SQLite não tem statement_timeout.
+            if timeout_ms and not EH_SQLITE:
+                # Aplicado ao abrir a transação, não ao criar a sessão: handlers que respondem
+                # sem consultar o banco não pagam essa ida.
+                event.listen(session.sync_session, "after_begin", definir_timeout)
+            yield session
+
+    return get_session_com_timeout
+
+
+def eh_timeout(erro: Exception) -> bool:
+    if not isinstance(erro, DBAPIError):
+        return False
+    return getattr(erro.orig, "sqlstate", None) == SQLSTATE_CANCELADO
+
+
+def tempo_esgotado(operacao: str) -> HTTPException:
+    logger.warning(f"Tempo limite de consulta excedido ao {operacao}")
+    return HTTPException(status_code=504, detail=f"Tempo limite excedido ao {operacao}.")
+
+
+class CancelamentoDesconexaoMiddleware:
+    # Para GETs, consome o corpo (vazio) no lugar da aplicação e fica escutando o
+    # http.disconnect; se o cliente desistir antes da resposta, a tarefa do handler é
+    # cancelada e o asyncpg cancela a consulta em andamento no servidor. Depois do último
+    # corpo enviado a desconexão é só o fim da conexão: o teardown (dependências com
+    # yield, background tasks) termina normalmente.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or scope["path"].startswith(CANCELAMENTO_ROTAS_IGNORADAS)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        desconectado = asyncio.Event()
+        corpo_entregue = False
+        resposta_enviada = False
+
+        async def receber():
+            nonlocal corpo_entregue
+            if not corpo_entregue:
+                corpo_entregue = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await desconectado.wait()
+            return {"type": "http.disconnect"}
+
+        async def vigiar():
+            while True:
+                mensagem = await receive()
+                if mensagem["type"] == "http.disconnect":
+                    desconectado.set()
+                    return
+
+        async def enviar(mensagem):
+            nonlocal resposta_enviada
+            if mensagem["type"] == "http.response.body" and not mensagem.get("more_body", False):
+                resposta_enviada = True
+            await send(mensagem)
+
+        tarefa_app = asyncio.create_task(self.app(scope, receber, enviar))
+        vigia = asyncio.create_task(vigiar())
+        try:
+            await asyncio.wait({tarefa_app, vigia}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            tarefa_app.cancel()
+            vigia.cancel()
+            raise
+
+        if not tarefa_app.done() and not resposta_enviada:
+            logger.info(f"Cliente desconectou; cancelando {scope['method']} {scope['path']}")
+            tarefa_app.cancel()
+            try:
+                await tarefa_app
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.error(f"Erro ao cancelar {scope['method']} {scope['path']}", exc_info=True)
+            return
+
+        vigia.cancel()
+        await tarefa_app
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import random
+from typing import Awaitable, Callable, TypeVar
+from fastapi import HTTPException
+from sqlalchemy.exc import DBAPIError
+from sqlmodel.ext.asyncio.session import AsyncSession
+from logs.logger import get_logger
+
+logger = get_logger("MyBooks")
+
+TRANSACAO_TENTATIVAS = int(os.getenv("TRANSACAO_TENTATIVAS", "4"))
+TRANSACAO_ESPERA_BASE_MS = float(os.getenv("TRANSACAO_ESPERA_BASE_MS", "20"))
+TRANSACAO_ESPERA_MAX_MS = float(os.getenv("TRANSACAO_ESPERA_MAX_MS", "500"))
+TRANSACAO_RETRY_AFTER_S = int(os.getenv("TRANSACAO_RETRY_AFTER_S", "1"))
+
+# Conflitos em que a transação inteira pode ser repetida sem efeito colateral.
+SQLSTATES_TRANSITORIOS = {
+    "40001": "falha de serialização",
+    "40P01": "deadlock",
+    "55P03": "lock indisponível",
+}
+
+# Equivalentes no SQLite embutido: outra conexão segura o lock de escrita.
+ERROS_SQLITE_TRANSITORIOS = {
+    "SQLITE_BUSY": "banco ocupado",
+    "SQLITE_LOCKED": "tabela travada",
+}
+
+T = TypeVar("T")
+
+
+def _motivo(erro: Exception):
+    if not isinstance(erro, DBAPIError):
+        return None
+    sqlstate = getattr(erro.orig, "sqlstate", None)
+    if sqlstate is not None:
+        return SQLSTATES_TRANSITORIOS.get(sqlstate)
+    return ERROS_SQLITE_TRANSITORIOS.get(getattr(erro.orig, "sqlite_errorname", None))
+
+
+def eh_transitorio(erro: Exception) -> bool:
+    return _motivo(erro) is not None
+
+
+def conflito_persistente(operacao: str) -> HTTPException:
+    logger.warning(f"Conflito de concorrência persistente ao {operacao}")
+    return HTTPException(
+        status_code=503,
+        detail=f"Conflito de concorrência ao {operacao}; tente novamente.",
+        headers={"Retry-After": str(TRANSACAO_RETRY_AFTER_S)},
+    )
+
+
+def _espera(tentativa: int) -> float:
+    # Backoff exponencial com jitter completo: quem colidiu não volta junto.
+    teto = min(TRANSACAO_ESPERA_MAX_MS, TRANSACAO_ESPERA_BASE_MS * 2 ** (tentativa - 1))
+    return random.uniform(0, teto) / 1000
+
+
+async def unidade_de_trabalho(
+    session: AsyncSession, operacao: Callable[[], Awaitable[T]], descricao: str
+) -> T:
+    # Executa operacao() e faz o commit. Em conflito transitório (inclusive no commit) a
+    # transação é desfeita e operacao() roda de novo do início, então ela deve fazer todas
+    # as leituras e escritas pela sessão. Esgotadas as tentativas, o último erro sobe.
+    tentativa = 1
+    while True:
+        try:
+            resultado = await operacao()
+            await session.commit()
+            return resultado
+        except Exception as e:
+            await session.rollback()
+            if not eh_transitorio(e) or tentativa >= TRANSACAO_TENTATIVAS:
+                if eh_transitorio(e):
+                    logger.warning(f"{_motivo(e)} ao {descricao}: {tentativa} tentativa(s) esgotada(s)")
+                raise
+            espera = _espera(tentativa)
+            logger.info(
+                f"{_motivo(e)} ao {descricao} "
+                f"(tentativa {tentativa}/{TRANSACAO_TENTATIVAS}); repetindo em {espera * 1000:.0f}ms"
+            )
+            await asyncio.sleep(espera)
+            tentativa += 1
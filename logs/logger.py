@@ -1,5 +1,6 @@
 import logging
 import os
+from logging.handlers import RotatingFileHandler
 
 os.makedirs("logs", exist_ok=True)
 
@@ -22,3 +23,20 @@ def get_logger(name: str) -> logging.Logger:
         logger.addHandler(stream_handler)
 
     return logger
+
+
+def get_rotating_logger(name: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    if not logger.handlers:
+        formatter = logging.Formatter("%(asctime)s - %(message)s")
+
+        file_handler = RotatingFileHandler(
+            f"logs/{name}.log", maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        file_handler.setFormatter(formatter)
+        logger.addHandler(file_handler)
+
+    return logger
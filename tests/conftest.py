@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+# Banco SQLite descartável; precisa estar definido antes do primeiro import de app.*.
+_DIRETORIO = tempfile.mkdtemp(prefix="mybooks-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_DIRETORIO}/mybooks.db")
+os.environ.setdefault("INVALIDACAO_BACKEND", "local")
+
+from datetime import date
+
+import pytest
+
+from app.database import async_session
+from app.embutido import app_embutido, contar_consultas, recriar_banco
+from app.models import Autor, Editora, Livro, Pedido, PedidoLivroLink, Usuario
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def app_em_processo(anyio_backend):
+    async with app_embutido() as cliente:
+        yield cliente
+
+
+@pytest.fixture
+async def cliente(app_em_processo, anyio_backend):
+    # Cada teste começa com o schema vazio; o app (lifespan) é o mesmo da sessão.
+    await recriar_banco()
+    yield app_em_processo
+
+
+@pytest.fixture
+def consultas():
+    with contar_consultas() as registradas:
+        yield registradas
+
+
+@pytest.fixture
+async def dados(cliente):
+    # Um usuário, dois livros e dois pedidos pendentes, cada um com os dois livros.
+    async with async_session() as session:
+        usuario = Usuario(nome="Ana", email="ana@exemplo.com", cpf="12345678900", data_cadastro=date(2024, 1, 1))
+        autor = Autor(nome="Autor", email="autor@exemplo.com", data_nascimento=date(1970, 1, 1), nacionalidade="BR")
+        editora = Editora(nome="Editora", endereco="Rua A", telefone="0000", email="editora@exemplo.com")
+        session.add_all([usuario, autor, editora])
+        await session.flush()
+        livros = [
+            Livro(titulo=f"Livro {i}", preco=10 + i, genero="ficcao", autor_id=autor.id, editora_id=editora.id)
+            for i in range(2)
+        ]
+        session.add_all(livros)
+        await session.flush()
+        pedidos = []
+        for i in range(2):
+            pedido = Pedido(usuario_id=usuario.id, data_pedido=date(2025, 6, i + 1), status="pendente", valor_total=20)
+            session.add(pedido)
+            await session.flush()
+            session.add_all([PedidoLivroLink(pedido_id=pedido.id, livro_id=livro.id) for livro in livros])
+            pedidos.append(pedido.id)
+        await session.commit()
+        return {
+            "usuario": usuario.id, "autor": autor.id, "editora": editora.id,
+            "livros": [livro.id for livro in livros], "pedidos": pedidos,
+        }
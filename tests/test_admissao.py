@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import admissao
+from app.admissao import ControleAdmissao, ControleAdmissaoMiddleware, EsperaExpirada, FilaCheia, Limitador
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_limitador_enfileira_por_prioridade_e_recusa_fila_cheia():
+    limitador = Limitador("teste", limite=1, fila_max=2)
+    await limitador.adquirir(prioridade=1, timeout=1)
+    ordem = []
+
+    async def esperar(prioridade):
+        await limitador.adquirir(prioridade, timeout=1)
+        ordem.append(prioridade)
+
+    tarefas = [asyncio.create_task(esperar(2)), asyncio.create_task(esperar(0))]
+    await asyncio.sleep(0)
+    with pytest.raises(FilaCheia):
+        await limitador.adquirir(prioridade=0, timeout=1)
+
+    # A vaga passa direto para o próximo da fila, na ordem de prioridade.
+    limitador.liberar()
+    await asyncio.sleep(0)
+    limitador.liberar()
+    await asyncio.gather(*tarefas)
+    assert ordem == [0, 2]
+    assert (limitador.em_uso, limitador.rejeitados) == (1, 1)
+
+
+async def test_limitador_expira_espera():
+    limitador = Limitador("teste", limite=1, fila_max=1)
+    await limitador.adquirir(prioridade=0, timeout=1)
+    with pytest.raises(EsperaExpirada):
+        await limitador.adquirir(prioridade=0, timeout=0.01)
+    assert (limitador.aguardando, limitador.expirados) == (0, 1)
+
+
+async def test_middleware_responde_503_com_retry_after(monkeypatch):
+    monkeypatch.setattr(admissao, "ADMISSAO_ESPERA_MAX_S", 0.01)
+    liberar = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await liberar.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    controle = ControleAdmissao()
+    controle.global_ = Limitador("global", limite=1, fila_max=10)
+    transporte = httpx.ASGITransport(app=ControleAdmissaoMiddleware(app, controle))
+    async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as cliente:
+        primeira = asyncio.create_task(cliente.get("/livros/"))
+        await asyncio.sleep(0.01)
+        recusada = await cliente.get("/livros/")
+        liberar.set()
+        assert (await primeira).status_code == 200
+    assert recusada.status_code == 503
+    assert recusada.headers["retry-after"] == str(admissao.ADMISSAO_RETRY_AFTER_S)
+    assert controle.global_.em_uso == 0
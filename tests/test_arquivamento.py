@@ -0,0 +1,55 @@
+from datetime import date
+
+import pytest
+
+from app.arquivamento import arquivar
+from app.database import async_session, engine
+from app.models import Livro, Pagamento, PedidoArquivado, PedidoLivroLinkArquivado
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def arquivado(dados):
+    # Um pedido antigo já no arquivo, com o primeiro livro.
+    async with async_session() as session:
+        session.add(PedidoArquivado(
+            id=1000, usuario_id=dados["usuario"], data_pedido=date(2020, 1, 1), status="entregue", valor_total=10
+        ))
+        session.add(PedidoLivroLinkArquivado(pedido_id=1000, livro_id=dados["livros"][0]))
+        await session.commit()
+    return 1000
+
+
+async def test_livro_de_pedido_arquivado_nao_e_removido(cliente, dados, arquivado):
+    livro_id = dados["livros"][0]
+    resposta = await cliente.delete("/livros/", params={"livro_id": livro_id})
+    assert resposta.status_code == 409
+    resposta = await cliente.delete("/livros/lote", params={"ids": [livro_id]})
+    assert resposta.status_code == 200
+    assert resposta.json()["ids"] == []
+
+    async with async_session() as session:
+        assert await session.get(Livro, livro_id) is not None
+        assert await session.get(PedidoLivroLinkArquivado, (arquivado, livro_id)) is not None
+
+
+async def test_leituras_com_incluir_arquivados(cliente, dados):
+    async with async_session() as session:
+        session.add(Pagamento(pedido_id=dados["pedidos"][0], data_pagamento=date(2025, 6, 1), valor=20, forma_pagamento="pix"))
+        await session.commit()
+    assert await arquivar(engine, meses=12, pausa_ms=0, hoje=date(2027, 1, 1)) == (2, 1)
+
+    for caminho, com_arquivo in [
+        ("/pedidos/", 2),
+        (f"/pedidos/filtrar?usuario_id={dados['usuario']}", 2),
+        ("/pagamentos/", 1),
+        (f"/pagamentos/filtro?pedido_id={dados['pedidos'][0]}", 1),
+    ]:
+        separador = "&" if "?" in caminho else "?"
+        resposta = await cliente.get(f"{caminho}{separador}incluir_arquivados=true")
+        assert resposta.status_code == 200, (caminho, resposta.text)
+        assert resposta.json()["total"] == com_arquivo, caminho
+        # Sem o parâmetro, só as tabelas quentes, já vazias (os filtros respondem 404).
+        resposta = await cliente.get(caminho)
+        assert resposta.status_code == 404 or resposta.json()["total"] == 0, caminho
@@ -0,0 +1,41 @@
+import pytest
+
+from app.autocompletar import Autocompletar, IndicePrefixos
+
+
+def test_remover_tolera_chave_ausente():
+    indice = IndicePrefixos([("livro", 1, "Dom Casmurro"), ("livro", 2, "Dom Quixote")])
+    # Entrada sem as chaves no array (estado inconsistente): a remoção não estoura.
+    posicao = indice._alvos.index(("livro", 1))
+    del indice._chaves[posicao], indice._alvos[posicao]
+    indice.remover("livro", 1)
+    assert [item["id"] for item in indice.buscar("dom", 10)] == [2]
+
+
+def test_definir_vendas_repassa_diferenca_ao_autor():
+    indice = IndicePrefixos([("livro", 1, "Dom Casmurro"), ("autor", 7, "Machado de Assis")])
+    indice.vincular_livro(1, 7, None)
+    indice.definir_vendas(1, 3)
+    indice.definir_vendas(1, 3)
+    assert indice.popularidade[("autor", 7)] == 3
+    indice.definir_vendas(1, 1)
+    assert indice.popularidade[("autor", 7)] == 1
+
+
+@pytest.mark.anyio
+async def test_popularidade_acompanha_remocao_e_eventos_repetidos(cliente, dados):
+    autocompletar = Autocompletar()
+    await autocompletar.construir()
+    indice = autocompletar.indice
+    assert indice.popularidade[("autor", dados["autor"])] == 4
+
+    # O mesmo evento de pedido duas vezes não conta a venda em dobro.
+    for _ in range(2):
+        await autocompletar._atualizar(indice, "pedido", dados["pedidos"][0])
+    assert indice.popularidade[("livro", dados["livros"][1])] == 2
+
+    resposta = await cliente.delete("/livros/", params={"livro_id": dados["livros"][0]})
+    assert resposta.status_code == 200
+    await autocompletar._atualizar(indice, "livro", dados["livros"][0])
+    assert indice.popularidade[("autor", dados["autor"])] == 2
+    assert indice.popularidade[("editora", dados["editora"])] == 2
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from app.coalescencia import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_requisicoes_identicas_compartilham_a_execucao():
+    single_flight = SingleFlight()
+    liberar = asyncio.Event()
+    execucoes = []
+
+    async def consulta():
+        execucoes.append(1)
+        await liberar.wait()
+        return b"[]"
+
+    esperas = [asyncio.create_task(single_flight.executar("GET /livros/", consulta)) for _ in range(3)]
+    outra = asyncio.create_task(single_flight.executar("GET /autores/", consulta))
+    await asyncio.sleep(0)
+    # Um cliente que desiste não cancela a execução dos demais.
+    esperas[0].cancel()
+    liberar.set()
+    assert await asyncio.gather(*esperas[1:], outra) == [b"[]"] * 3
+    assert len(execucoes) == 2
+    assert esperas[0].cancelled()
+
+    # Terminada a execução, a próxima requisição consulta de novo.
+    await single_flight.executar("GET /livros/", consulta)
+    assert len(execucoes) == 3
+
+
+async def test_erro_chega_a_todos_os_que_esperam():
+    single_flight = SingleFlight()
+
+    async def consulta():
+        await asyncio.sleep(0)
+        raise RuntimeError("falhou")
+
+    resultados = await asyncio.gather(
+        *(single_flight.executar("GET /livros/", consulta) for _ in range(2)), return_exceptions=True
+    )
+    assert [type(resultado) for resultado in resultados] == [RuntimeError, RuntimeError]
+
+
+async def test_execucao_cancelada_quando_todos_desistem():
+    single_flight = SingleFlight()
+    iniciada = asyncio.Event()
+
+    async def consulta():
+        iniciada.set()
+        await asyncio.Event().wait()
+
+    esperas = [asyncio.create_task(single_flight.executar("GET /livros/", consulta)) for _ in range(2)]
+    await iniciada.wait()
+    tarefa = single_flight._em_voo["GET /livros/"]
+    esperas[0].cancel()
+    await asyncio.sleep(0)
+    assert not tarefa.cancelled()
+    esperas[1].cancel()
+    await asyncio.gather(*esperas, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert tarefa.cancelled()
+    assert single_flight._em_voo == {}
+
+
+async def test_rotas_coalescidas_respondem_dentro_e_fora_do_batch(cliente, dados):
+    resposta = await cliente.get("/pedidos/contar")
+    assert resposta.status_code == 200, resposta.text
+    esperado = resposta.json()
+
+    resposta = await cliente.post("/batch", json={"operacoes": [{"id": "a", "path": "/pedidos/contar"}]})
+    assert resposta.status_code == 200, resposta.text
+    assert resposta.json()["resultados"][0]["body"] == esperado
@@ -0,0 +1,61 @@
+import httpx
+import msgpack
+import pytest
+from fastapi import Response
+
+from app.codificacao import COMPRESSAO_MINIMO_BYTES, CompressaoMiddleware, MessagePackMiddleware, RespostaNegociada
+
+pytestmark = pytest.mark.anyio
+
+
+def _app(tipo: str, corpo: bytes):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", tipo.encode())]})
+        await send({"type": "http.response.body", "body": corpo})
+    return CompressaoMiddleware(app)
+
+
+@pytest.mark.parametrize("tipo, corpo, accept_encoding, codificada", [
+    ("application/json", b"[]", "gzip", False),
+    ("image/png", b"x" * (COMPRESSAO_MINIMO_BYTES * 2), "gzip", False),
+    ("application/json", b"1" * (COMPRESSAO_MINIMO_BYTES * 2), "gzip", True),
+    ("application/json", b"1" * (COMPRESSAO_MINIMO_BYTES * 2), "identity", False),
+])
+async def test_vary_sempre_que_ha_negociacao(tipo, corpo, accept_encoding, codificada):
+    transporte = httpx.ASGITransport(app=_app(tipo, corpo))
+    async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as cliente:
+        resposta = await cliente.get("/", headers={"accept-encoding": accept_encoding})
+    assert resposta.headers["vary"] == "Accept-Encoding"
+    assert ("content-encoding" in resposta.headers) == codificada
+    assert resposta.content == corpo
+
+
+def _app_msgpack(resposta):
+    # A resposta é criada dentro da requisição, como numa rota.
+    async def app(scope, receive, send):
+        await resposta()(scope, receive, send)
+    return MessagePackMiddleware(app)
+
+
+async def _get(app, accept):
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as cliente:
+        return await cliente.get("/", headers={"accept": accept})
+
+
+async def test_resposta_negociada_sai_em_msgpack_sem_passar_por_json():
+    resposta = await _get(_app_msgpack(lambda: RespostaNegociada({"id": 1})), "application/msgpack")
+    assert resposta.headers["content-type"] == "application/msgpack"
+    assert resposta.headers["vary"] == "Accept"
+    assert msgpack.unpackb(resposta.content) == {"id": 1}
+
+
+@pytest.mark.parametrize("accept, status", [
+    ("application/msgpack, application/json;q=0.5", 200),
+    ("application/msgpack", 406),
+])
+async def test_json_invalido_nao_varia_com_accept(accept, status):
+    resposta = await _get(_app_msgpack(lambda: Response(b"{invalido", media_type="application/json")), accept)
+    assert resposta.status_code == status
+    assert "vary" not in resposta.headers
+    assert resposta.headers["content-type"] == "application/json"
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from app.database import async_session
+from app.models import Pagamento, Pedido, PedidoEvento, PedidoLivroLink, PedidoView
+from app.routes import pagamentos, pedidos
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def agrupada(monkeypatch):
+    monkeypatch.setattr(pedidos, "ESCRITA_AGRUPADA", True)
+    monkeypatch.setattr(pagamentos, "ESCRITA_AGRUPADA", True)
+
+
+async def _contar(modelo, *condicoes):
+    async with async_session() as session:
+        return await session.scalar(select(func.count()).select_from(modelo).where(*condicoes))
+
+
+async def test_pedido_agrupado_com_livro_inexistente(cliente, dados, agrupada):
+    pedido = {"usuario_id": dados["usuario"], "data_pedido": "2025-07-01", "status": "pendente", "valor_total": 10}
+
+    resposta = await cliente.post("/pedidos/", json={**pedido, "livro_ids": [dados["livros"][0], 999]})
+    assert resposta.status_code == 404
+    assert await _contar(Pedido) == 2
+    assert await _contar(PedidoEvento) == 0
+
+
+async def test_pedido_agrupado_grava_dependentes_no_mesmo_commit(cliente, dados, agrupada):
+    pedido = {"usuario_id": dados["usuario"], "data_pedido": "2025-07-01", "status": "pendente", "valor_total": 10}
+
+    resposta = await cliente.post("/pedidos/", json={**pedido, "livro_ids": dados["livros"]})
+    assert resposta.status_code == 200, resposta.text
+    pedido_id = resposta.json()["id"]
+    assert await _contar(PedidoLivroLink, PedidoLivroLink.pedido_id == pedido_id) == 2
+    assert await _contar(PedidoEvento, PedidoEvento.registro_id == pedido_id, PedidoEvento.acao == "criado") == 1
+    async with async_session() as session:
+        view = await session.get(PedidoView, pedido_id)
+    assert view.quantidade_livros == 2
+
+
+async def test_pagamento_agrupado_valida_e_sincroniza_no_mesmo_commit(cliente, dados, agrupada):
+    pedido_id = dados["pedidos"][0]
+    pagamento = {"data_pagamento": "2025-06-02", "valor": 20, "forma_pagamento": "pix"}
+
+    resposta = await cliente.post("/pagamentos/", json={**pagamento, "pedido_id": 999})
+    assert resposta.status_code == 404
+    resposta = await cliente.post("/pagamentos/", json={**pagamento, "pedido_id": pedido_id})
+    assert resposta.status_code == 200, resposta.text
+    pagamento_id = resposta.json()["id"]
+    resposta = await cliente.post("/pagamentos/", json={**pagamento, "pedido_id": pedido_id, "data_pagamento": "2025-06-03"})
+    assert resposta.status_code == 409
+
+    assert await _contar(Pagamento) == 1
+    assert await _contar(PedidoEvento, PedidoEvento.entidade == "pagamento") == 1
+    async with async_session() as session:
+        view = await session.get(PedidoView, pedido_id)
+    assert view.pagamento_id == pagamento_id
+
+
+async def test_pagamentos_agrupados_para_o_mesmo_pedido(cliente, dados, agrupada):
+    # Os dois caem no mesmo lote: ele é desfeito e refeito item a item.
+    pagamento = {"pedido_id": dados["pedidos"][1], "valor": 20, "forma_pagamento": "pix"}
+
+    respostas = await asyncio.gather(*(
+        cliente.post("/pagamentos/", json={**pagamento, "data_pagamento": f"2025-06-0{dia}"}) for dia in (2, 3)
+    ))
+    assert sorted(resposta.status_code for resposta in respostas) == [200, 409]
+    assert await _contar(Pagamento) == 1
@@ -0,0 +1,73 @@
+import pytest
+
+from app.database import async_session
+from app.eventos_pedidos import DistribuidorEventos, transmitir
+from app.models import PedidoEvento
+
+pytestmark = pytest.mark.anyio
+
+
+class _Coletor:
+    def __init__(self):
+        self.ids = []
+
+    def entregar(self, evento):
+        self.ids.append(evento["id"])
+
+
+async def _gravar_eventos(*ids):
+    async with async_session() as session:
+        session.add_all([
+            PedidoEvento(id=id, entidade="pedido", acao="criado", registro_id=id, pedido_id=id, status="pendente")
+            for id in ids
+        ])
+        await session.commit()
+
+
+async def test_distribuidor_espera_lacuna_sem_reler_o_que_ja_entregou(cliente):
+    await _gravar_eventos(1, 2)
+    distribuidor = DistribuidorEventos()
+    coletor = _Coletor()
+    distribuidor.assinantes.add(coletor)
+    await distribuidor._iniciar()
+
+    await _gravar_eventos(5)
+    await distribuidor._varrer()
+    assert coletor.ids == [5]
+    assert sorted(distribuidor._lacunas) == [3, 4]
+
+    # A lacuna aparece depois (commit fora de ordem): entregue uma vez, sem repetir o 5.
+    await _gravar_eventos(3)
+    await distribuidor._varrer()
+    await distribuidor._varrer()
+    assert coletor.ids == [5, 3]
+    assert sorted(distribuidor._lacunas) == [4]
+
+    # Prazo vencido: o id não vai mais aparecer.
+    distribuidor._lacunas = dict.fromkeys(distribuidor._lacunas, 0.0)
+    await distribuidor._varrer()
+    assert distribuidor._lacunas == {}
+
+
+async def _inicio(gerador, quantidade):
+    partes = []
+    try:
+        for _ in range(quantidade):
+            partes.append(await gerador.__anext__())
+    finally:
+        await gerador.aclose()
+    return partes
+
+
+async def test_retomada_envia_so_os_eventos_seguintes(cliente):
+    await _gravar_eventos(1, 2, 3)
+    partes = await _inicio(transmitir(desde=1), 3)
+    assert partes[0].startswith("retry:")
+    assert [parte.split("\n")[0] for parte in partes[1:]] == ["id: 2", "id: 3"]
+
+
+@pytest.mark.parametrize("ids, desde", [((), 7), ((5, 6), 2), ((1, 2), 9)])
+async def test_retomada_de_id_desconhecido_envia_reset(cliente, ids, desde):
+    await _gravar_eventos(*ids)
+    partes = await _inicio(transmitir(desde=desde), 2)
+    assert partes[1] == "event: reset\ndata: {}\n\n"
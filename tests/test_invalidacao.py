@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from app import invalidacao
+from app.invalidacao import BarramentoSocket, assinar
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_barramento_socket_entrega_a_outro_worker(tmp_path, monkeypatch):
+    recebidos = []
+    monkeypatch.setattr(invalidacao, "_assinantes", {"livro": []})
+    assinar("livro", recebidos.append)
+
+    worker = BarramentoSocket(str(tmp_path))
+    outro = BarramentoSocket(str(tmp_path))
+    outro.caminho = os.path.join(str(tmp_path), "outro.sock")
+    await worker.iniciar()
+    await outro.iniciar()
+    try:
+        # Eventos do próprio worker já foram aplicados localmente e não voltam pelo socket.
+        await outro.enviar(json.dumps({"entidade": "livro", "acao": "atualizado", "id": 1, "origem": invalidacao.ORIGEM}))
+        evento = {"entidade": "livro", "acao": "atualizado", "id": 2, "origem": "outro-host:1"}
+        await outro.enviar(json.dumps(evento))
+        for _ in range(50):
+            if recebidos:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await outro.encerrar()
+        await worker.encerrar()
+    assert recebidos == [evento]
+
+
+async def test_socket_de_worker_encerrado_e_removido(tmp_path):
+    morto = tmp_path / "123.sock"
+    morto.touch()
+    worker = BarramentoSocket(str(tmp_path))
+    await worker.iniciar()
+    try:
+        await worker.enviar("{}")
+    finally:
+        await worker.encerrar()
+    assert not morto.exists()
+
+
+class _EnvioComFilaCheia:
+    # Recusa os primeiros `cheia` envios como um socket com a fila lotada.
+    def __init__(self, cheia):
+        self.cheia = cheia
+        self.entregues = []
+
+    def sendto(self, dados, caminho):
+        if self.cheia:
+            self.cheia -= 1
+            raise BlockingIOError
+        self.entregues.append(json.loads(dados))
+
+    def close(self):
+        pass
+
+
+async def test_worker_com_fila_cheia_recebe_resync(tmp_path, monkeypatch):
+    monkeypatch.setattr(invalidacao, "INVALIDACAO_RECONEXAO_S", 0)
+    (tmp_path / "outro.sock").touch()
+    worker = BarramentoSocket(str(tmp_path))
+    envio = _EnvioComFilaCheia(cheia=2)
+    worker._envio = envio
+
+    await worker.enviar(json.dumps({"entidade": "livro", "acao": "atualizado", "id": 1}))
+    # Enquanto o resync não sai, eventos avulsos não vão para o worker marcado.
+    await worker.enviar(json.dumps({"entidade": "livro", "acao": "atualizado", "id": 2}))
+    await asyncio.wait_for(worker._reenvio, 1)
+
+    assert [evento["acao"] for evento in envio.entregues] == ["resync"]
+    await worker.enviar(json.dumps({"entidade": "livro", "acao": "atualizado", "id": 3}))
+    assert envio.entregues[-1]["id"] == 3
@@ -0,0 +1,52 @@
+from datetime import date
+
+import pytest
+
+from app import benchmark_leitura
+from app.database import async_session
+from app.models import Pagamento, Pedido, PedidoLivroLink
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def pagina_cheia(dados):
+    # Página inteira de pedidos com livros e pagamento: uma consulta por linha estouraria o orçamento.
+    async with async_session() as session:
+        for i in range(10):
+            pedido = Pedido(usuario_id=dados["usuario"], data_pedido=date(2025, 7, i + 1), status="pago", valor_total=20)
+            session.add(pedido)
+            await session.flush()
+            session.add_all([PedidoLivroLink(pedido_id=pedido.id, livro_id=livro_id) for livro_id in dados["livros"]])
+            session.add(Pagamento(pedido_id=pedido.id, data_pagamento=pedido.data_pedido, valor=20, forma_pagamento="pix"))
+        await session.commit()
+    return dados
+
+
+@pytest.mark.parametrize("caminho, orcamento", [
+    ("/pedidos/", 3),
+    ("/pedidos/?incluir_arquivados=true", 3),
+    ("/pedidos/pedidos/{pedido}", 1),
+    ("/pagamentos/", 2),
+    ("/pagamentos/?incluir_arquivados=true", 2),
+    ("/livros/", 2),
+    ("/livros/livros/{livro}", 1),
+    ("/usuarios/", 2),
+    ("/usuarios/usuarios/{usuario}", 1),
+    ("/usuarios/{usuario}/pedidos", 3),
+    ("/autores/", 2),
+    ("/editoras/", 2),
+])
+async def test_orcamento_de_consultas(cliente, pagina_cheia, consultas, caminho, orcamento):
+    url = caminho.format(pedido=pagina_cheia["pedidos"][0], livro=pagina_cheia["livros"][0], usuario=pagina_cheia["usuario"])
+    consultas.clear()
+    resposta = await cliente.get(url)
+    assert resposta.status_code == 200, resposta.text
+    assert len(consultas) <= orcamento, consultas
+
+
+async def test_benchmark_de_leitura_no_banco_embutido(cliente, pagina_cheia):
+    # Os dois caminhos do benchmark devolvem a mesma página.
+    medicoes = await benchmark_leitura.medir("editoras", limit=10, repeticoes=2)
+    assert medicoes["orm"]["linhas"] == medicoes["leve"]["linhas"]
+    assert medicoes["orm"]["bytes"] == medicoes["leve"]["bytes"]
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import select
+
+from app.database import async_session
+from app.models import Pagamento
+
+pytestmark = pytest.mark.anyio
+
+
+def _pagamento(pedido_id, chave=None, valor=20):
+    return {
+        "pedido_id": pedido_id, "data_pagamento": "2025-06-10", "valor": valor,
+        "forma_pagamento": "pix", "chave_idempotencia": chave,
+    }
+
+
+async def _enviar(cliente, *pagamentos):
+    resposta = await cliente.post("/pagamentos/lote", json={"pagamentos": list(pagamentos)})
+    assert resposta.status_code == 200, resposta.text
+    corpo = resposta.json()
+    return corpo["criados"], corpo["atualizados"], corpo["ignorados"]
+
+
+async def test_lote_repetido_com_as_mesmas_chaves_nao_grava_de_novo(cliente, dados):
+    primeiro, segundo = dados["pedidos"]
+    lote = [_pagamento(primeiro, "a"), _pagamento(segundo, "b"), _pagamento(segundo, "b", valor=99)]
+    assert await _enviar(cliente, *lote) == (2, 0, 1)
+    assert await _enviar(cliente, *lote) == (0, 0, 3)
+
+    async with async_session() as session:
+        valores = (await session.execute(select(Pagamento.valor).where(Pagamento.pedido_id == segundo))).scalars()
+        assert list(valores) == [20]
+
+
+async def test_lote_sem_chave_faz_upsert(cliente, dados):
+    pedido = dados["pedidos"][0]
+    assert await _enviar(cliente, _pagamento(pedido)) == (1, 0, 0)
+    assert await _enviar(cliente, _pagamento(pedido)) == (0, 0, 1)
+    assert await _enviar(cliente, _pagamento(pedido, valor=30)) == (0, 1, 0)
+
+
+async def test_chave_de_pagamento_ignorado_continua_livre(cliente, dados):
+    assert await _enviar(cliente, _pagamento(9999, "c")) == (0, 0, 1)
+    assert await _enviar(cliente, _pagamento(dados["pedidos"][0], "c")) == (1, 0, 0)
+
+
+async def test_chave_de_item_substituido_no_bloco_continua_livre(cliente, dados):
+    pedido = dados["pedidos"][0]
+    assert await _enviar(cliente, _pagamento(pedido, "x"), _pagamento(pedido, "y", valor=30)) == (1, 0, 1)
+    assert await _enviar(cliente, _pagamento(pedido, "x", valor=40)) == (0, 1, 0)
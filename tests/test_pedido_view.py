@@ -0,0 +1,25 @@
+import pytest
+
+from app import pedido_view
+from app.database import async_session, engine
+from app.models import PedidoView
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_renomear_atualiza_a_view_sem_recalcular_pedidos(cliente, dados, monkeypatch):
+    monkeypatch.setattr(pedido_view, "BLOCO_SINCRONIZACAO", 1)
+    async with async_session() as session:
+        await pedido_view.sincronizar_pedidos(session, dados["pedidos"])
+        await session.commit()
+
+    resposta = await cliente.patch(f"/livros/{dados['livros'][1]}", json={"titulo": "Outro título"})
+    assert resposta.status_code == 200, resposta.text
+    resposta = await cliente.patch(f"/usuarios/{dados['usuario']}", json={"nome": "Ana Maria"})
+    assert resposta.status_code == 200, resposta.text
+
+    assert await pedido_view.verificar(engine) == []
+    async with async_session() as session:
+        view = await session.get(PedidoView, dados["pedidos"][0])
+    assert view.usuario_nome == "Ana Maria"
+    assert view.titulos == ["Livro 0", "Outro título"]
@@ -0,0 +1,39 @@
+from datetime import date
+
+import pytest
+
+from app.database import async_session
+from app.models import Livro, Pedido, PedidoLivroLink
+from app.recomendacoes import IndiceRecomendacoes, indice_recomendacoes
+
+pytestmark = pytest.mark.anyio
+
+
+def test_registrar_pedido_mantem_so_o_top_k():
+    indice = IndiceRecomendacoes(k=2)
+    indice.registrar_pedido(1, [10, 20, 30])
+    indice.registrar_pedido(2, [10, 30])
+    assert indice.recomendados(10, 5) == [(30, 2), (20, 1)]
+    # Lista cheia: o livro novo só entra na próxima reconstrução.
+    indice.registrar_pedido(3, [10, 40])
+    assert [id for id, _ in indice.recomendados(10, 5)] == [30, 20]
+
+
+async def test_recomendados_pela_rota(cliente, dados):
+    livro_a, livro_b = dados["livros"]
+    async with async_session() as session:
+        livro_c = Livro(titulo="Livro 2", preco=12, genero="ficcao")
+        session.add(livro_c)
+        await session.flush()
+        pedido = Pedido(usuario_id=dados["usuario"], data_pedido=date(2025, 6, 3), status="pendente", valor_total=10)
+        session.add(pedido)
+        await session.flush()
+        session.add_all([PedidoLivroLink(pedido_id=pedido.id, livro_id=id) for id in (livro_a, livro_c.id)])
+        await session.commit()
+    await indice_recomendacoes.reconstruir()
+
+    resposta = await cliente.get(f"/livros/{livro_a}/recomendados")
+    assert resposta.status_code == 200
+    assert [(item["id"], item["compras_em_comum"]) for item in resposta.json()] == [(livro_b, 2), (livro_c.id, 1)]
+    resposta = await cliente.get("/livros/9999/recomendados")
+    assert resposta.status_code == 404
@@ -0,0 +1,72 @@
+import msgpack
+import pytest
+
+from app.database import async_session
+from app.models import Livro, Pedido
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_deletar_com_dependentes(cliente, dados):
+    for caminho, parametro, id in [
+        ("/livros/", "livro_id", dados["livros"][0]),
+        ("/autores/", "autor_id", dados["autor"]),
+        ("/editoras/", "editora_id", dados["editora"]),
+        ("/usuarios/", "usuario_id", dados["usuario"]),
+    ]:
+        resposta = await cliente.delete(caminho, params={parametro: id})
+        assert resposta.status_code == 200, (caminho, resposta.text)
+
+    async with async_session() as session:
+        pedido = await session.get(Pedido, dados["pedidos"][0])
+        livro = await session.get(Livro, dados["livros"][1])
+        assert pedido.usuario_id is None
+        assert (livro.autor_id, livro.editora_id) == (None, None)
+
+
+async def test_lote_com_lista_vazia(cliente, dados):
+    resposta = await cliente.patch(
+        "/pagamentos/lote/forma-pagamento", json={"forma_pagamento": "boleto", "pedido_ids": []}
+    )
+    assert resposta.status_code == 422
+    resposta = await cliente.patch("/pedidos/lote/status", json={"status": "pago", "ids": []})
+    assert resposta.status_code == 422
+
+
+async def test_batch_recusa_stream(cliente, dados):
+    resposta = await cliente.post("/batch", json={"operacoes": [
+        {"id": "feed", "path": "/pedidos/eventos"},
+        {"id": "livro", "path": f"/livros/livros/{dados['livros'][0]}"},
+    ]})
+    assert resposta.status_code == 200
+    feed, livro = resposta.json()["resultados"]
+    assert feed["status"] == 400
+    assert livro["status"] == 200
+
+
+async def test_transicoes_de_status(cliente, dados):
+    pedido_id = dados["pedidos"][0]
+
+    resposta = await cliente.patch(f"/pedidos/{pedido_id}", json={"status": "entregue"})
+    assert resposta.status_code == 409
+    resposta = await cliente.patch(f"/pedidos/{pedido_id}", json={"status": "pago"})
+    assert resposta.status_code == 200
+    resposta = await cliente.patch(f"/pedidos/{pedido_id}", json={"status": "pendente"})
+    assert resposta.status_code == 409
+
+    resposta = await cliente.patch("/pedidos/lote/status", json={"status": "enviado", "ids": dados["pedidos"]})
+    assert resposta.status_code == 200
+    assert resposta.json()["ids"] == [pedido_id]
+
+
+async def test_msgpack_na_rota_e_dentro_do_batch(cliente, dados):
+    cabecalhos = {"accept": "application/msgpack"}
+    resposta = await cliente.get("/pedidos/contar", headers=cabecalhos)
+    assert resposta.headers["content-type"] == "application/msgpack"
+    esperado = msgpack.unpackb(resposta.content)
+
+    resposta = await cliente.post(
+        "/batch", json={"operacoes": [{"id": "a", "path": "/pedidos/contar"}]}, headers=cabecalhos
+    )
+    assert resposta.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(resposta.content)["resultados"][0]["body"] == esperado
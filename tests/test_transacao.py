@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from app import transacao
+from app.database import async_session
+from app.transacao import TRANSACAO_ESPERA_MAX_MS, TRANSACAO_TENTATIVAS, _espera, unidade_de_trabalho
+
+pytestmark = pytest.mark.anyio
+
+
+class _ErroBanco(Exception):
+    def __init__(self, sqlstate):
+        self.sqlstate = sqlstate
+
+
+def _erro(sqlstate):
+    return DBAPIError("UPDATE pedido ...", {}, _ErroBanco(sqlstate))
+
+
+@pytest.fixture
+def esperas(monkeypatch):
+    registradas = []
+
+    def esperar(tentativa):
+        registradas.append(tentativa)
+        return 0
+
+    monkeypatch.setattr(transacao, "_espera", esperar)
+    return registradas
+
+
+def _operacao(*erros):
+    chamadas = []
+
+    async def operacao():
+        chamadas.append(len(chamadas) + 1)
+        if len(chamadas) <= len(erros):
+            raise erros[len(chamadas) - 1]
+        return "ok"
+
+    return operacao, chamadas
+
+
+async def test_repete_conflito_transitorio_com_backoff(cliente, esperas):
+    operacao, chamadas = _operacao(_erro("40001"), _erro("40P01"))
+    async with async_session() as session:
+        assert await unidade_de_trabalho(session, operacao, "testar") == "ok"
+    assert chamadas == [1, 2, 3]
+    assert esperas == [1, 2]
+
+
+async def test_desiste_apos_as_tentativas(cliente, esperas):
+    operacao, chamadas = _operacao(*[_erro("40001")] * TRANSACAO_TENTATIVAS)
+    async with async_session() as session:
+        with pytest.raises(DBAPIError):
+            await unidade_de_trabalho(session, operacao, "testar")
+    assert len(chamadas) == TRANSACAO_TENTATIVAS
+
+
+async def test_erro_nao_transitorio_sobe_na_hora(cliente, esperas):
+    operacao, chamadas = _operacao(_erro("23505"))
+    async with async_session() as session:
+        with pytest.raises(DBAPIError):
+            await unidade_de_trabalho(session, operacao, "testar")
+    assert chamadas == [1]
+    assert esperas == []
+
+
+def test_espera_exponencial_limitada():
+    for tentativa in range(1, 12):
+        teto = min(TRANSACAO_ESPERA_MAX_MS, transacao.TRANSACAO_ESPERA_BASE_MS * 2 ** (tentativa - 1))
+        assert 0 <= _espera(tentativa) <= teto / 1000
+    assert max(_espera(30) for _ in range(200)) <= TRANSACAO_ESPERA_MAX_MS / 1000